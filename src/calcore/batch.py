@@ -0,0 +1,395 @@
+# -*- coding: ISO-8859-15 -*-
+# (C) Copyright 2005 Nuxeo SARL <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+# $Id$
+
+"""Expansion of many events into occurrences at once.
+
+Expanding events one by one runs a recurrence generator per event. Here
+events are grouped by their type of recurrence rule instead, and the
+occurrences of each group are computed together with array arithmetic
+on date ordinals. This needs NumPy; without it, or for rules the groups
+do not know about, events are expanded one by one.
+"""
+
+from datetime import date, datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from calcore import recurrent
+from calcore.cal import Occurrence
+
+# datetimes are handled as microseconds since the proleptic ordinal 0
+_DAY = 86400 * 1000000
+# NumPy datetime64 values count from 1970-01-01
+_EPOCH = date(1970, 1, 1).toordinal() * _DAY
+# count of a recurrence rule without count
+_NOCOUNT = 1 << 40
+# ordinals of dates up to 9999-12-31 fit in 22 bits
+_ORDINAL_BITS = 22
+
+class OccurrenceBatch:
+    """Occurrences of events, kept in columns.
+
+    starts, durations and positions give the start and duration of each
+    occurrence and the position in events of the event it is an
+    occurrence of. With NumPy they are datetime64, timedelta64 and
+    integer arrays, otherwise lists of datetimes, timedeltas and integers.
+    Occurrences are sorted on start, and only created when asked for.
+    """
+
+    def __init__(self, events, starts, durations, positions):
+        self.events = events
+        self.starts = starts
+        self.durations = durations
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, i):
+        start = self.starts[i]
+        duration = self.durations[i]
+        if numpy is not None:
+            start = start.item()
+            duration = duration.item()
+        return Occurrence(start, duration, self.events[self.positions[i]])
+
+    def __iter__(self):
+        for i in xrange(len(self.positions)):
+            yield self[i]
+
+def expandEvents(events, period):
+    """Return an OccurrenceBatch of the occurrences of events in period.
+
+    The period must be bounded.
+    """
+    events = list(events)
+    if numpy is None:
+        return _expandOneByOne(events, period)
+
+    begin = _micros(period[0])
+    end = _micros(period[1])
+    enddate = period[1].toordinal()
+    groups = {}
+    others = []
+    starts = []
+    times = []
+    durations = []
+    intervals = []
+    counts = []
+    lasts = []
+    exceptions = []
+    for position, event in enumerate(events):
+        dtstart = _micros(event.dtstart)
+        starts.append(dtstart // _DAY)
+        times.append(dtstart % _DAY)
+        durations.append(_timedeltaMicros(event.duration))
+        rule = event.recurrence
+        last = enddate
+        if rule is None:
+            expander = _expandSingle
+            intervals.append(1)
+            counts.append(1)
+        else:
+            expander = _getExpander(event)
+            intervals.append(rule.interval)
+            counts.append(_NOCOUNT if rule.count is None else rule.count)
+            if rule.until:
+                last = min(last, rule.until.toordinal())
+            for exception in rule.exceptions:
+                # NoRecurrenceRule ignores exceptions
+                if (expander is not _expandSingle and
+                    not isinstance(exception, datetime)):
+                    exceptions.append((position << _ORDINAL_BITS) +
+                                      exception.toordinal())
+        lasts.append(last)
+        if expander is None:
+            others.append(position)
+        else:
+            groups.setdefault(expander, []).append(position)
+
+    columns = {'start': numpy.array(starts, numpy.int64),
+               'time': numpy.array(times, numpy.int64),
+               'duration': numpy.array(durations, numpy.int64),
+               'interval': numpy.array(intervals, numpy.int64),
+               'count': numpy.array(counts, numpy.int64),
+               'last': numpy.array(lasts, numpy.int64)}
+    # occurrences starting on an earlier day end before the period
+    columns['first'] = (begin - columns['duration']) // _DAY
+
+    found_positions = []
+    found_ordinals = []
+    for expander, positions in groups.items():
+        positions, ordinals = expander(
+            numpy.array(positions, numpy.int64), columns, events)
+        found_positions.append(positions)
+        found_ordinals.append(ordinals)
+    positions = numpy.concatenate(
+        found_positions + [numpy.zeros(0, numpy.int64)])
+    ordinals = numpy.concatenate(
+        found_ordinals + [numpy.zeros(0, numpy.int64)])
+    if exceptions:
+        keys = (positions << _ORDINAL_BITS) + ordinals
+        keep = numpy.in1d(keys, numpy.array(exceptions, numpy.int64),
+                          invert=True)
+        positions = positions[keep]
+        ordinals = ordinals[keep]
+
+    result_starts = ordinals * _DAY + columns['time'][positions]
+    result_durations = columns['duration'][positions]
+    keep = ((result_starts < end) &
+            (result_starts + result_durations > begin))
+    result_starts = result_starts[keep]
+    result_durations = result_durations[keep]
+    positions = positions[keep]
+
+    if others:
+        other_batch = _expandOneByOne([events[position]
+                                       for position in others], period)
+        result_starts = numpy.concatenate(
+            [result_starts, numpy.array([_micros(start) for start
+                                         in other_batch.starts],
+                                        numpy.int64)])
+        result_durations = numpy.concatenate(
+            [result_durations,
+             numpy.array([_timedeltaMicros(duration) for duration
+                          in other_batch.durations], numpy.int64)])
+        positions = numpy.concatenate(
+            [positions, numpy.array(others, numpy.int64)[
+                numpy.array(other_batch.positions, numpy.int64)]])
+
+    order = numpy.lexsort((positions, result_starts))
+    return OccurrenceBatch(
+        events,
+        (result_starts[order] - _EPOCH).view('datetime64[us]'),
+        result_durations[order].view('timedelta64[us]'),
+        positions[order])
+
+def _expandOneByOne(events, period):
+    found = []
+    for position, event in enumerate(events):
+        for occurrence in event.expand(period):
+            found.append((occurrence.dtstart, position, occurrence.duration))
+    found.sort()
+    return OccurrenceBatch(events,
+                           [start for start, position, duration in found],
+                           [duration for start, position, duration in found],
+                           [position for start, position, duration in found])
+
+def _getExpander(event):
+    """Return the function expanding the group event belongs in.
+
+    Returns None if the event has to be expanded on its own. Rule
+    classes are matched exactly, as subclasses may recur differently.
+    """
+    rule = event.recurrence
+    klass = rule.__class__
+    if klass is recurrent.NoRecurrenceRule:
+        # only happens on the day it starts
+        return _expandSingle
+    if klass is recurrent.DailyRecurrenceRule:
+        return _expandDaily
+    if klass is recurrent.WeeklyRecurrenceRule:
+        return _expandWeekly
+    day = event.dtstart.day
+    if klass is recurrent.MonthlyRecurrenceRule:
+        if rule.monthly != 'monthday':
+            return _expandMonthlyWeekday
+        if day <= 28:
+            # every month has this day
+            return _expandMonthly
+    elif klass is recurrent.YearlyRecurrenceRule:
+        if event.dtstart.month != 2 or day != 29:
+            return _expandYearly
+    return None
+
+#
+# Expanders. These are given the positions of the events of a group and
+# the event columns, and return the positions and ordinals of occurrences
+# that may be in the period. Occurrences still need to be checked against
+# exceptions and the period.
+#
+
+def _expandSingle(positions, columns, events):
+    return positions, columns['start'][positions]
+
+def _expandDaily(positions, columns, events):
+    start = columns['start'][positions]
+    interval = columns['interval'][positions]
+    first = _ceildiv(columns['first'][positions] - start, interval)
+    last = numpy.minimum((columns['last'][positions] - start) // interval,
+                         columns['count'][positions] - 1)
+    rows, steps = _ranges(first, last)
+    return positions[rows], start[rows] + steps * interval[rows]
+
+def _expandWeekly(positions, columns, events):
+    # each weekday of each event recurs every interval weeks, so expand
+    # (event, weekday) pairs like daily recurrences
+    pair_positions = []
+    pair_weekdays = []
+    pair_offsets = []
+    pair_sizes = []
+    start_weekdays = []
+    for position in positions:
+        event = events[position]
+        start_weekday = event.dtstart.weekday()
+        weekdays = dict.fromkeys(event.recurrence.weekdays)
+        weekdays[start_weekday] = None
+        weekdays = weekdays.keys()
+        weekdays.sort()
+        # recurrences counted from start on, for weekdays in the first week
+        offset = -len([day for day in weekdays if day < start_weekday])
+        for day in weekdays:
+            pair_positions.append(position)
+            pair_weekdays.append(day)
+            pair_offsets.append(offset)
+            pair_sizes.append(len(weekdays))
+            start_weekdays.append(start_weekday)
+            offset += 1
+    positions = numpy.array(pair_positions, numpy.int64)
+    weekday = numpy.array(pair_weekdays, numpy.int64)
+    # the recurrence of weekday in week w counts w * size + offset
+    offset = numpy.array(pair_offsets, numpy.int64)
+    size = numpy.array(pair_sizes, numpy.int64)
+    start_weekday = numpy.array(start_weekdays, numpy.int64)
+    day = columns['start'][positions] - start_weekday + weekday
+    step = columns['interval'][positions] * 7
+    first = _ceildiv(columns['first'][positions] - day, step)
+    # weekdays before the start in the first week are not recurrences
+    first = numpy.maximum(first, weekday < start_weekday)
+    last = numpy.minimum((columns['last'][positions] - day) // step,
+                         (columns['count'][positions] - offset - 1) // size)
+    rows, weeks = _ranges(first, last)
+    return positions[rows], day[rows] + weeks * step[rows]
+
+def _expandMonthly(positions, columns, events):
+    return _expandMonths(positions, columns, events,
+                         columns['interval'][positions])
+
+def _expandYearly(positions, columns, events):
+    return _expandMonths(positions, columns, events,
+                         columns['interval'][positions] * 12)
+
+def _expandMonths(positions, columns, events, step):
+    start = columns['start'][positions]
+    months = numpy.array([events[position].dtstart.year * 12 +
+                          events[position].dtstart.month - 1
+                          for position in positions], numpy.int64)
+    days = start - _firstOrdinals(months)
+    rows, steps = _monthRanges(positions, columns, months, step)
+    ordinals = (_firstOrdinals(months[rows] + steps * step[rows]) +
+                days[rows])
+    return _checkRange(positions[rows], ordinals, columns)
+
+def _expandMonthlyWeekday(positions, columns, events):
+    months = []
+    indexes = []
+    weekdays = []
+    for position in positions:
+        start = events[position].dtstart
+        months.append(start.year * 12 + start.month - 1)
+        weekdays.append(start.weekday())
+        if events[position].recurrence.monthly == 'weekday':
+            indexes.append((start.day - 1) // 7 + 1)
+        else:
+            daysinmonth = recurrent.calendar.monthrange(start.year,
+                                                        start.month)[1]
+            # last weekdays are found counting back from the first
+            # weekday of the next month
+            indexes.append((start.day - daysinmonth - 1) // 7 + 1)
+            months[-1] += 1
+    months = numpy.array(months, numpy.int64)
+    index = numpy.array(indexes, numpy.int64)
+    weekday = numpy.array(weekdays, numpy.int64)
+    step = columns['interval'][positions]
+    # the fifth weekday may fall in the next month, last weekdays are
+    # found from months after their month
+    rows, steps = _monthRanges(positions, columns, months, step, 2)
+    ordinals = _firstOrdinals(months[rows] + steps * step[rows])
+    ordinals += (weekday[rows] - ordinals + 1) % 7
+    ordinals += (index[rows] - 1) * 7
+    return _checkRange(positions[rows], ordinals, columns)
+
+#
+# Helpers working on arrays
+#
+
+def _ceildiv(a, b):
+    """Divide a by b, rounding up. Never returns less than 0."""
+    return numpy.maximum(-(-a // b), 0)
+
+def _ranges(first, last):
+    """Return (rows, values) for all values from first to last per row.
+
+    rows gives the row each value belongs to.
+    """
+    sizes = numpy.maximum(last - first + 1, 0)
+    rows = numpy.repeat(numpy.arange(len(sizes)), sizes)
+    values = numpy.arange(sizes.sum())
+    values += numpy.repeat(first - (numpy.cumsum(sizes) - sizes), sizes)
+    return rows, values
+
+def _monthRanges(positions, columns, months, step, slack=0):
+    """Return (rows, steps) of months that may be in the period.
+
+    months are those of the first recurrences, each recurring every
+    step months. Recurrences may fall up to slack months before or after
+    their month.
+    """
+    firsts = _firstOrdinals(months)
+    # months have between 28 and 31 days
+    lower = -(-(columns['first'][positions] - firsts - 30) // 31) - slack
+    upper = (columns['last'][positions] - firsts) // 28 + slack
+    first = _ceildiv(lower, step)
+    last = numpy.minimum(upper // step, columns['count'][positions] - 1)
+    return _ranges(first, last)
+
+def _checkRange(positions, ordinals, columns):
+    keep = ((ordinals >= columns['first'][positions]) &
+            (ordinals <= columns['last'][positions]))
+    return positions[keep], ordinals[keep]
+
+_days_before_month = None
+if numpy is not None:
+    _days_before_month = numpy.array(recurrent._days_before_month[1:],
+                                     numpy.int64)
+
+def _firstOrdinals(months):
+    """Return the ordinals of the first days of months.
+
+    Months are counted from January of year 0.
+    """
+    year = months // 12
+    month = months % 12
+    y = year - 1
+    result = y * 365 + y // 4 - y // 100 + y // 400
+    result += _days_before_month[month] + 1
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    result += (month > 1) & leap
+    return result
+
+def _micros(dt):
+    return (dt.toordinal() * _DAY +
+            ((dt.hour * 60 + dt.minute) * 60 + dt.second) * 1000000 +
+            dt.microsecond)
+
+def _timedeltaMicros(td):
+    return (td.days * 86400 + td.seconds) * 1000000 + td.microseconds
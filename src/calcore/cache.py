@@ -0,0 +1,168 @@
+# -*- coding: ISO-8859-15 -*-
+# (C) Copyright 2005 Nuxeo SARL <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+# $Id$
+
+"""Caches of computed results.
+"""
+
+from threading import Lock
+
+# fields of the links in the list of entries
+_PREV, _NEXT, _KEY, _VALUE, _COST = range(5)
+
+class LRUCache:
+    """Keep values by key, dropping the least recently used ones.
+
+    Every value has a cost, its size in whatever unit fits the values.
+    The total cost is kept under maxcost by dropping the values used
+    least recently; ondrop, if given, is called with their keys. Hits
+    and misses are counted.
+    """
+
+    def __init__(self, maxcost=10000, ondrop=None):
+        self.maxcost = maxcost
+        self._ondrop = ondrop
+        self._lock = Lock()
+        self.clear()
+        self.resetStatistics()
+
+    # MANIPULATORS
+
+    def set(self, key, value, cost=1):
+        """Cache value for key, returning whether it was kept.
+
+        Values costing more than maxcost are not kept.
+        """
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is not None:
+                self._unlink(link)
+            if cost > self.maxcost:
+                return False
+            root = self._root
+            last = root[_PREV]
+            link = [last, root, key, value, cost]
+            last[_NEXT] = root[_PREV] = self._links[key] = link
+            self._cost += cost
+            dropped = self._shrink()
+        finally:
+            self._lock.release()
+        self._dropped(dropped)
+        return True
+
+    def invalidate(self, key):
+        """Remove the value of key. Unknown keys are ignored.
+        """
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is not None:
+                self._unlink(link)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            root = []
+            root[:] = [root, root, None, None, 0]
+            self._root = root
+            self._links = {}
+            self._cost = 0
+        finally:
+            self._lock.release()
+
+    def setMaxCost(self, maxcost):
+        self._lock.acquire()
+        try:
+            self.maxcost = maxcost
+            dropped = self._shrink()
+        finally:
+            self._lock.release()
+        self._dropped(dropped)
+
+    def resetStatistics(self):
+        self.hits = 0
+        self.misses = 0
+
+    # ACCESSORS
+
+    def get(self, key, default=None):
+        """Return the value of key, default if it is not cached.
+        """
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # move to the most recently used end
+            link[_PREV][_NEXT] = link[_NEXT]
+            link[_NEXT][_PREV] = link[_PREV]
+            root = self._root
+            last = root[_PREV]
+            link[_PREV] = last
+            link[_NEXT] = root
+            last[_NEXT] = root[_PREV] = link
+            return link[_VALUE]
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._links)
+
+    def has_key(self, key):
+        return self._links.has_key(key)
+
+    def getStatistics(self):
+        """Return a dictionary with hits, misses, entries, cost and maxcost.
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._links),
+                'cost': self._cost,
+                'maxcost': self.maxcost}
+
+    # PRIVATE
+
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+        del self._links[link[_KEY]]
+        self._cost -= link[_COST]
+
+    def _shrink(self):
+        """Drop least recently used values until under maxcost.
+
+        Returns the keys dropped.
+        """
+        dropped = []
+        root = self._root
+        while self._cost > self.maxcost and root[_NEXT] is not root:
+            link = root[_NEXT]
+            self._unlink(link)
+            dropped.append(link[_KEY])
+        return dropped
+
+    def _dropped(self, keys):
+        # called outside of the lock, ondrop may use the cache
+        if self._ondrop is not None:
+            for key in keys:
+                self._ondrop(key)
@@ -20,20 +20,41 @@
 from logging import getLogger
 from datetime import datetime, timedelta, date, time
 import socket # to get hostname
+import weakref
+from weakref import WeakKeyDictionary
+from heapq import heapify, heapreplace, heappop, heappush
+from itertools import islice
+from collections import deque
+from time import time as walltime
+from StringIO import StringIO
+from threading import Lock, local
 combine = datetime.combine
 from types import ListType, TupleType
 
 import icalendar
+from icalendar.parser import Contentline
+from icalendar.cal import types_factory
 from sets import Set
+from hashlib import sha1
 
-from calcore import util, recurrent
+try:
+    import transaction
+except ImportError:
+    # without ZODB, caches are only kept up to date by notifications
+    transaction = None
+
+from calcore import recurrent, index, cache
+from calcore.freebusy import FreeBusyMap
+from calcore.intervalset import IntervalSet, merge
 
 from zope.interface import implements
 from interfaces import IAttendee, IAttendeeSource,\
      IStorageManager, IStorage, IInvitableCalendarEvent, ICalendar,\
-     ISearchCriteria, ICalendarOccurrence, ITimed, IEventSpecification
+     ISearchCriteria, ICalendarOccurrence, ITimed, IEventSpecification,\
+     IEventEvent, IEventCreatedEvent, IEventModifiedEvent,\
+     IEventDeletedEvent, IEventParticipationChangeEvent, IEventBatchEvent
 from zope.schema.vocabulary import SimpleVocabulary, SimpleTerm
-from zope.event import notify
+from zope.event import notify, subscribers
 from events import *
 
 try:
@@ -44,6 +65,22 @@ _ = MessageFactory("calendar")
 
 _marker = object()
 
+class DoubleBookingError(Exception):
+    """An event books rooms already booked at the same time.
+
+    conflicts are the other events booking the rooms, in lists by room
+    id.
+    """
+
+    def __init__(self, event, conflicts):
+        Exception.__init__(self, "Event %s books %s at the same time as %s"
+                           % (event.unique_id, ', '.join(conflicts.keys()),
+                              ', '.join([other.unique_id for events in
+                                         conflicts.values()
+                                         for other in events])))
+        self.event = event
+        self.conflicts = conflicts
+
 class EventSpecification:
     """Structure used to pass around the specification of an event.
 
@@ -94,16 +131,18 @@ class EventSpecification:
                     modified = True
         if self.organizer is not None:
             o._setParticipationStatus(self.organizer, 'ACCEPTED')
-            o.setParticipationRole(self.organizer, 'REQ-PARTICIPANT')
+            o._setParticipationRole(self.organizer, 'REQ-PARTICIPANT')
             o._organizer_id = self.organizer.getAttendeeId()
         else:
             o._organizer_id = None
 
         if self.attendees:
             for (attendee, role, status) in self.attendees:
-                o.setParticipationRole(attendee, role)
+                o._setParticipationRole(attendee, role)
                 o._setParticipationStatus(attendee, status)
 
+        o._reindex()
+
     def willModify(self, o):
         """Checks is this specification would modify the object.
         """
@@ -142,15 +181,111 @@ class StorageManagerBase:
 
     def createEventFromSpecification(self, unique_id, spec):
         event = self._storage.createEvent(unique_id, spec)
-        notify(EventCreatedEvent(event))
+        self.notifyEvent(EventCreatedEvent(event))
         return event
 
     def deleteEvent(self, event):
         self._storage.deleteEvent(event)
-        notify(EventDeletedEvent(event))
+        self.notifyEvent(EventDeletedEvent(event))
+
+    def beginBatch(self):
+        """Buffer notifications and defer indexing until commitBatch.
+
+        Batches nest, only the outermost commitBatch ends the batch.
+        A batch belongs to the thread that began it, and to the storage
+        of the manager, so that events notify their participation
+        changes to it too.
+        """
+        batch = _batches.get(self._storage)
+        if batch is None:
+            batch = _Batch()
+            _batches.set(self._storage, batch)
+            self._storage.deferIndexing()
+        batch.depth += 1
+
+    def commitBatch(self):
+        """Index the events changed in the batch and notify the changes
+        at once.
+        """
+        batch = _batches.get(self._storage)
+        assert batch is not None, "commitBatch called outside of a batch"
+        batch.depth -= 1
+        if batch.depth:
+            return
+        _batches.set(self._storage, None)
+        batchevent = batch.getBatchEvent()
+        self._storage.commitIndexing()
+        if batchevent.events:
+            notify(batchevent)
+
+    def notifyEvent(self, eventevent):
+        """Notify eventevent, or keep it for the batch if there is one.
+        """
+        batch = _batches.get(self._storage)
+        if batch is None:
+            notify(eventevent)
+            return
+        batch.add(eventevent)
+        if IEventModifiedEvent.providedBy(eventevent):
+            # what reindexSubscriber does, while indexing is deferred
+            eventevent.event._reindex()
+
+    def enableQueryCache(self, max_results=10000):
+        """Cache the results of getEvents and getOccurrences(Segmented).
+
+        At most max_results events and occurrences are kept.
+        """
+        # volatile, persistent storage managers do not keep it
+        self._v_query_cache = QueryCache(max_results)
+
+    def disableQueryCache(self):
+        self._v_query_cache = None
+
+    def enableBusyIndex(self, horizon=(timedelta(days=-30),
+                                       timedelta(days=365))):
+        """Keep the busy periods of attendees within horizon of today.
+
+        getBlockedPeriods and getFreePeriods read them from the index
+        when the period asked for is within the horizon.
+        """
+        # volatile, persistent storage managers do not keep it
+        self._v_busy_index = BusyIndex(self, horizon)
+
+    def disableBusyIndex(self):
+        self._v_busy_index = None
+
+    def setConflictPolicy(self, policy):
+        self._storage.setConflictPolicy(policy)
 
     # ACCESSORS
 
+    def getQueryCache(self):
+        """Return the QueryCache in use, None if results are not cached.
+        """
+        return getattr(self, '_v_query_cache', None)
+
+    def getBusyIndex(self):
+        """Return the BusyIndex in use, None if there is none.
+        """
+        return getattr(self, '_v_busy_index', None)
+
+    def _getUpToDateBusyIndex(self):
+        # the busy index is only updated at the end of a batch
+        if _batches.get(self._storage) is not None:
+            return None
+        return self.getBusyIndex()
+
+    def getConflictPolicy(self):
+        return self._storage.getConflictPolicy()
+
+    def getConflicts(self, event, attendees=None):
+        if attendees is None:
+            attendee_ids = _getBlockedAttendeeIds(event)
+        else:
+            attendee_ids = [attendee.getAttendeeId()
+                            for attendee in attendees]
+        return self._storage.getConflicts(event, attendee_ids)
+
     def getEvent(self, event_id):
         return self._storage.getEvent(event_id)
 
@@ -162,87 +297,300 @@ class StorageManagerBase:
             return False
 
     def getEvents(self, period, search_criteria=None):
-        return self._storage.getEvents(period, search_criteria)
+        return self._cachedQuery('getEvents', period, search_criteria,
+                                 self._storage.getEvents)
 
     def getOccurrences(self, period, search_criteria=None):
-        return self._storage.getOccurrences(period, search_criteria)
+        return self._cachedQuery('getOccurrences', period, search_criteria,
+                                 self._storage.getOccurrences)
+
+    def iterOccurrences(self, period, search_criteria=None):
+        return self._storage.iterOccurrences(period, search_criteria)
+
+    def getOccurrenceBatch(self, period, search_criteria=None):
+        return self._storage.getOccurrenceBatch(period, search_criteria)
+
+    def getUpcomingOccurrences(self, after, limit, search_criteria=None):
+        return list(islice(
+            self._storage.iterUpcomingOccurrences(after, search_criteria),
+            limit))
+
+    def getUpcomingOccurrencesPage(self, after, limit, search_criteria=None,
+                                   cursor=None):
+        if cursor is None:
+            occurrences = self._storage.iterUpcomingOccurrences(
+                after, search_criteria)
+        else:
+            # continue from the last occurrence returned; those still
+            # going on then are found again and skipped
+            occurrences = self._storage.iterUpcomingOccurrences(
+                max(after, cursor[0] - timedelta.resolution),
+                search_criteria)
+            occurrences = _skipUntil(occurrences, cursor)
+        result = list(islice(occurrences, limit))
+        if len(result) < limit:
+            return result, None
+        last = result[-1]
+        return result, (last.dtstart, last.original.unique_id)
 
     def getOccurrencesSegmented(self, period, search_criteria=None):
+        return self._cachedQuery('getOccurrencesSegmented', period,
+                                 search_criteria,
+                                 self._getOccurrencesSegmented)
+
+    def explain(self, period, search_criteria=None):
+        return self._storage.explain(period, search_criteria)
+
+    def _getOccurrencesSegmented(self, period, search_criteria):
         return segmentOccurrences(period,
                                   self.getOccurrences(period, search_criteria))
 
+    def _cachedQuery(self, name, period, search_criteria, query):
+        query_cache = self.getQueryCache()
+        if query_cache is None or _batches.get(self._storage) is not None:
+            # results are only dropped at the end of a batch
+            return query(period, search_criteria)
+        if search_criteria is None:
+            search_criteria = NullSearchCriteria()
+        key = (name, tuple(period), search_criteria.getKey())
+        result = query_cache.get(key)
+        if result is None:
+            result = query(period, search_criteria)
+            query_cache.set(key, result, period, search_criteria)
+        return list(result)
+
     def getBlockedPeriods(self, attendees, period, time_period):
         # XXX need to check for events that an attendee is interested
         # in, but not actively participating
-        blocked_periods = {}
         begins, ends = period
         time_begins, time_ends = time_period
-        for attendee in attendees:
-            search_criteria = SearchCriteria(attendees=[attendee])
-            for occ in self.getOccurrencesSegmented(period, search_criteria):
-                # transparent or canceled events don't count
-                if (occ.original.transparent or
-                    occ.original.status == 'CANCELED'):
-                    continue
-                # And neither does events you are not going to:
-                if (occ.original.getParticipationStatus(attendee) in
-                    ['DECLINED', 'DELEGATED']):
-                    continue
-                dtstart = occ.dtstart
-                dtend = dtstart + occ.duration
-                if dtend < begins:
-                    continue
-                if dtstart >= ends:
-                    continue
-                day_start = combine(dtstart.date(), time_begins)
-                if dtstart < day_start:
-                    dtstart = day_start
-                # since we're segmenting occurrences, this is safe
-                day_end = combine(dtstart.date(), time_ends)
-                if dtend >= day_end:
-                    dtend = day_end
-                blocked_periods[(dtstart, dtend)] = None
-        blocked_periods = blocked_periods.keys()
+        busy_index = self._getUpToDateBusyIndex()
+        if busy_index is not None and busy_index.covers(period):
+            # the periods outside of time_period are blocked below
+            blocked_periods = busy_index.getBusyPeriods(
+                [attendee.getAttendeeId() for attendee in attendees],
+                period)
+        else:
+            blocked_periods = self._getBlockedPeriods(
+                attendees, period, time_period)
         # also block all periods outside time_period
-        d = begins.date()
-        end_d = ends.date()
-        if ends.time() == time(0, 0):
-            end_d -= timedelta(days=1)
-        while d <= end_d:
-            blocked_periods.append((combine(d, time(0, 0)),
-                                    combine(d, time_begins)))
-            next_day = d + timedelta(days=1)
-            blocked_periods.append((combine(d, time_ends),
-                                    combine(next_day, time(0, 0))))
-            d = next_day
-        return util.removeOverlaps(blocked_periods)
+        blocked_periods = IntervalSet(blocked_periods).union(
+            _getNonWorkingPeriods(period, time_period))
+        return blocked_periods.getPeriods()
 
+    def _getBlockedPeriods(self, attendees, period, time_period):
+        blocked_periods = {}
+        begins, ends = period
+        time_begins, time_ends = time_period
+        # get the events of all attendees at once, each event blocks the
+        # periods of its occurrences if it blocks any of the attendees
+        attendees = list(attendees)
+        search_criteria = SearchCriteria(attendees=attendees)
+        blocking = {}
+        for occ in self.getOccurrencesSegmented(period, search_criteria):
+            event = occ.original
+            blocks = blocking.get(event.unique_id)
+            if blocks is None:
+                blocks = bool(_getBlockedAttendees(event, attendees))
+                blocking[event.unique_id] = blocks
+            if not blocks:
+                continue
+            dtstart = occ.dtstart
+            dtend = dtstart + occ.duration
+            if dtend < begins:
+                continue
+            if dtstart >= ends:
+                continue
+            day_start = combine(dtstart.date(), time_begins)
+            if dtstart < day_start:
+                dtstart = day_start
+            # since we're segmenting occurrences, this is safe
+            day_end = combine(dtstart.date(), time_ends)
+            if dtend >= day_end:
+                dtend = day_end
+            blocked_periods[(dtstart, dtend)] = None
+        return blocked_periods.keys()
+
+    def _getBusyPeriods(self, attendees, period):
+        """Return the IntervalSet of the time any of attendees is busy.
+        """
+        attendees = list(attendees)
+        busy_index = self._getUpToDateBusyIndex()
+        if busy_index is not None and busy_index.covers(period):
+            return IntervalSet(busy_index.getBusyPeriods(
+                [attendee.getAttendeeId() for attendee in attendees],
+                period), True)
+        begins, ends = period
+        search_criteria = SearchCriteria(attendees=attendees)
+        busy = []
+        blocking = {}
+        for occ in self.getOccurrences(period, search_criteria):
+            event = occ.original
+            blocks = blocking.get(event.unique_id)
+            if blocks is None:
+                blocks = bool(_getBlockedAttendees(event, attendees))
+                blocking[event.unique_id] = blocks
+            if blocks:
+                busy.append((max(occ.dtstart, begins),
+                             min(occ.dtstart + occ.duration, ends)))
+        return IntervalSet(busy)
+
+    def getFreeBusyMap(self, attendees, period,
+                       granularity=timedelta(minutes=15)):
+        freebusy = FreeBusyMap(period, granularity)
+        busy = self._getBusyPeriodsByAttendee(attendees, period)
+        for attendee_id, periods in busy.items():
+            for busy_period in periods:
+                freebusy.addBusy(attendee_id, busy_period)
+        return freebusy
+
+    def _getBusyPeriodsByAttendee(self, attendees, period):
+        """Return the periods each of attendees is busy in, by id.
+        """
+        attendees = list(attendees)
+        busy_index = self._getUpToDateBusyIndex()
+        if busy_index is not None and busy_index.covers(period):
+            busy = {}
+            for attendee in attendees:
+                attendee_id = attendee.getAttendeeId()
+                busy[attendee_id] = busy_index.getBusyPeriods(
+                    [attendee_id], period)
+            return busy
+        # one query for all attendees, each occurrence marks the
+        # attendees it blocks as busy
+        begins, ends = period
+        search_criteria = SearchCriteria(attendees=attendees)
+        attendee_ids = dict.fromkeys(
+            [attendee.getAttendeeId() for attendee in attendees])
+        busy = {}
+        blocking = {}
+        for occ in self.getOccurrences(period, search_criteria):
+            event = occ.original
+            blocked = blocking.get(event.unique_id)
+            if blocked is None:
+                # events have few attendees, there may be many asked for
+                blocked = [attendee_id for attendee_id
+                           in _getBlockedAttendeeIds(event)
+                           if attendee_ids.has_key(attendee_id)]
+                blocking[event.unique_id] = blocked
+            busy_period = (max(occ.dtstart, begins),
+                           min(occ.dtstart + occ.duration, ends))
+            for attendee_id in blocked:
+                busy.setdefault(attendee_id, []).append(busy_period)
+        return busy
 
     def getFreePeriods(self, attendees, period, time_period,
-                     minimal_duration=None):
+                     minimal_duration=None, granularity=None):
+        if granularity is not None:
+            attendees = list(attendees)
+            freebusy = self.getFreeBusyMap(attendees, period, granularity)
+            return freebusy.getFreePeriods(
+                [attendee.getAttendeeId() for attendee in attendees],
+                time_period, minimal_duration)
         blocked_periods = self.getBlockedPeriods(
             attendees, period, time_period)
-        begins, ends = period
+        return _getFreePeriods(blocked_periods, period, time_period,
+                               minimal_duration)
+
+    def getFreePeriodsByAttendee(self, attendees, period, time_period,
+                                 minimal_duration=None):
+        # the events of all attendees are looked at once
+        attendees = list(attendees)
+        busy = self._getBusyPeriodsByAttendee(attendees, period)
+        non_working = _getNonWorkingPeriods(period, time_period)
+        result = {}
+        for attendee in attendees:
+            attendee_id = attendee.getAttendeeId()
+            blocked_periods = non_working.union(busy.get(attendee_id, ()))
+            result[attendee_id] = _getFreePeriods(
+                blocked_periods, period, time_period, minimal_duration)
+        return result
+
+    def findAvailableSlots(self, attendees, duration, search_from,
+                           time_period, limit=1, max_days=366, rooms=None):
         time_begins, time_ends = time_period
-        # now find out any unblocked periods
-        free_periods = []
-        if begins < combine(begins.date(), time_begins):
-            begins = combine(begins.date(), time_begins)
-        if ends > combine(ends.date(), time_ends):
-            ends = combine(ends.date(), time_ends)
-
-        last_block_begins = begins
-        for dtstart, dtend in blocked_periods:
-            if dtstart.time() >= time_begins and last_block_begins != dtstart:
-                if (minimal_duration is None or
-                    (dtstart - last_block_begins) >= minimal_duration):
-                    free_periods.append((last_block_begins, dtstart))
-            last_block_begins = dtend
-        if last_block_begins != ends:
-            if (minimal_duration is None or
-                (ends - last_block_begins) >= minimal_duration):
-                free_periods.append((last_block_begins, ends))
-        return free_periods
+        day = search_from.date()
+        if (combine(day, time_ends) - combine(day, time_begins) <
+            duration):
+            # no day has room for it
+            return []
+        attendees = list(attendees)
+        if rooms is not None:
+            rooms = list(rooms)
+        horizon_ends = combine(day + timedelta(days=max_days), time(0, 0))
+        slots = []
+        begins = search_from
+        days = _SLOT_SEARCH_DAYS
+        while begins < horizon_ends and len(slots) < limit:
+            # windows end at midnight, which is never working time, and
+            # double each time so near slots are found from a few days
+            ends = min(combine(begins.date() + timedelta(days=days),
+                               time(0, 0)), horizon_ends)
+            window = (begins, ends)
+            blocked = self._getBusyPeriods(attendees, window).union(
+                _getNonWorkingPeriods(window, time_period))
+            if rooms is not None:
+                busy = self._getBusyPeriodsByAttendee(rooms, window)
+                room_busy = [
+                    (room, IntervalSet(busy.get(room.getAttendeeId(), ())))
+                    for room in rooms]
+            for dtstart, dtend in blocked.complement(window):
+                # the slots follow each other through each free period
+                slot_start = dtstart
+                while (slot_start + duration <= dtend and
+                       len(slots) < limit):
+                    slot = (slot_start, slot_start + duration)
+                    if rooms is None:
+                        slots.append(slot)
+                        slot_start += duration
+                        continue
+                    room, next_start = _findFreeRoom(room_busy, slot)
+                    if room is None:
+                        slot_start = next_start
+                    else:
+                        slots.append(slot + (room,))
+                        slot_start += duration
+                if len(slots) >= limit:
+                    break
+            begins = ends
+            days *= 2
+        return slots
+
+    def findRecurringSlots(self, rule, duration, attendees, horizon,
+                           time_period, fraction=1.0,
+                           granularity=timedelta(minutes=30)):
+        time_begins, time_ends = time_period
+        begins, ends = horizon
+        first_day = begins.date()
+        weekdays = getattr(rule, 'weekdays', None)
+        if weekdays:
+            # the first day is a recurrence whatever its day of the week
+            while first_day.weekday() not in weekdays:
+                first_day += timedelta(days=1)
+        # the dates are the same whatever the time of day
+        dates = list(rule.apply(Timed(combine(first_day, time_begins),
+                                      duration), ends.date()))
+        busy = self._getBusyPeriods(attendees, horizon)
+        result = []
+        t = combine(first_day, time_begins)
+        last_t = combine(first_day, time_ends) - duration
+        while t <= last_t:
+            starts = []
+            conflicts = 0
+            for d in dates:
+                dtstart = combine(d, t.time())
+                dtend = dtstart + duration
+                if dtstart < begins or dtend > ends:
+                    continue
+                starts.append(dtstart)
+                if busy.overlaps((dtstart, dtend)):
+                    conflicts += 1
+            if starts and len(starts) - conflicts >= fraction * len(starts):
+                result.append((conflicts, starts[0]))
+            t += granularity
+        result.sort()
+        return [(start, conflicts) for conflicts, start in result]
+
 
 class StorageManager(StorageManagerBase):
     pass
@@ -252,14 +600,34 @@ class StorageBase:
     """
     implements(IStorage)
 
+    _logger = getLogger('calcore.StorageBase')
+
+    # storages created before indexing existed have no indexes
+    _indexes = {}
+    # how double bookings of rooms are handled, see setConflictPolicy
+    _conflict_policy = None
+
     def __init__(self, storage_id, hostname=None):
         self._storage_id = storage_id
         self._events = self._initEvents()
+        self._indexes = self._initIndexes()
         self._hostname = hostname or socket.getfqdn()
 
     def _initEvents(self):
         raise NotImplementedError
 
+    def _initIndexes(self):
+        """Return the indexes to keep, by name.
+
+        The names are those of _index_values. There is no period index
+        by default, so period queries scan all events.
+        """
+        return {'attendee': index.KeywordIndex(),
+                'status': index.KeywordIndex(),
+                'role': index.KeywordIndex(),
+                'organizer': index.KeywordIndex(),
+                'category': index.KeywordIndex()}
+
     def _eventFactory(self, event_id, spec):
         raise NotImplementedError
 
@@ -270,48 +638,315 @@ class StorageBase:
                 '%s-%s' %
                 (self._storage_id, len(self._events)), self._hostname)
         event = self._eventFactory(unique_id, spec)
+        attendees = [spec.organizer] + [attendee for attendee, role, status
+                                        in spec.attendees or ()]
+        blocked_ids = _getBlockedAttendeeIds(event)
+        for room in self.checkConflicts(
+            event, [attendee for attendee in attendees if attendee is not None
+                    and attendee.getAttendeeId() in blocked_ids]):
+            event._setParticipationStatus(room, 'DECLINED')
         self._events[unique_id] = event
+        event.__parent__ = self
+        self.indexEvent(event)
         return event
 
     def deleteEvent(self, event):
+        self.unindexEvent(event)
         del self._events[event.unique_id]
+        event.__parent__ = None
+
+    def indexEvent(self, event, idxs=None):
+        """Index event, in all indexes or only in those named in idxs.
+        """
+        deferred = _deferred.get(self)
+        if deferred is not None:
+            # all indexes are updated on commitIndexing
+            deferred[event.unique_id] = None
+            return
+        self._indexEventNow(event, idxs)
+
+    def _indexEventNow(self, event, idxs=None):
+        event_id = event.unique_id
+        for name, idx in self._indexes.items():
+            if idxs is not None and name not in idxs:
+                continue
+            idx.index(event_id, _index_values[name](event))
+
+    def unindexEvent(self, event):
+        event_id = event.unique_id
+        deferred = _deferred.get(self)
+        if deferred is not None:
+            deferred.pop(event_id, None)
+        for idx in self._indexes.values():
+            idx.unindex(event_id)
+
+    def reindexEvent(self, event, idxs=None):
+        self.indexEvent(event, idxs)
+
+    def deferIndexing(self):
+        """Only keep track of the events to index until commitIndexing.
+
+        Indexing is deferred for the calling thread only.
+        """
+        if _deferred.get(self) is None:
+            _deferred.set(self, {})
+
+    def commitIndexing(self):
+        """Index the events whose indexing was deferred.
+        """
+        self._indexDeferred()
+        _deferred.set(self, None)
+
+    def _indexDeferred(self):
+        deferred = _deferred.get(self)
+        if not deferred:
+            return
+        # events changed while indexing them are deferred again
+        _deferred.set(self, {})
+        for event_id in deferred:
+            event = self._events.get(event_id)
+            if event is not None:
+                self._indexEventNow(event)
+
+    def _getIndexes(self):
+        """Return the indexes to search, indexing the events whose
+        indexing was deferred first.
+        """
+        self._indexDeferred()
+        return self._indexes
+
+    def setConflictPolicy(self, policy):
+        if policy not in _conflict_policies:
+            raise ValueError("Conflict policy must be one of %s (got %r)"
+                             % (', '.join(map(repr, _conflict_policies)),
+                                policy))
+        self._conflict_policy = policy
+
+    def checkConflicts(self, event, attendees):
+        """Apply the conflict policy to the rooms among attendees of event.
+
+        Returns the rooms to decline.
+        """
+        policy = self._conflict_policy
+        if policy is None or event.transparent or event.status == 'CANCELED':
+            return []
+        rooms = {}
+        for attendee in attendees:
+            if attendee.getAttendeeType() == 'ROOM':
+                rooms[attendee.getAttendeeId()] = attendee
+        if not rooms:
+            return []
+        conflicts = self.getConflicts(event, rooms.keys())
+        if not conflicts:
+            return []
+        if policy == 'reject':
+            raise DoubleBookingError(event, conflicts)
+        if policy == 'warn':
+            self._logger.warning(str(DoubleBookingError(event, conflicts)))
+            return []
+        return [rooms[attendee_id] for attendee_id in conflicts.keys()]
 
     # ACCESSORS
 
     def getStorageId(self):
         return self._storage_id
 
+    def getConflictPolicy(self):
+        return self._conflict_policy
+
+    def getConflicts(self, event, attendee_ids):
+        span = getOccurrencesSpan(event)
+        result = {}
+        for attendee_id in attendee_ids:
+            conflicts = []
+            for other in self._getBlockingEvents(attendee_id, span):
+                if other.unique_id == event.unique_id:
+                    continue
+                if _occurrencesOverlap(event, other):
+                    conflicts.append(other)
+            if conflicts:
+                result[attendee_id] = conflicts
+        return result
+
     def getEvent(self, event_id):
         return self._events[event_id]
 
     def getEvents(self, period, search_criteria):
-        events = self._getMatchingEvents(search_criteria)
+        events = self._getMatchingEvents(search_criteria, period)
         return [event for event in events if inPeriod(event, period)]
 
     def getOccurrences(self, period, search_criteria):
         assertPeriodBounded(period)
-        events = self._getMatchingEvents(search_criteria)
+        events = self._getMatchingEvents(search_criteria, period)
         result = []
         for event in events:
             result.extend(event.expand(period))
         return result
 
+    def iterOccurrences(self, period, search_criteria):
+        assertPeriodBounded(period)
+        events = self._getMatchingEvents(search_criteria, period)
+        return mergeOccurrences([event.iterExpand(period)
+                                 for event in events])
+
+    def iterUpcomingOccurrences(self, after, search_criteria):
+        events = self._getMatchingEvents(search_criteria, (after, None))
+        return _mergeUpcoming(events, (after, None))
+
+    def getOccurrenceBatch(self, period, search_criteria):
+        # batch imports Occurrence from this module
+        from calcore.batch import expandEvents
+        assertPeriodBounded(period)
+        return expandEvents(self._getMatchingEvents(search_criteria, period),
+                            period)
+
+    def explain(self, period, search_criteria=None):
+        """Report how events in period matching search_criteria are found.
+        """
+        begin = walltime()
+        stages = []
+        events = self._getMatchingEvents(search_criteria, period, stages)
+        if period[0] is not None and period[1] is not None:
+            stage_begin = walltime()
+            count = 0
+            for event in events:
+                count += len(event.expand(period))
+            stages.append(_explainStage('expand', None, count, stage_begin))
+        return {'events': len(self._events),
+                'plan': [stage['index'] for stage in stages],
+                'stages': stages,
+                'time': walltime() - begin}
+
     # PRIVATE
 
-    def _getMatchingEvents(self, search_criteria):
+    def _getBlockingEvents(self, attendee_id, period):
+        """Return the events blocking attendee_id, among which those
+        with occurrences in period.
+        """
+        indexes = self._getIndexes()
+        busy = indexes.get('busy')
+        if busy is not None:
+            event_ids = busy.search(attendee_id, period)
+        else:
+            attendee_index = indexes.get('attendee')
+            if attendee_index is not None:
+                event_ids = attendee_index.search(attendee_id)
+            else:
+                event_ids = self._events.keys()
+            event_ids = [event_id for event_id in event_ids
+                         if attendee_id in _getBlockedAttendeeIds(
+                             self._events[event_id])]
+        return [self._events[event_id] for event_id in event_ids]
+
+    def _getMatchingEvents(self, search_criteria, period=(None, None),
+                           report=None):
         if search_criteria is None:
             search_criteria = NullSearchCriteria()
 
+        event_ids = self._getCandidateIds(search_criteria, period, report)
+        if report is not None:
+            begin = walltime()
+        if event_ids is None:
+            events = self._events.values()
+        else:
+            events = [self._events[event_id] for event_id in event_ids]
         result = []
-        for event in self._events.values():
+        for event in events:
             if search_criteria._match(event):
                 result.append(event)
+        if report is not None:
+            if event_ids is None:
+                name = 'scan'
+            else:
+                name = 'match'
+            report.append(_explainStage(name, len(events), len(result), begin))
         return result
 
+    def _getCandidateIds(self, search_criteria, period, report=None):
+        """Return ids of the events that may match, using the indexes.
+
+        The indexes to use are ordered by the number of events they are
+        estimated to return. The first one is searched, the candidates
+        found are then filtered through the others.
+
+        Returns None if the indexes cannot narrow down the search, in
+        which case all events need to be checked.
+        """
+        plan = self._planSearch(search_criteria, period)
+        if not plan:
+            return None
+        result = None
+        for estimate, name, search_ids, filter_ids in plan:
+            if report is not None:
+                begin = walltime()
+            if result is None:
+                result = search_ids()
+            else:
+                result = filter_ids(result)
+            if report is not None:
+                report.append(_explainStage(name, estimate, len(result), begin))
+            if not result:
+                break
+        return result
+
+    def _planSearch(self, search_criteria, period):
+        """Return the index stages that can be used, cheapest first.
+
+        Stages are (estimate, index name, search, filter) tuples.
+        search() returns the ids found in the index, filter(ids) returns
+        those of ids that the index would have found.
+        """
+        plan = []
+        indexes = self._getIndexes()
+        if period != (None, None) and indexes.has_key('period'):
+            idx = indexes['period']
+            plan.append((idx.count(period), 'period',
+                         lambda idx=idx: idx.search(period),
+                         lambda ids, idx=idx: idx.filter(ids, period)))
+
+        keywords = []
+        if search_criteria.categories is not None:
+            keywords.append(('category', search_criteria.categories))
+        if search_criteria.organizer is not None:
+            keywords.append(('organizer',
+                             [search_criteria.organizer.getAttendeeId()]))
+        if search_criteria.attendees is not None:
+            attendee_ids = [attendee.getAttendeeId()
+                            for attendee in search_criteria.attendees]
+            status = search_criteria.participation_status
+            role = search_criteria.participation_role
+            # with both a status and a role, these may be of different
+            # attendees, but _match will weed those out
+            if status is not None:
+                keywords.append(('status', [(attendee_id, status)
+                                            for attendee_id in attendee_ids]))
+            if role is not None:
+                keywords.append(('role', [(attendee_id, role)
+                                          for attendee_id in attendee_ids]))
+            if status is None and role is None:
+                keywords.append(('attendee', attendee_ids))
+
+        for name, values in keywords:
+            if not indexes.has_key(name):
+                continue
+            idx = indexes[name]
+            plan.append((idx.countAny(values), name,
+                         lambda idx=idx, values=values: idx.searchAny(values),
+                         lambda ids, idx=idx, values=values:
+                             idx.filterAny(ids, values)))
+        plan.sort()
+        return plan
+
 class MemoryStorage(StorageBase):
     def _initEvents(self):
         return {}
 
+    def _initIndexes(self):
+        indexes = StorageBase._initIndexes(self)
+        indexes['period'] = index.PeriodIndex()
+        indexes['busy'] = index.KeywordPeriodIndex()
+        return indexes
+
     def _eventFactory(self, event_id, spec):
         return Event(event_id, spec)
 
@@ -347,6 +982,21 @@ class SearchCriteria:
         return SearchCriteria(attendees, participation_status,
                               participation_role, categories, organizer)
 
+    def getKey(self):
+        """See ISearchCriteria"""
+        attendees = self.attendees
+        if attendees is not None:
+            attendees = frozenset([attendee.getAttendeeId()
+                                   for attendee in attendees])
+        categories = self.categories
+        if categories is not None:
+            categories = frozenset(categories)
+        organizer = self.organizer
+        if organizer is not None:
+            organizer = organizer.getAttendeeId()
+        return (attendees, self.participation_status,
+                self.participation_role, categories, organizer)
+
     # this method is not part of ISearchCriteria, as other storages may
     # implement altogether different ways to fetch relevant events.
     def _match(self, event):
@@ -361,10 +1011,18 @@ class SearchCriteria:
             event.getOrganizerId() != self.organizer.getAttendeeId()):
             return False
 
-        if self.attendees is None:
+        attendees = self.attendees
+        if attendees is None:
             return True
 
-        for attendee in self.attendees:
+        attendee_ids = event.getAttendeeIds()
+        if len(attendees) > len(attendee_ids):
+            # only look at those attendees that are in the event
+            by_id = self._getAttendeesById()
+            attendees = [by_id[attendee_id] for attendee_id in attendee_ids
+                         if by_id.has_key(attendee_id)]
+
+        for attendee in attendees:
             if not event.hasAttendee(attendee):
                 continue
 
@@ -384,6 +1042,17 @@ class SearchCriteria:
         # No attendee matched
         return False
 
+    def _getAttendeesById(self):
+        # kept while matching events, until attendees are replaced
+        attendees = self.attendees
+        cached = getattr(self, '_attendees_by_id', None)
+        if cached is None or cached[0] is not attendees:
+            by_id = {}
+            for attendee in attendees:
+                by_id[attendee.getAttendeeId()] = attendee
+            cached = self._attendees_by_id = (attendees, by_id)
+        return cached[1]
+
 
 class NullSearchCriteria(SearchCriteria):
     def __init__(self):
@@ -392,6 +1061,14 @@ class NullSearchCriteria(SearchCriteria):
 class EventBase:
     implements(IInvitableCalendarEvent)
 
+    # end of the last occurrence, computed when needed
+    _v_series_end = None
+    # fingerprints of the VEVENT last imported as this event and of
+    # the event as it was imported, see _getImportState
+    _import_fingerprint = None
+    # the storage keeping the event, set when it is stored there
+    __parent__ = None
+
     def __init__(self, unique_id, spec):
         self.unique_id = unique_id
         self._participation_state = self._initParticipationState()
@@ -411,10 +1088,25 @@ class EventBase:
     # MANIPULATORS
 
     def invite(self, attendees):
+        attendees = [attendee for attendee in attendees
+                     if self.getParticipationStatus(attendee) is None]
+        declined = {}
+        storage = self._getStorage()
+        if storage is not None:
+            for room in storage.checkConflicts(self, attendees):
+                declined[room.getAttendeeId()] = None
         for attendee in attendees:
-            if self.getParticipationStatus(attendee) is None:
-                self.setParticipationStatus(attendee, 'NEEDS-ACTION')
-                self.setParticipationRole(attendee, 'REQ-PARTICIPANT')
+            if declined.has_key(attendee.getAttendeeId()):
+                self._setParticipationStatus(attendee, 'DECLINED')
+            else:
+                self._setParticipationStatus(attendee, 'NEEDS-ACTION')
+            self._setParticipationRole(attendee, 'REQ-PARTICIPANT')
+        if not attendees:
+            return
+        self._reindex(_participation_indexes)
+        for attendee in attendees:
+            self._notify(EventParticipationChangeEvent(
+                self, attendee, None, self.getParticipationStatus(attendee)))
 
     def setParticipationStatus(self, attendee, status):
         assert status in [None, 'NEEDS-ACTION', 'ACCEPTED', 'DECLINED',
@@ -423,7 +1115,9 @@ class EventBase:
         if old_status == status:
             return
         self._setParticipationStatus(attendee, status)
-        notify(EventParticipationChangeEvent(self, attendee, old_status, status))
+        self._reindex(_participation_indexes)
+        self._notify(
+            EventParticipationChangeEvent(self, attendee, old_status, status))
 
     def _setParticipationStatus(self, attendee, status):
         # implementation specific overriding
@@ -437,8 +1131,34 @@ class EventBase:
     def setParticipationRole(self, attendee, role):
         assert role in ['CHAIR', 'REQ-PARTICIPANT', 'OPT-PARTICIPANT',
                         'NON-PARTICIPANT']
+        self._setParticipationRole(attendee, role)
+        self._reindex(('role',))
+
+    def _setParticipationRole(self, attendee, role):
+        # implementation specific overriding
         self._participation_role[attendee.getAttendeeId()] = role
 
+    def _reindex(self, idxs=None):
+        if idxs is None:
+            # the event may have been moved or have a new recurrence
+            self._v_series_end = None
+            expansion_cache.invalidate(self)
+        storage = self._getStorage()
+        if storage is not None:
+            storage.reindexEvent(self, idxs)
+
+    def _notify(self, eventevent):
+        """Notify eventevent, or keep it for the batch of the storage.
+        """
+        storage = self._getStorage()
+        batch = None
+        if storage is not None:
+            batch = _batches.get(storage)
+        if batch is None:
+            notify(eventevent)
+        else:
+            batch.add(eventevent)
+
     def alldayAdjust(self):
         self.dtstart = combine(self.dtstart.date(), time(0, 0))
         if self.duration is None:
@@ -484,6 +1204,16 @@ class EventBase:
         return self._participation_role.get(
             attendee.getAttendeeId())
 
+    def _getStorage(self):
+        """Return the storage keeping the event, None if not stored.
+        """
+        storage = self.__parent__
+        if (storage is not None and
+            storage._events.get(self.unique_id) is not self):
+            raise ValueError("Event %s is not kept by its storage %s"
+                             % (self.unique_id, storage.getStorageId()))
+        return storage
+
     def __hash__(self):
         return hash(self.unique_id)
 
@@ -495,6 +1225,25 @@ class EventBase:
             (self.dtstart, self.unique_id),
             (other.dtstart, self.unique_id))
 
+    def getSeriesEnd(self):
+        series_end = self._v_series_end
+        if series_end is None:
+            series_end = self._v_series_end = self._computeSeriesEnd()
+        return series_end
+
+    def _computeSeriesEnd(self):
+        dtend = self.dtstart + self.duration
+        if self.recurrence is None:
+            return dtend
+        last = self.recurrence.getLastDate(self.dtstart.date())
+        if last is None:
+            return datetime.max
+        try:
+            return max(dtend, combine(last, self.dtstart.time()) +
+                       self.duration)
+        except OverflowError:
+            return datetime.max
+
     def expand(self, period):
         """Returns ICalendarOccurrences for this event in period."""
         # if we don't have a recurrence, we only generate a single occurrence
@@ -503,16 +1252,50 @@ class EventBase:
                 return []
             return [Occurrence(self.dtstart, self.duration, self)]
 
-        result = []
-        enddate = period[1].date()
-        for d in self.recurrence.apply(self, enddate):
+        if period[0] is not None and period[0] >= self.getSeriesEnd():
+            # the series ended before the period
+            return []
+        period = tuple(period)
+        occurrences = expansion_cache.get(self, period)
+        if occurrences is None:
+            occurrences = self._expandRecurrence(period)
+            expansion_cache.set(self, period, occurrences)
+        return list(occurrences)
+
+    def iterExpand(self, period):
+        """Generate the occurrences of this event in period, in order.
+
+        Occurrences are only computed when asked for, unless the
+        expansion for period is cached already. The period may have no
+        end.
+        """
+        if self.recurrence is None:
+            return iter(self.expand(period))
+        if period[0] is not None and period[0] >= self.getSeriesEnd():
+            return iter(())
+        occurrences = expansion_cache.get(self, tuple(period))
+        if occurrences is not None:
+            return iter(occurrences)
+        return self._iterRecurrence(period)
+
+    def _expandRecurrence(self, period):
+        return list(self._iterRecurrence(period))
+
+    def _iterRecurrence(self, period):
+        enddate = None
+        if period[1] is not None:
+            enddate = period[1].date()
+        period_start = None
+        if period[0] is not None:
+            # occurrences starting on an earlier day end before the period
+            period_start = (period[0] - self.duration).date()
+        for d in self.recurrence.apply(self, enddate, period_start):
             dtstart = self.dtstart
             dtstart = combine(d, dtstart.time())
             # must be in right period
             if not inPeriod(Timed(dtstart, self.duration), period):
                 continue
-            result.append(Occurrence(dtstart, self.duration, self))
-        return result
+            yield Occurrence(dtstart, self.duration, self)
 
     def export(self, private=False):
         """Exports the event as an icalendar.Event.
@@ -571,6 +1354,29 @@ class EventBase:
         e.add('status', self.status)
         return e
 
+    def _getExportKey(self, private):
+        """Return the values export() puts in the text, or None.
+
+        Texts are cached by these values, so override this along with
+        export(); texts of classes that only override export() are not
+        cached.
+        """
+        if self.__class__.export.im_func is not EventBase.export.im_func:
+            return None
+        return _getExportValues(self, private)
+
+    def exportText(self, private=False):
+        """Return the event exported as iCalendar text.
+
+        The text is cached for the values of the event it was exported
+        from, see _getExportKey.
+        """
+        text = export_cache.get(self, private)
+        if text is None:
+            text = self.export(private).as_string()
+            export_cache.set(self, private, text)
+        return text
+
 
 class Timed:
     implements(ITimed)
@@ -688,7 +1494,7 @@ class CalendarBase:
         return source.getAttendee(attendee_id)
 
     def import_(self, text, period=(None, None), search_criteria=None,
-                synchronize=0):
+                synchronize=0, bulk=False, processes=None, pool=None):
         """Given iCalendar text, import events.
 
         This overwrites existing event data where necessary,
@@ -696,36 +1502,109 @@ class CalendarBase:
         it also removes existing events. This is used when the
         iCalendar client is assumed to have retrieved the calendar
         first, as when you are using it via WebDAV.
+
+        If bulk is set, events are imported in a batch of the storage
+        manager: the changes are notified at once in an EventBatchEvent
+        and indexed at the end.
+
+        If processes is given, events are unfolded, fingerprinted and
+        parsed by that many processes in parallel, and only stored by
+        this one. pool is a multiprocessing pool to use instead, which
+        is left running so that it can be used again.
+
+        Events are imported as they are read, so incomplete text raises
+        ValueError after the events before the point where it ends have
+        been imported. Synchronization then removes no events.
         """
         self._logger.log(5, 'import_ raw ical text: \n\n%s\n\n', text)
         # repair text with proper line endings if necessary
         text = self._repairText(text)
+        # read line by line, without a copy of the text split in lines
+        self._importVEvents(_iterVEvents(StringIO(text)), period,
+                            search_criteria, synchronize, bulk=bulk,
+                            processes=processes, pool=pool)
+
+    def importFrom(self, stream, period=(None, None), search_criteria=None,
+                   synchronize=0, progress=None, bulk=False,
+                   processes=None, pool=None):
+        """Given a file-like object with iCalendar data, import events.
+
+        This works like import_, but stream is read line by line and
+        each event is imported as soon as it has been read, so the data
+        is never held in memory as a whole. If progress is given, it is
+        called with the number of events read so far after each event.
+        bulk, processes and pool are as for import_.
+        """
+        self._importVEvents(_iterVEvents(stream), period, search_criteria,
+                            synchronize, progress, bulk, processes, pool)
+
+    def _importVEvents(self, vevents, period, search_criteria, synchronize,
+                       progress=None, bulk=False, processes=None, pool=None):
+        # fingerprints of the VEVENTs imported by unique id
+        fingerprints = {}
+        # the organizer of events without one depends on the calendar
+        prefix = '%s\r\n' % self.getMainAttendeeId()
+        own_pool = None
+        if pool is None and processes:
+            from multiprocessing import Pool
+            pool = own_pool = Pool(processes)
+        if pool is None:
+            # parsed here, the events go through the import hooks
+            decode = lambda vevents: _parseVEvents(vevents, prefix)
+            importers = (self._importExistingEvent, self._importNewEvent)
+        else:
+            # keep every process busy with a chunk or two
+            ahead = 2 * (processes or _DECODE_AHEAD)
+            decode = lambda vevents: _decodeVEventsInPool(
+                vevents, prefix, pool, ahead)
+            importers = (self._importExistingFields, self._importNewFields)
+        try:
+            if not bulk:
+                self._importVEventsNow(vevents, period, search_criteria,
+                                       synchronize, progress, fingerprints,
+                                       decode, importers)
+            else:
+                m = self._getStorageManager()
+                m.beginBatch()
+                try:
+                    self._importVEventsNow(vevents, period, search_criteria,
+                                           synchronize, progress,
+                                           fingerprints, decode, importers)
+                finally:
+                    # also notify what was imported before an error
+                    m.commitBatch()
+        finally:
+            if own_pool is not None:
+                own_pool.terminate()
+                own_pool.join()
+        # only now, the events are not changed by the import anymore
+        for uid, fingerprint in fingerprints.items():
+            event = self.getEvent(uid)
+            event._import_fingerprint = (fingerprint,
+                                         _getImportState(event))
+
+    def _importVEventsNow(self, vevents, period, search_criteria,
+                          synchronize, progress, fingerprints, decode,
+                          (import_existing, import_new)):
         # get all events (to use when we import)
         events = self.getEvents(period, search_criteria)
         # make a set of their unique_ids
         known_uids = Set([event.unique_id for event in events])
-        # now parse iCalendar text
-        ical = icalendar.Calendar.from_string(text)
-        if ical is None:
-            return
         ical_uids = Set()
-        # now walk through all events
-        for e in ical.walk('VEVENT'):
-            uid = e.decoded('UID')
-            # we have to have uid
-            assert uid is not None
-            ical_uids.add(uid)
+        vevents = self._iterVEventsToImport(vevents, known_uids, ical_uids,
+                                            progress)
+        # now walk through all events that changed
+        for uid, fingerprint, e in decode(vevents):
             # edit existing event
             if uid in known_uids:
-                self._importExistingEvent(uid, e)
+                import_existing(uid, e)
+            elif not self.hasEvent(uid):
+                # this uid is really new, so import it
+                import_new(uid, e)
             else:
-                if not self.hasEvent(uid):
-                    # this uid is really new, so import it
-                    self._importNewEvent(uid, e)
-                else:
-                    # this uid exists already, but is not in our calendar,
-                    # so refuse to modify it
-                    continue
+                # this uid was created by the import already
+                continue
+            fingerprints[uid] = fingerprint
         if synchronize:
             # now for all uids that were in known_uids but not in
             # ical_uids, we need to remove the related events
@@ -733,35 +1612,78 @@ class CalendarBase:
             for uid in removed_uids:
                 self._deleteEvent(self.getEvent(uid))
 
+    def _iterVEventsToImport(self, vevents, known_uids, ical_uids,
+                             progress):
+        """Generate (uid, lines, known) for the VEVENTs to import.
+
+        known is the fingerprint of the VEVENT the event was imported
+        from, if it did not change since, so that the VEVENT is skipped
+        without even parsing it if it is the same. The uids of all
+        VEVENTs are added to ical_uids.
+        """
+        count = 0
+        for uid, lines in vevents:
+            # we have to have uid
+            assert uid is not None
+            ical_uids.add(uid)
+            count += 1
+            if progress is not None:
+                progress(count)
+            if uid in known_uids:
+                event = self.getEvent(uid)
+                known = None
+                if event._import_fingerprint is not None:
+                    known, state = event._import_fingerprint
+                    if state != _getImportState(event):
+                        known = None
+                yield uid, lines, known
+            elif not self.hasEvent(uid):
+                yield uid, lines, None
+            # otherwise this uid exists already, but is not in our
+            # calendar, so refuse to modify it
+
     def _importExistingEvent(self, uid, e):
+        self._importExistingSpecification(
+            uid, self._importEventSpecification(e))
+
+    def _importNewEvent(self, uid, e):
+        self._importNewSpecification(uid, self._importEventSpecification(e))
+
+    def _importExistingFields(self, uid, fields):
+        self._importExistingSpecification(
+            uid, self._importFieldsSpecification(fields))
+
+    def _importNewFields(self, uid, fields):
+        self._importNewSpecification(
+            uid, self._importFieldsSpecification(fields))
+
+    def _importExistingSpecification(self, uid, spec):
         event = self.getEvent(uid)
-        spec = self._importEventSpecification(e)
         if spec.willModify(event):
             spec.setOnObject(event)
-            notify(EventModifiedEvent(event))
+            self._getStorageManager().notifyEvent(EventModifiedEvent(event))
 
-    def _importNewEvent(self, uid, e):
+    def _importNewSpecification(self, uid, spec):
         m = self._getStorageManager()
-        spec = self._importEventSpecification(e)
         m.createEventFromSpecification(uid, spec)
 
     def _importEventSpecification(self, e):
         """Given an iCalendar event object, create event specification.
         """
-        asrc = self._getAttendeeSource()
-
-        kw = {}
-        kw['dtstart'], kw['duration'], kw['allday'] =\
-                       self._getDtstartDuration(e)
+        return self._importFieldsSpecification(_decodeVEvent(
+            e, self._getDtstartDuration, self._getRecurrenceRule,
+            self._getCategories))
 
-        kw['title'] = e.decoded('SUMMARY', '')
-        kw['description'] = e.decoded('DESCRIPTION', '')
-        kw['location'] = e.decoded('LOCATION', '')
-        kw['status'] = e.decoded('STATUS', 'TENTATIVE')
+    def _importFieldsSpecification(self, fields):
+        """Given the fields decoded from an iCalendar event, create event
+        specification.
+        """
+        asrc = self._getAttendeeSource()
+        kw = fields.copy()
         # XXX we make the first attendee of the calendar the organizer.
         # this is perhaps slightly bogus
-        if e.has_key('ORGANIZER'):
-            organizer = asrc.getAttendeeFromSpec(e['organizer'])
+        if kw['organizer'] is not None:
+            organizer = asrc.getAttendeeFromSpec(kw['organizer'])
         else:
             organizer = None
 
@@ -770,27 +1692,10 @@ class CalendarBase:
 
         kw['organizer'] = organizer
 
-        if e.has_key('ATTENDEE'):
-            attendees = []
-            attendee_list = e['ATTENDEE']
-            if not isinstance(attendee_list, ListType):
-                attendee_list = [attendee_list]
-            for attendee_spec in attendee_list:
-                attendee = asrc.getAttendeeFromSpec(attendee_spec)
-                status = attendee_spec.params.get('PARTSTAT', 'NEEDS-ACTION')
-                role = attendee_spec.params.get('ROLE', 'REQ-PARTICIPANT')
-                attendees.append((attendee, role, status))
-            kw['attendees'] = attendees
-
-        kw['categories'] = self._getCategories(e)
-        kw['transparent'] = e.decoded('TRANSP', 'OPAQUE') == 'TRANSPARENT'
-        kw['access'] = e.decoded('CLASS', 'PUBLIC')
-        kw['document'] = e.decoded('ATTACH', None)
-        rrule = e.decoded('RRULE', None)
-        if rrule is not None:
-            kw['recurrence'] = self._getRecurrenceRule(rrule)
-        else:
-            kw['recurrence'] = None
+        if kw.has_key('attendees'):
+            kw['attendees'] = [
+                (asrc.getAttendeeFromSpec(attendee_spec), role, status)
+                for attendee_spec, role, status in kw['attendees']]
         return EventSpecification(**kw)
 
     def _getDefaultOrganizer(self):
@@ -800,94 +1705,13 @@ class CalendarBase:
         self._getStorageManager().deleteEvent(event)
 
     def _getDtstartDuration(self, component):
-        dtstart = component.decoded('DTSTART', None)
-        dtend = component.decoded('DTEND', None)
-        duration = component.decoded('DURATION', None)
-        if duration is not None and dtend is not None:
-            # too much info: set duration back to None to recompute it and
-            # ensure consistency
-            self._logger.warning("Invalid iCalendar data: Event '%s' has both "
-                                 "dtend and duration. Ignoring the duration." %
-                                 component.decoded('UID'))
-            duration = None
-        assert dtstart is not None
-        assert ((dtend is None and duration is not None) or
-                (dtend is not None and duration is None) or
-                (dtend is None and duration is None))
-        allday = False
-        # if we're just getting a date, we assume allday events and
-        # convert the date into a datetime
-        if type(dtstart) is date:
-            dtstart = combine(dtstart, time(0, 0))
-            allday = True
-        else:
-            dtstart = float_datetime(dtstart)
-        if dtend is not None:
-            if type(dtend) is date:
-                dtend = combine(dtend, time(0, 0))
-            else:
-                dtend = float_datetime(dtend)
-            duration = dtend - dtstart
-        else:
-            if duration is None:
-                # no duration, no dtend, follow iCalendar rules
-                if type(dtstart) is date:
-                    dtend = combine(dtend, time(0, 0) + timedelta(days=1))
-                else:
-                    dtend = dtstart
-                duration = dtend - dtstart
-        return dtstart, duration, allday
+        return _getDtstartDuration(component)
 
     def _getRecurrenceRule(self, rrule):
-        freq = rrule['FREQ'][0]
-        if freq == 'DAILY':
-            r = recurrent.DailyRecurrenceRule()
-        elif freq == 'YEARLY':
-            r = recurrent.YearlyRecurrenceRule()
-        elif freq == 'WEEKLY':
-            byday = rrule.get('BYDAY')
-            weekdays = []
-            if byday is not None:
-                for day in byday:
-                    weekdays.append(ical_weekdays.index(day))
-            r = recurrent.WeeklyRecurrenceRule(weekdays=weekdays)
-        elif freq == 'MONTHLY':
-            byday = rrule.get('BYDAY')
-            if byday is not None:
-                if byday[0][0] == '-':
-                    monthly = 'lastweekday'
-                else:
-                    monthly = 'weekday'
-            else:
-                monthly = 'monthday'
-            r = recurrent.MonthlyRecurrenceRule(monthly=monthly)
-        interval = rrule.get('INTERVAL')
-        if interval is not None:
-            r.interval = interval[0]
-        count = rrule.get('COUNT')
-        if count is not None:
-            r.count = count[0]
-        until = rrule.get('UNTIL')
-        if until is not None:
-            r.until = until[0]
-        return r
+        return _getRecurrenceRule(rrule)
 
     def _getCategories(self, e):
-        try:
-            categories = Set(e.get_inline('CATEGORIES'))
-        except KeyError:
-            categories = Set()
-        except AttributeError:
-            # XXX depending on implementation specific behavior
-            # in icalendar..
-            # we could not get categories using get_inline
-            # as we probably have multiple CATEGORIES entries
-            categories = e.decoded('CATEGORIES', None)
-            if categories is None:
-                categories = Set()
-            else:
-                categories = Set(categories)
-        return categories
+        return _getCategories(e)
 
     def _repairText(self, text):
         # repair text to have \r\n if necessary
@@ -927,6 +1751,51 @@ class CalendarBase:
             search_criteria  = SearchCriteria(attendees=self.getAttendees())
         return self._getStorageManager().getOccurrences(period, search_criteria)
 
+    def iterOccurrences(self, period, search_criteria=None):
+        if search_criteria is not None:
+            search_criteria = search_criteria.clone(
+                attendees=self.getAttendees())
+        else:
+            search_criteria  = SearchCriteria(attendees=self.getAttendees())
+        return self._getStorageManager().iterOccurrences(period,
+                                                         search_criteria)
+
+    def getUpcomingOccurrences(self, after, limit, search_criteria=None):
+        if search_criteria is not None:
+            search_criteria = search_criteria.clone(
+                attendees=self.getAttendees())
+        else:
+            search_criteria  = SearchCriteria(attendees=self.getAttendees())
+        return self._getStorageManager().getUpcomingOccurrences(
+            after, limit, search_criteria)
+
+    def getUpcomingOccurrencesPage(self, after, limit, search_criteria=None,
+                                   cursor=None):
+        if search_criteria is not None:
+            search_criteria = search_criteria.clone(
+                attendees=self.getAttendees())
+        else:
+            search_criteria  = SearchCriteria(attendees=self.getAttendees())
+        return self._getStorageManager().getUpcomingOccurrencesPage(
+            after, limit, search_criteria, cursor)
+
+    def getOccurrenceBatch(self, period, search_criteria=None):
+        if search_criteria is not None:
+            search_criteria = search_criteria.clone(
+                attendees=self.getAttendees())
+        else:
+            search_criteria  = SearchCriteria(attendees=self.getAttendees())
+        return self._getStorageManager().getOccurrenceBatch(period,
+                                                            search_criteria)
+
+    def explain(self, period, search_criteria=None):
+        if search_criteria is not None:
+            search_criteria = search_criteria.clone(
+                attendees=self.getAttendees())
+        else:
+            search_criteria  = SearchCriteria(attendees=self.getAttendees())
+        return self._getStorageManager().explain(period, search_criteria)
+
     def getOccurrencesSegmented(self, period, search_criteria=None):
         # first get occurrences
         occurrences = self.getOccurrences(period, search_criteria)
@@ -973,16 +1842,27 @@ class CalendarBase:
 
     def export(self, period=(None, None), search_criteria=None):
         """Export calendar data in ICalendar format"""
+        ical_text = ''.join(self.iterExport(period, search_criteria))
+        self._logger.log(5, 'export generated ical text: \n\n%s\n\n', ical_text)
+        return ical_text
+
+    def exportTo(self, stream, period=(None, None), search_criteria=None):
+        """Write calendar data in ICalendar format to stream, event by event
+        """
+        for text in self.iterExport(period, search_criteria):
+            stream.write(text)
+
+    def iterExport(self, period=(None, None), search_criteria=None):
+        """Generate calendar data in ICalendar format, event by event"""
         ical = icalendar.Calendar()
         ical.add('prodid', '-//CalCore //nuxeo.com//')
         ical.add('version', '2.0')
-
+        # the components go before the end of the calendar
+        footer = 'END:VCALENDAR\r\n'
+        yield ical.as_string()[:-len(footer)]
         for event in self.getEvents(period, search_criteria):
-            e = event.export()
-            ical.add_component(e)
-        ical_text = ical.as_string()
-        self._logger.log(5, 'export generated ical text: \n\n%s\n\n', ical_text)
-        return ical_text
+            yield event.exportText()
+        yield footer
 
 
     def _getStorageManager(self):
@@ -991,6 +1871,285 @@ class CalendarBase:
     def _getAttendeeSource(self):
         raise NotImplementedError
 
+def _getDtstartDuration(component):
+    dtstart = component.decoded('DTSTART', None)
+    dtend = component.decoded('DTEND', None)
+    duration = component.decoded('DURATION', None)
+    if duration is not None and dtend is not None:
+        # too much info: set duration back to None to recompute it and
+        # ensure consistency
+        getLogger('calcore.CalendarBase').warning(
+            "Invalid iCalendar data: Event '%s' has both "
+            "dtend and duration. Ignoring the duration." %
+            component.decoded('UID'))
+        duration = None
+    assert dtstart is not None
+    assert ((dtend is None and duration is not None) or
+            (dtend is not None and duration is None) or
+            (dtend is None and duration is None))
+    allday = False
+    # if we're just getting a date, we assume allday events and
+    # convert the date into a datetime
+    if type(dtstart) is date:
+        dtstart = combine(dtstart, time(0, 0))
+        allday = True
+    else:
+        dtstart = float_datetime(dtstart)
+    if dtend is not None:
+        if type(dtend) is date:
+            dtend = combine(dtend, time(0, 0))
+        else:
+            dtend = float_datetime(dtend)
+        duration = dtend - dtstart
+    else:
+        if duration is None:
+            # no duration, no dtend, follow iCalendar rules
+            if type(dtstart) is date:
+                dtend = combine(dtend, time(0, 0) + timedelta(days=1))
+            else:
+                dtend = dtstart
+            duration = dtend - dtstart
+    return dtstart, duration, allday
+
+def _getRecurrenceRule(rrule):
+    freq = rrule['FREQ'][0]
+    if freq == 'DAILY':
+        r = recurrent.DailyRecurrenceRule()
+    elif freq == 'YEARLY':
+        r = recurrent.YearlyRecurrenceRule()
+    elif freq == 'WEEKLY':
+        byday = rrule.get('BYDAY')
+        weekdays = []
+        if byday is not None:
+            for day in byday:
+                weekdays.append(ical_weekdays.index(day))
+        r = recurrent.WeeklyRecurrenceRule(weekdays=weekdays)
+    elif freq == 'MONTHLY':
+        byday = rrule.get('BYDAY')
+        if byday is not None:
+            if byday[0][0] == '-':
+                monthly = 'lastweekday'
+            else:
+                monthly = 'weekday'
+        else:
+            monthly = 'monthday'
+        r = recurrent.MonthlyRecurrenceRule(monthly=monthly)
+    interval = rrule.get('INTERVAL')
+    if interval is not None:
+        r.interval = interval[0]
+    count = rrule.get('COUNT')
+    if count is not None:
+        r.count = count[0]
+    until = rrule.get('UNTIL')
+    if until is not None:
+        r.until = until[0]
+    return r
+
+def _getCategories(e):
+    try:
+        categories = Set(e.get_inline('CATEGORIES'))
+    except KeyError:
+        categories = Set()
+    except AttributeError:
+        # XXX depending on implementation specific behavior
+        # in icalendar..
+        # we could not get categories using get_inline
+        # as we probably have multiple CATEGORIES entries
+        categories = e.decoded('CATEGORIES', None)
+        if categories is None:
+            categories = Set()
+        else:
+            categories = Set(categories)
+    return categories
+
+def _decodeVEvent(e, getDtstartDuration=_getDtstartDuration,
+                  getRecurrenceRule=_getRecurrenceRule,
+                  getCategories=_getCategories):
+    """Return the fields of e, an iCalendar event, in a dictionary.
+
+    The keys are the arguments of EventSpecification, but the organizer
+    and attendees are left as calendar addresses, and all values can be
+    pickled. The values are decoded by the given functions, which
+    calendars pass their import hooks as.
+    """
+    kw = {}
+    kw['dtstart'], kw['duration'], kw['allday'] = getDtstartDuration(e)
+
+    kw['title'] = e.decoded('SUMMARY', '')
+    kw['description'] = e.decoded('DESCRIPTION', '')
+    kw['location'] = e.decoded('LOCATION', '')
+    kw['status'] = e.decoded('STATUS', 'TENTATIVE')
+    kw['organizer'] = e.get('ORGANIZER')
+
+    if e.has_key('ATTENDEE'):
+        attendees = []
+        attendee_list = e['ATTENDEE']
+        if not isinstance(attendee_list, ListType):
+            attendee_list = [attendee_list]
+        for attendee_spec in attendee_list:
+            status = attendee_spec.params.get('PARTSTAT', 'NEEDS-ACTION')
+            role = attendee_spec.params.get('ROLE', 'REQ-PARTICIPANT')
+            attendees.append((attendee_spec, role, status))
+        kw['attendees'] = attendees
+
+    kw['categories'] = getCategories(e)
+    kw['transparent'] = e.decoded('TRANSP', 'OPAQUE') == 'TRANSPARENT'
+    kw['access'] = e.decoded('CLASS', 'PUBLIC')
+    kw['document'] = e.decoded('ATTACH', None)
+    rrule = e.decoded('RRULE', None)
+    if rrule is not None:
+        kw['recurrence'] = getRecurrenceRule(rrule)
+    else:
+        kw['recurrence'] = None
+    return kw
+
+def _parseChangedVEvent(lines, prefix, known):
+    """Return the fingerprint and iCalendar event of the VEVENT in lines.
+
+    The fingerprint is that of prefix and the unfolded VEVENT. The
+    event is None if it is known already.
+    """
+    text = _unfold(lines)
+    data = prefix + text
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    fingerprint = sha1(data).hexdigest()
+    if fingerprint == known:
+        return fingerprint, None
+    return fingerprint, icalendar.Event.from_string(text)
+
+def _decodeChangedVEvent(lines, prefix, known):
+    """Return the fingerprint and fields of the VEVENT in lines.
+
+    The fields are None if it is known already.
+    """
+    fingerprint, e = _parseChangedVEvent(lines, prefix, known)
+    if e is None:
+        return fingerprint, None
+    return fingerprint, _decodeVEvent(e)
+
+def _decodeVEvents(vevents, prefix):
+    """Return the fingerprints and fields of (lines, known) VEVENTs.
+
+    This is what processes of a pool run.
+    """
+    return [_decodeChangedVEvent(lines, prefix, known)
+            for lines, known in vevents]
+
+def _parseVEvents(vevents, prefix):
+    """Generate (uid, fingerprint, iCalendar event) for the changed
+    VEVENTs among (uid, lines, known) ones.
+    """
+    for uid, lines, known in vevents:
+        fingerprint, e = _parseChangedVEvent(lines, prefix, known)
+        if e is not None:
+            yield uid, fingerprint, e
+
+# number of VEVENTs decoded at once in a process pool
+_DECODE_CHUNK = 100
+# chunks read ahead in a pool of an unknown number of processes
+_DECODE_AHEAD = 8
+
+def _decodeVEventsInPool(vevents, prefix, pool, ahead):
+    """Generate (uid, fingerprint, fields) for the changed VEVENTs, in
+    order, decoded by chunks in pool.
+
+    At most ahead chunks are read ahead of the results, so memory does
+    not grow with the number of events.
+    """
+    pending = deque()
+    vevents = iter(vevents)
+    while True:
+        chunk = list(islice(vevents, _DECODE_CHUNK))
+        if chunk:
+            args = [(lines, known) for uid, lines, known in chunk]
+            pending.append((chunk, pool.apply_async(_decodeVEvents,
+                                                    (args, prefix))))
+            if len(pending) < ahead:
+                continue
+        elif not pending:
+            return
+        chunk, result = pending.popleft()
+        for (uid, lines, known), (fingerprint, fields) in zip(
+            chunk, result.get()):
+            if fields is not None:
+                yield uid, fingerprint, fields
+
+def _iterUnfolded(stream):
+    """Generate the content lines read from stream, unfolded.
+
+    Lines may end with CRLF or LF only.
+    """
+    parts = []
+    for line in stream:
+        line = line.rstrip('\r\n')
+        # a line starting with a space or a tab continues the last one
+        if parts and line[:1] in (' ', '\t'):
+            parts.append(line[1:])
+            continue
+        if parts and parts != ['']:
+            yield ''.join(parts)
+        parts = [line]
+    if parts and parts != ['']:
+        yield ''.join(parts)
+
+def _unfold(lines):
+    """Return the VEVENT in lines unfolded, lines ending with CRLF.
+    """
+    unfolded = list(_iterUnfolded(lines))
+    unfolded.append('')
+    return '\r\n'.join(unfolded)
+
+def _iterVEvents(stream):
+    """Generate (uid, lines) for the VEVENTs of iCalendar data in stream.
+
+    stream is a file-like object or any iterable of lines. The lines
+    of each VEVENT are generated as read, once the last one has been
+    read; only the UID is unfolded here, the rest is left to _unfold.
+    Incomplete data raises ValueError, after the VEVENTs read so far.
+    """
+    lines = None
+    depth = 0
+    uid = None
+    # the lines of the UID, while it may continue
+    uid_lines = None
+    complete = False
+    for line in stream:
+        if lines is None:
+            name = line.rstrip().upper()
+            if name == 'BEGIN:VEVENT':
+                lines = [line]
+                depth = 1
+                uid = None
+            elif name == 'END:VCALENDAR':
+                complete = True
+            continue
+        lines.append(line)
+        # a line starting with a space or a tab continues the last one
+        if line[:1] in (' ', '\t'):
+            if uid_lines is not None:
+                uid_lines.append(line)
+            continue
+        if uid_lines is not None:
+            uid = _getUid(uid_lines)
+            uid_lines = None
+        name = line[:6].upper()
+        if name == 'BEGIN:':
+            depth += 1
+        elif name[:4] == 'END:':
+            depth -= 1
+            if not depth:
+                yield uid, lines
+                lines = None
+        elif depth == 1 and name[:4] in ('UID:', 'UID;'):
+            uid_lines = [line]
+    if not complete or lines is not None:
+        raise ValueError("Incomplete iCalendar data")
+
+def _getUid(lines):
+    name, params, value = Contentline(_iterUnfolded(lines).next()).parts()
+    return types_factory.from_ical('UID', value)
+
 class Calendar(CalendarBase):
     def __init__(self, storage_manager, attendee_source):
         CalendarBase.__init__(self)
@@ -1056,14 +2215,31 @@ class SimpleAttendeeSource:
 
     def getAttendeesOfType(self, attendee_type):
         result = []
-        for attendee in self.attendees.values():
-            if attendee_type is attendee.getAttendeeType():
+        for attendee in self._attendees.values():
+            if attendee_type == attendee.getAttendeeType():
                 result.append(attendee)
         return result
 
-    def getAttendeeTypes():
+    def getAttendeeTypes(self):
         return ['INDIVIDUAL', 'ROOM']
 
+    def findFreeRooms(self, period, duration, time_period):
+        """Return the rooms free for duration in period, with free periods.
+
+        Returns a list of (room, free periods) tuples, ordered by room
+        id. The events of all rooms are looked at once.
+        """
+        rooms = self.getAttendeesOfType('ROOM')
+        free = self._storage_manager.getFreePeriodsByAttendee(
+            rooms, period, time_period, duration)
+        result = []
+        for room in rooms:
+            periods = free[room.getAttendeeId()]
+            if periods:
+                result.append((room.getAttendeeId(), room, periods))
+        result.sort()
+        return [(room, periods) for attendee_id, room, periods in result]
+
     def getAttendeeFromSpec(self, vcaladdress):
         id = vcaladdress.decode()
         return self._attendees.get(id, None)
@@ -1087,6 +2263,51 @@ def inPeriod(o, (b, e)):
         return False
     return True
 
+def getOccurrencesSpan(event):
+    """Return the (start, end) period all occurrences of event fall within.
+
+    For events recurring forever the end is datetime.max.
+    """
+    return event.dtstart, event.getSeriesEnd()
+
+def _getStatusIndexValues(event):
+    return event._participation_state.items()
+
+def _getRoleIndexValues(event):
+    return event._participation_role.items()
+
+def _getOrganizerIndexValues(event):
+    organizer_id = event.getOrganizerId()
+    if organizer_id is None:
+        return ()
+    return (organizer_id,)
+
+def _getCategoryIndexValues(event):
+    return event.categories or ()
+
+# functions giving the values to index an event with, by index name
+def _getBusyIndexValues(event):
+    return getOccurrencesSpan(event), _getBlockedAttendeeIds(event)
+
+_index_values = {
+    'period': getOccurrencesSpan,
+    'busy': _getBusyIndexValues,
+    'attendee': lambda event: event.getAttendeeIds(),
+    'status': _getStatusIndexValues,
+    'role': _getRoleIndexValues,
+    'organizer': _getOrganizerIndexValues,
+    'category': _getCategoryIndexValues,
+    }
+
+# the indexes depending on the participation of attendees
+_participation_indexes = ('attendee', 'status', 'role', 'busy')
+
+def _explainStage(name, estimate, candidates, begin):
+    return {'index': name,
+            'estimate': estimate,
+            'candidates': candidates,
+            'time': walltime() - begin}
+
 def sameDay(dt, dt2):
     return dt.date() == dt2.date()
 
@@ -1120,6 +2341,238 @@ def iso8601(dt):
     return  '%.4d%.2d%.2dT%.2d%.2d%.2d' % (
         dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
 
+def mergeOccurrences(sequences):
+    """Merge sequences of occurrences sorted on dtstart into one.
+
+    This is a generator. Only the next occurrence of each sequence is
+    kept, in a heap. Occurrences starting at the same time come in the
+    order of their sequences.
+    """
+    heap = []
+    for position, sequence in enumerate(sequences):
+        iterator = iter(sequence)
+        for occurrence in iterator:
+            heap.append((occurrence.dtstart, position, occurrence, iterator))
+            break
+    heapify(heap)
+    while heap:
+        dtstart, position, occurrence, iterator = heap[0]
+        yield occurrence
+        for occurrence in iterator:
+            heapreplace(heap, (occurrence.dtstart, position, occurrence,
+                               iterator))
+            break
+        else:
+            # this sequence is exhausted
+            heappop(heap)
+
+def _mergeUpcoming(events, period):
+    """Generate the occurrences of events in period in order.
+
+    The order is on dtstart, then on the unique id of the events.
+    Events are only expanded once their start comes before the next
+    occurrence to give, so stopping early leaves the later events alone.
+    """
+    # popped from the end, earliest first
+    pending = [(event.dtstart, event.unique_id, event) for event in events]
+    pending.sort()
+    pending.reverse()
+    heap = []
+    while pending or heap:
+        # occurrences of an event never start before the event
+        while pending and (not heap or pending[-1][:2] <= heap[0][:2]):
+            dtstart, unique_id, event = pending.pop()
+            iterator = event.iterExpand(period)
+            for occurrence in iterator:
+                heappush(heap, (occurrence.dtstart, unique_id, occurrence,
+                                iterator))
+                break
+        if not heap:
+            continue
+        dtstart, unique_id, occurrence, iterator = heap[0]
+        yield occurrence
+        for occurrence in iterator:
+            heapreplace(heap, (occurrence.dtstart, unique_id, occurrence,
+                               iterator))
+            break
+        else:
+            heappop(heap)
+
+def _getBlockedAttendees(event, attendees):
+    """Return the attendees among attendees whose time event blocks."""
+    # transparent or canceled events don't count
+    if event.transparent or event.status == 'CANCELED':
+        return []
+    result = []
+    for attendee in attendees:
+        status = event.getParticipationStatus(attendee)
+        # And neither does events you are not going to:
+        if status is not None and status not in ('DECLINED', 'DELEGATED'):
+            result.append(attendee)
+    return result
+
+def _getBlockedAttendeeIds(event):
+    """Return the ids of the attendees whose time event blocks."""
+    if event.transparent or event.status == 'CANCELED':
+        return []
+    absent = (event.getAttendeeIds('DECLINED') +
+              event.getAttendeeIds('DELEGATED'))
+    return [attendee_id for attendee_id in event.getAttendeeIds()
+            if attendee_id not in absent]
+
+def _getNonWorkingPeriods(period, (time_begins, time_ends)):
+    """Return the IntervalSet of the time outside of the hours of each
+    day of period."""
+    begins, ends = period
+    result = []
+    d = begins.date()
+    end_d = ends.date()
+    if ends.time() == time(0, 0):
+        end_d -= timedelta(days=1)
+    while d <= end_d:
+        result.append((combine(d, time(0, 0)), combine(d, time_begins)))
+        next_day = d + timedelta(days=1)
+        result.append((combine(d, time_ends), combine(next_day, time(0, 0))))
+        d = next_day
+    return IntervalSet(result, True)
+
+def _getFreePeriods(blocked_periods, period, time_period,
+                    minimal_duration=None):
+    """Return the periods of period between blocked_periods.
+
+    blocked_periods include the periods outside of time_period.
+    """
+    begins, ends = period
+    time_begins, time_ends = time_period
+    if begins < combine(begins.date(), time_begins):
+        begins = combine(begins.date(), time_begins)
+    if ends > combine(ends.date(), time_ends):
+        ends = combine(ends.date(), time_ends)
+    free_periods = IntervalSet(blocked_periods).complement((begins, ends))
+    return [(dtstart, dtend) for dtstart, dtend in free_periods
+            if minimal_duration is None or dtend - dtstart >= minimal_duration]
+
+_conflict_policies = (None, 'reject', 'warn', 'decline')
+
+def _findFreeRoom(room_busy, slot):
+    """Return the first room free during slot, and None.
+
+    room_busy is a list of (room, busy periods) tuples. If all rooms are
+    busy, None and the earliest time a slot could have a room are
+    returned.
+    """
+    begins, ends = slot
+    next_start = ends
+    for room, busy in room_busy:
+        overlapping = busy.window(slot)
+        if not len(overlapping):
+            return room, None
+        # the room is busy in every slot starting before that
+        next_start = min(next_start, overlapping[-1][1])
+    return None, next_start
+
+# available slots are first looked for that many days, then twice as
+# many after those, and so on
+_SLOT_SEARCH_DAYS = 7
+
+# conflicts between series recurring forever by rules not known to
+# repeat are looked for that long
+_CONFLICT_HORIZON = timedelta(days=366)
+
+# days after which the Gregorian calendar repeats, weekdays included
+_GREGORIAN_CYCLE = 146097
+
+def _getRecurrenceCycle(rule):
+    """Return the days after which the recurrences of rule repeat, and
+    the average days between recurrences, or None if not known.
+    """
+    interval = rule.interval
+    if isinstance(rule, recurrent.DailyRecurrenceRule):
+        return interval, interval
+    if isinstance(rule, recurrent.WeeklyRecurrenceRule):
+        return 7 * interval, 7.0 * interval / max(len(rule.weekdays), 1)
+    if isinstance(rule, recurrent.MonthlyRecurrenceRule):
+        steps = 4800
+    elif isinstance(rule, recurrent.YearlyRecurrenceRule):
+        steps = 400
+    else:
+        return None
+    cycle = interval // recurrent.gcd(interval, steps) * _GREGORIAN_CYCLE
+    return cycle, float(_GREGORIAN_CYCLE) * interval / steps
+
+def _seriesOverlap(event, other, begins):
+    """Tell whether occurrences of two series recurring forever overlap.
+
+    Returns None if their recurrences are not known to repeat.
+    """
+    cycles = [_getRecurrenceCycle(e.recurrence) for e in (event, other)]
+    if None in cycles:
+        return None
+    (cycle, gap), (other_cycle, other_gap) = cycles
+    days = cycle // recurrent.gcd(cycle, other_cycle) * other_cycle
+    # once both series run, and after their exceptions, occurrences
+    # repeat with the days of both cycles: if any overlap, one within
+    # these days does
+    start = begins
+    for rule in (event.recurrence, other.recurrence):
+        for exception in rule.exceptions:
+            if not isinstance(exception, datetime):
+                start = max(start, combine(exception, time(0, 0)))
+    duration = max(event.duration, other.duration)
+    try:
+        ends = start + timedelta(days + 1) + 2 * duration
+    except OverflowError:
+        ends = datetime.max
+    if gap < other_gap:
+        event, other = other, event
+    # go through the sparser series, looking for occurrences of the
+    # other one during each, without asking the expansion cache
+    for a in event.iterExpand((begins, ends)):
+        a_end = a.dtstart + a.duration
+        for b in other._iterRecurrence((a.dtstart, a_end)):
+            if b.dtstart < a_end and a.dtstart < b.dtstart + b.duration:
+                return True
+    return False
+
+def _occurrencesOverlap(event, other):
+    """Tell whether an occurrence of event overlaps one of other."""
+    begins = max(event.dtstart, other.dtstart)
+    ends = min(event.getSeriesEnd(), other.getSeriesEnd())
+    if ends == datetime.max:
+        overlap = _seriesOverlap(event, other, begins)
+        if overlap is not None:
+            return overlap
+        ends = begins + _CONFLICT_HORIZON
+    if begins >= ends:
+        return False
+    # both are in start order, and so in end order
+    window = (begins, ends)
+    others = other.iterExpand(window)
+    b = None
+    for a in event.iterExpand(window):
+        a_end = a.dtstart + a.duration
+        while True:
+            if b is None:
+                for b in others:
+                    break
+                else:
+                    return False
+            b_end = b.dtstart + b.duration
+            if b.dtstart < a_end and a.dtstart < b_end:
+                return True
+            if b_end > a_end:
+                # b may overlap the next occurrence of event
+                break
+            b = None
+    return False
+
+def _skipUntil(occurrences, (dtstart, unique_id)):
+    """Skip the occurrences up to the one of unique_id at dtstart."""
+    for occurrence in occurrences:
+        if ((occurrence.dtstart, occurrence.original.unique_id) >
+            (dtstart, unique_id)):
+            yield occurrence
+
 def segmentOccurrences(period, occurrences):
     """Given a sequence of occurrences, split them up.
 
@@ -1181,3 +2634,661 @@ def CalendarWeekdaysVocabulary(context):
     for day in range(0,7):
         terms.append(SimpleTerm(day, day, _('weekday_%s' % str(day))))
     return SimpleVocabulary(terms)
+
+class _Expansions:
+    """The periods an event has cached expansions for.
+    """
+
+    def __init__(self):
+        self.periods = {}
+
+class ExpansionCache:
+    """Cache of the occurrences of recurrent events by period.
+
+    Each event keeps the key of its expansions in a volatile attribute,
+    so they are forgotten with the event when it is deactivated, or
+    invalidated by an abort or another transaction. Entries are kept
+    up to a total number of occurrences, dropping the least recently
+    used ones. Entries of an event are invalidated when it is
+    reindexed or deleted.
+    """
+
+    def __init__(self, max_occurrences=50000):
+        self._lock = Lock()
+        self._cache = cache.LRUCache(max_occurrences, self._dropped)
+
+    # MANIPULATORS
+
+    def set(self, event, period, occurrences):
+        self._lock.acquire()
+        try:
+            expansions = getattr(event, '_v_expansions', None)
+            if expansions is None:
+                expansions = event._v_expansions = _Expansions()
+        finally:
+            self._lock.release()
+        # an entry costs at least one, even without occurrences
+        if not self._cache.set((expansions, period), occurrences,
+                               len(occurrences) + 1):
+            return
+        self._lock.acquire()
+        try:
+            expansions.periods[period] = None
+        finally:
+            self._lock.release()
+
+    def invalidate(self, event):
+        self._lock.acquire()
+        try:
+            expansions = getattr(event, '_v_expansions', None)
+            if expansions is None:
+                return
+            event._v_expansions = None
+            periods = expansions.periods.keys()
+            expansions.periods = {}
+        finally:
+            self._lock.release()
+        for period in periods:
+            self._cache.invalidate((expansions, period))
+
+    def clear(self):
+        # events keep their expansions keys, which are found no more
+        self._cache.clear()
+
+    def setMaxOccurrences(self, max_occurrences):
+        self._cache.setMaxCost(max_occurrences)
+
+    def resetStatistics(self):
+        self._cache.resetStatistics()
+
+    # ACCESSORS
+
+    def get(self, event, period):
+        """Return the cached occurrences of event in period, or None.
+        """
+        # without expansions, this is a miss like any unknown period
+        expansions = getattr(event, '_v_expansions', None)
+        return self._cache.get((expansions, period))
+
+    def getStatistics(self):
+        """Return the hits, misses, entries, occurrences cached and the
+        maximum number of occurrences, in a dictionary.
+        """
+        stats = self._cache.getStatistics()
+        return {'hits': stats['hits'],
+                'misses': stats['misses'],
+                'entries': stats['entries'],
+                'occurrences': stats['cost'] - stats['entries'],
+                'max_occurrences': stats['maxcost']}
+
+    # PRIVATE
+
+    def _dropped(self, (expansions, period)):
+        self._lock.acquire()
+        try:
+            expansions.periods.pop(period, None)
+        finally:
+            self._lock.release()
+
+expansion_cache = ExpansionCache()
+
+class ExportCache:
+    """Cache of events exported as iCalendar text.
+
+    Texts are kept by what export() puts in them, as told by the
+    _getExportKey method of events, with and without private
+    information, up to a total size, dropping the least recently used
+    ones. An event changed in any way, notified or not, in this
+    transaction or another one, is therefore never found with its old
+    text.
+    """
+
+    def __init__(self, max_size=10000000):
+        self._cache = cache.LRUCache(max_size)
+
+    # MANIPULATORS
+
+    def set(self, event, private, text):
+        key = event._getExportKey(private)
+        if key is not None:
+            self._cache.set(key, text, len(text))
+
+    def invalidate(self, event):
+        for private in (False, True):
+            key = event._getExportKey(private)
+            if key is not None:
+                self._cache.invalidate(key)
+
+    def clear(self):
+        self._cache.clear()
+
+    def setMaxSize(self, max_size):
+        self._cache.setMaxCost(max_size)
+
+    def resetStatistics(self):
+        self._cache.resetStatistics()
+
+    # ACCESSORS
+
+    def get(self, event, private):
+        """Return the cached text of event, or None.
+        """
+        key = event._getExportKey(private)
+        if key is None:
+            return None
+        return self._cache.get(key)
+
+    def getStatistics(self):
+        """Return the hits, misses, entries, size cached and the maximum
+        size, in a dictionary.
+        """
+        stats = self._cache.getStatistics()
+        return {'hits': stats['hits'],
+                'misses': stats['misses'],
+                'entries': stats['entries'],
+                'size': stats['cost'],
+                'max_size': stats['maxcost']}
+
+def _getImportState(event):
+    """Return a fingerprint of the values of event an import sets.
+
+    Changes of these values are found this way, notified or not.
+    """
+    state = (_getExportValues(event, False), event.getOrganizerId(),
+             sorted(event._participation_state.items()),
+             sorted(event._participation_role.items()))
+    return sha1(repr(state)).hexdigest()
+
+def _getExportValues(event, private):
+    """Return the values of event that EventBase.export uses.
+    """
+    recurrence = event.recurrence
+    if recurrence is not None:
+        recurrence = (recurrence.ical_freq, recurrence.interval,
+                      recurrence.count, recurrence.until)
+    return (bool(private), event.unique_id, event.allday, event.dtstart,
+            event.duration, recurrence, event.transparent, event.access,
+            event.title, event.description, event.location,
+            tuple(event.categories or ()), event.document, event.status)
+
+export_cache = ExportCache()
+
+# the query caches to invalidate when events change
+class _ThreadState(local):
+    """Values kept for objects by the current thread.
+
+    They are not kept on the objects, where ZODB would drop them along
+    with volatile attributes when deactivating the objects, and each
+    thread has its own.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def get(self, obj):
+        entry = self._values.get(id(obj))
+        if entry is None:
+            return None
+        return entry[1]
+
+    def set(self, obj, value):
+        if value is None:
+            self._values.pop(id(obj), None)
+        else:
+            # obj is kept so that its id is not reused
+            self._values[id(obj)] = (obj, value)
+
+# batches of changes and events to index, by storage
+_batches = _ThreadState()
+_deferred = _ThreadState()
+
+class _Batch:
+    """Changes of events notified during a batch, by unique id.
+
+    Changes to the same event are coalesced: an event created and then
+    modified was created, an event created and then deleted is not
+    reported at all.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        # 'created', 'modified', 'deleted' or None by unique id
+        self._changes = {}
+        # unique ids in the order they were first notified
+        self._order = []
+        # the last event notified by unique id
+        self._events = {}
+
+    def add(self, eventevent):
+        unique_id = eventevent.event.unique_id
+        old = self._changes.get(unique_id)
+        if IEventDeletedEvent.providedBy(eventevent):
+            if old == 'created':
+                change = None
+            else:
+                change = 'deleted'
+        elif IEventCreatedEvent.providedBy(eventevent):
+            if old == 'deleted':
+                change = 'modified'
+            else:
+                change = 'created'
+        elif not self._events.has_key(unique_id):
+            change = 'modified'
+        else:
+            change = old
+        if not self._events.has_key(unique_id):
+            self._order.append(unique_id)
+        self._changes[unique_id] = change
+        self._events[unique_id] = eventevent.event
+
+    def getBatchEvent(self):
+        changes = {'created': [], 'modified': [], 'deleted': []}
+        for unique_id in self._order:
+            change = self._changes[unique_id]
+            if change is not None:
+                changes[change].append(unique_id)
+        return EventBatchEvent(changes['created'], changes['modified'],
+                               changes['deleted'], self._events)
+
+def _iterBatchChanges(batchevent):
+    """Generate (event, deleted) for the events changed in a batch.
+    """
+    stored = dict.fromkeys(batchevent.created + batchevent.modified)
+    for unique_id, event in batchevent.events.items():
+        yield event, not stored.has_key(unique_id)
+
+class _TransactionScope:
+    """Tell when the current transaction is not the one of last time.
+
+    Without the transaction package, it always is.
+    """
+
+    def __init__(self):
+        self._transaction = None
+
+    def changed(self):
+        if transaction is None:
+            return False
+        current = transaction.get()
+        if self._transaction is not None and self._transaction() is current:
+            return False
+        # finished transactions are not kept alive
+        self._transaction = weakref.ref(current)
+        return True
+
+_query_caches = WeakKeyDictionary()
+
+class QueryCache:
+    """Cache of storage manager query results.
+
+    Results are kept by (query, period, search criteria key), up to a
+    total number of events or occurrences, dropping the least recently
+    used ones. When an event is created, modified or deleted, the only
+    results dropped are those that contained it and those whose period
+    and attendees it falls within.
+
+    With the transaction package, results are only kept during the
+    transaction they were found in: after an abort, or in a transaction
+    seeing changes other ZODB clients committed, they may be stale.
+    """
+
+    def __init__(self, max_results=10000):
+        self._cache = cache.LRUCache(max_results, self._forget)
+        self._transaction = _TransactionScope()
+        # (period, attendee ids, event ids) of the results, by key
+        self._scopes = {}
+        # keys by the ids of the events in the results
+        self._by_event = {}
+        # keys by attendee id, for results restricted to attendees
+        self._by_attendee = {}
+        # keys of results not restricted to attendees
+        self._unscoped = {}
+        _query_caches[self] = None
+
+    # MANIPULATORS
+
+    def set(self, key, result, period, search_criteria):
+        """Cache result, a list of events or occurrences.
+        """
+        self._checkTransaction()
+        if self._scopes.has_key(key):
+            self.invalidate(key)
+        attendee_ids = None
+        if search_criteria.attendees is not None:
+            attendee_ids = [attendee.getAttendeeId()
+                            for attendee in search_criteria.attendees]
+        # occurrences refer to their event
+        event_ids = dict.fromkeys([getattr(item, 'original', item).unique_id
+                                   for item in result]).keys()
+        self._scopes[key] = (tuple(period), attendee_ids, event_ids)
+        for event_id in event_ids:
+            self._by_event.setdefault(event_id, {})[key] = None
+        if attendee_ids is None:
+            self._unscoped[key] = None
+        else:
+            for attendee_id in attendee_ids:
+                self._by_attendee.setdefault(attendee_id, {})[key] = None
+        # a result costs at least one, even when empty
+        self._cache.set(key, result, len(result) + 1)
+        if not self._cache.has_key(key):
+            # too big to be kept
+            self._forget(key)
+
+    def invalidate(self, key):
+        self._cache.invalidate(key)
+        self._forget(key)
+
+    def invalidateEvent(self, event, deleted=False):
+        """Drop the results event is or may now be part of.
+        """
+        keys = self._by_event.get(event.unique_id, {}).copy()
+        if not deleted:
+            begins, ends = getOccurrencesSpan(event)
+            candidates = self._unscoped.keys()
+            for attendee_id in event.getAttendeeIds():
+                candidates.extend(self._by_attendee.get(attendee_id, ()))
+            for key in candidates:
+                scope = self._scopes.get(key)
+                if scope is None:
+                    continue
+                period_begins, period_ends = scope[0]
+                if period_begins is not None and ends <= period_begins:
+                    continue
+                if period_ends is not None and begins >= period_ends:
+                    continue
+                keys[key] = None
+        for key in keys:
+            self.invalidate(key)
+
+    def clear(self):
+        self._cache.clear()
+        self._scopes = {}
+        self._by_event = {}
+        self._by_attendee = {}
+        self._unscoped = {}
+
+    def resetStatistics(self):
+        self._cache.resetStatistics()
+
+    # ACCESSORS
+
+    def get(self, key):
+        """Return the cached result for key, or None.
+        """
+        self._checkTransaction()
+        return self._cache.get(key)
+
+    def getStatistics(self):
+        """Return hits, misses, entries, cost and maxcost in a dictionary.
+
+        The cost is the number of events and occurrences cached, plus
+        one for each entry.
+        """
+        return self._cache.getStatistics()
+
+    # PRIVATE
+
+    def _checkTransaction(self):
+        if self._transaction.changed():
+            self.clear()
+
+    def _forget(self, key):
+        scope = self._scopes.pop(key, None)
+        if scope is None:
+            return
+        period, attendee_ids, event_ids = scope
+        if attendee_ids is None:
+            self._unscoped.pop(key, None)
+        else:
+            _discard(self._by_attendee, attendee_ids, key)
+        _discard(self._by_event, event_ids, key)
+
+# the busy indexes to update when events change
+_busy_indexes = WeakKeyDictionary()
+
+class BusyIndex:
+    """Busy periods of attendees, over a horizon around today.
+
+    The horizon is a (before, after) pair of timedeltas from today. For
+    each attendee asked about, the periods of the occurrences blocking
+    the attendee are kept by event, and merged when asked for. The
+    events are found through the busy index of the storage, when it
+    has one. Created, modified and deleted events and participation
+    changes only recompute the periods of that event.
+
+    Attendees are loaded again when the day changes and the horizon
+    moves with it, and with the transaction package in each
+    transaction: after an abort, or in a transaction seeing changes
+    other ZODB clients committed, their periods may be stale.
+    """
+
+    def __init__(self, storage_manager, horizon=(timedelta(days=-30),
+                                                  timedelta(days=365))):
+        self._storage_manager = storage_manager
+        self.horizon = horizon
+        self._transaction = _TransactionScope()
+        self._clear()
+        _busy_indexes[self] = None
+
+    # MANIPULATORS
+
+    def rebuild(self):
+        """Forget the busy periods of all attendees, moving the horizon
+        to today.
+        """
+        self._clear()
+        today = date.today()
+        midnight = time(0, 0)
+        self._period = (combine(today + self.horizon[0], midnight),
+                        combine(today + self.horizon[1], midnight))
+        self._day = today
+
+    def eventChanged(self, event, deleted=False):
+        """Recompute the busy periods of event.
+        """
+        if self._day is None:
+            # not built yet
+            return
+        unique_id = event.unique_id
+        if deleted:
+            # an event with the same id may be left in our storage
+            if not self._storage_manager.hasEvent(unique_id):
+                self._remove(unique_id)
+            return
+        if not self._isOwn(event):
+            return
+        self._remove(unique_id)
+        self._add(event)
+
+    # ACCESSORS
+
+    def covers(self, period):
+        """Tell whether period is within the horizon.
+        """
+        self._update()
+        begins, ends = period
+        return self._period[0] <= begins and ends <= self._period[1]
+
+    def getBusyPeriods(self, attendee_ids, period):
+        """Return the periods any of attendee_ids is busy in within period.
+
+        Periods are clipped to period, merged and sorted.
+        """
+        self._update()
+        return merge([self._getMerged(attendee_id).window(period)
+                      for attendee_id in attendee_ids]).getPeriods()
+
+    def getPeriod(self):
+        """Return the period the horizon covers today.
+        """
+        self._update()
+        return self._period
+
+    # PRIVATE
+
+    def _clear(self):
+        self._period = None
+        self._day = None
+        # periods by unique id by id of the attendees loaded
+        self._busy = {}
+        # merged periods by attendee id, computed when needed
+        self._merged = {}
+        # ids of the attendees loaded by unique id
+        self._attendee_ids = {}
+
+    def _update(self):
+        if self._transaction.changed() or self._day != date.today():
+            self.rebuild()
+
+    def _isOwn(self, event):
+        try:
+            return self._storage_manager.getEvent(event.unique_id) is event
+        except KeyError:
+            return False
+
+    def _getPeriods(self, event):
+        return [(occ.dtstart, occ.dtstart + occ.duration)
+                for occ in event.expand(self._period)]
+
+    def _add(self, event):
+        # attendees not loaded get the event when they are
+        attendee_ids = [attendee_id
+                        for attendee_id in _getBlockedAttendeeIds(event)
+                        if self._busy.has_key(attendee_id)]
+        if not attendee_ids:
+            return
+        periods = self._getPeriods(event)
+        if not periods:
+            return
+        unique_id = event.unique_id
+        self._attendee_ids[unique_id] = attendee_ids
+        for attendee_id in attendee_ids:
+            self._busy[attendee_id][unique_id] = periods
+            self._merged.pop(attendee_id, None)
+
+    def _remove(self, unique_id):
+        for attendee_id in self._attendee_ids.pop(unique_id, ()):
+            del self._busy[attendee_id][unique_id]
+            self._merged.pop(attendee_id, None)
+
+    def _load(self, attendee_id):
+        busy = self._busy[attendee_id] = {}
+        storage = self._storage_manager._storage
+        for event in storage._getBlockingEvents(attendee_id, self._period):
+            periods = self._getPeriods(event)
+            if periods:
+                unique_id = event.unique_id
+                busy[unique_id] = periods
+                self._attendee_ids.setdefault(unique_id, []).append(
+                    attendee_id)
+        return busy
+
+    def _getMerged(self, attendee_id):
+        merged = self._merged.get(attendee_id)
+        if merged is None:
+            busy = self._busy.get(attendee_id)
+            if busy is None:
+                busy = self._load(attendee_id)
+            periods = []
+            for event_periods in busy.values():
+                periods.extend(event_periods)
+            merged = self._merged[attendee_id] = IntervalSet(periods)
+        return merged
+
+def _discard(keys_by_id, ids, key):
+    for id in ids:
+        keys = keys_by_id.get(id)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del keys_by_id[id]
+
+def queryCacheSubscriber(eventevent):
+    """Drop cached query results affected by a created, modified or
+    deleted event.
+    """
+    if IEventBatchEvent.providedBy(eventevent):
+        changes = list(_iterBatchChanges(eventevent))
+    elif IEventEvent.providedBy(eventevent):
+        changes = [(eventevent.event,
+                    IEventDeletedEvent.providedBy(eventevent))]
+    else:
+        return
+    for query_cache in _query_caches.keys():
+        for event, deleted in changes:
+            query_cache.invalidateEvent(event, deleted)
+
+def busyIndexSubscriber(eventevent):
+    """Update the busy indexes for created, modified and deleted events
+    and changes of participation.
+    """
+    if IEventBatchEvent.providedBy(eventevent):
+        changes = list(_iterBatchChanges(eventevent))
+    elif IEventEvent.providedBy(eventevent):
+        changes = [(eventevent.event,
+                    IEventDeletedEvent.providedBy(eventevent))]
+    else:
+        return
+    for busy_index in _busy_indexes.keys():
+        for event, deleted in changes:
+            busy_index.eventChanged(event, deleted)
+
+def expansionCacheSubscriber(eventevent):
+    """Forget the expansions of deleted events.
+
+    Modified events forget theirs when they are reindexed.
+    """
+    if IEventBatchEvent.providedBy(eventevent):
+        for event, deleted in _iterBatchChanges(eventevent):
+            if deleted:
+                expansion_cache.invalidate(event)
+    elif IEventDeletedEvent.providedBy(eventevent):
+        expansion_cache.invalidate(eventevent.event)
+
+def exportCacheSubscriber(eventevent):
+    """Forget the exports of deleted events.
+
+    Exports of modified events are not found anymore, and are dropped
+    as the least recently used.
+    """
+    if IEventBatchEvent.providedBy(eventevent):
+        for event, deleted in _iterBatchChanges(eventevent):
+            if deleted:
+                export_cache.invalidate(event)
+    elif IEventDeletedEvent.providedBy(eventevent):
+        export_cache.invalidate(eventevent.event)
+
+def reindexSubscriber(eventevent):
+    """Keep storage indexes up to date when an event is modified.
+    """
+    if IEventParticipationChangeEvent.providedBy(eventevent):
+        # the event reindexed what depends on participation already
+        return
+    if IEventModifiedEvent.providedBy(eventevent):
+        reindex = getattr(eventevent.event, '_reindex', None)
+        if reindex is not None:
+            reindex()
+
+# in the order they must be called
+_subscribers = (reindexSubscriber,
+                expansionCacheSubscriber,
+                exportCacheSubscriber,
+                queryCacheSubscriber,
+                busyIndexSubscriber)
+
+def registerSubscribers():
+    """Register the subscribers keeping indexes and caches up to date.
+
+    This is done when the module is imported. Subscribers registered
+    already are not registered again, e.g. when the module is reloaded.
+    """
+    for subscriber in _subscribers:
+        for registered in subscribers:
+            if (getattr(registered, '__module__', None) == __name__ and
+                getattr(registered, '__name__', None) ==
+                subscriber.__name__):
+                break
+        else:
+            subscribers.append(subscriber)
+
+registerSubscribers()
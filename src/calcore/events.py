@@ -20,7 +20,7 @@
 from zope.interface import implements
 
 from interfaces import IEventEvent, IEventCreatedEvent, IEventDeletedEvent, \
-     IEventModifiedEvent, IEventParticipationChangeEvent
+     IEventModifiedEvent, IEventParticipationChangeEvent, IEventBatchEvent
 
 class EventEvent(object):
     
@@ -54,3 +54,14 @@ class EventParticipationChangeEvent(EventModifiedEvent):
         self.attendee = attendee
         self.old_status = old_status
         self.new_status = new_status
+
+
+class EventBatchEvent(object):
+
+    implements(IEventBatchEvent)
+
+    def __init__(self, created, modified, deleted, events):
+        self.created = created
+        self.modified = modified
+        self.deleted = deleted
+        self.events = events
@@ -0,0 +1,133 @@
+# -*- coding: ISO-8859-15 -*-
+# (C) Copyright 2005 Nuxeo SARL <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+# $Id$
+
+"""Free/busy time kept as bitmaps.
+
+The period looked at is cut into slots of a fixed duration, the
+granularity. The busy time of an attendee is a bitmap, a long integer
+with the bit of each slot the attendee is busy in set. The busy time of
+a group is then the bitwise or of the bitmaps of its members, and free
+time is found by scanning for runs of free slots within working hours.
+"""
+
+from datetime import datetime, timedelta
+
+class FreeBusyMap:
+    """Busy time of attendees in a period, by slots.
+
+    Slots start at the beginning of the period. A slot an attendee is
+    busy in for any part of it counts as busy.
+    """
+
+    def __init__(self, period, granularity=timedelta(minutes=15)):
+        self.period = period
+        self.granularity = granularity
+        self._granularity = _micros(granularity)
+        self._slots = self._slot(period[1], True)
+        self._busy = {}
+
+    # MANIPULATORS
+
+    def addBusy(self, key, (dtstart, dtend)):
+        """Mark key (an attendee id) busy from dtstart to dtend.
+        """
+        first = max(self._slot(dtstart), 0)
+        last = min(self._slot(dtend, True), self._slots)
+        if first >= last:
+            return
+        self._busy[key] = self._busy.get(key, 0) | _bits(first, last)
+
+    # ACCESSORS
+
+    def getBusy(self, keys):
+        """Return the bitmap of the slots any of keys is busy in.
+        """
+        busy = 0
+        for key in keys:
+            busy |= self._busy.get(key, 0)
+        return busy
+
+    def getWorkingHours(self, (time_begins, time_ends)):
+        """Return the bitmap of the slots within the hours of each day.
+        """
+        begins, ends = self.period
+        mask = 0
+        day = begins.date()
+        while day <= ends.date():
+            first = self._slot(datetime.combine(day, time_begins), True)
+            last = self._slot(datetime.combine(day, time_ends))
+            first = max(first, 0)
+            last = min(last, self._slot(ends))
+            if first < last:
+                mask |= _bits(first, last)
+            day += timedelta(days=1)
+        return mask
+
+    def getFreePeriods(self, keys, time_period, minimal_duration=None):
+        """Return the periods within time_period none of keys is busy in.
+
+        Periods are (start, end) tuples, in order.
+        """
+        free = self.getWorkingHours(time_period) & ~self.getBusy(keys)
+        begins = self.period[0]
+        result = []
+        for first, last in _runs(free):
+            start = begins + self.granularity * first
+            end = begins + self.granularity * last
+            if (minimal_duration is not None and
+                end - start < minimal_duration):
+                continue
+            result.append((start, end))
+        return result
+
+    # PRIVATE
+
+    def _slot(self, dt, round_up=False):
+        """Return the number of the slot dt falls in.
+
+        If round_up is set, a dt within a slot gives the next slot.
+        """
+        offset = _micros(dt - self.period[0])
+        if round_up:
+            return -(-offset // self._granularity)
+        return offset // self._granularity
+
+def _runs(bitmap):
+    """Generate (first, last) for the runs of set bits in bitmap.
+
+    last is the first bit after the run.
+    """
+    # the bits as a string, lowest first
+    bits = bin(bitmap)[:1:-1]
+    position = 0
+    while True:
+        first = bits.find('1', position)
+        if first < 0:
+            return
+        last = bits.find('0', first)
+        if last < 0:
+            last = len(bits)
+        yield first, last
+        position = last
+
+def _bits(first, last):
+    return ((1L << (last - first)) - 1) << first
+
+def _micros(td):
+    return (td.days * 86400 + td.seconds) * 1000000 + td.microseconds
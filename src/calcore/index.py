@@ -0,0 +1,513 @@
+# -*- coding: ISO-8859-15 -*-
+# (C) Copyright 2005 Nuxeo SARL <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+# $Id$
+
+"""Indexes used by storages to avoid scanning all events.
+
+With ZODB, indexes keep their data in BTrees, and the nodes of period
+trees are persistent objects of their own, so an update only writes the
+few records it changes. Without it, builtin types are used instead.
+"""
+
+from random import Random
+
+try:
+    from persistent import Persistent
+except ImportError:
+    Persistent = None
+
+try:
+    from BTrees.OOBTree import OOBTree, OOTreeSet
+    from BTrees.Length import Length
+except ImportError:
+    OOBTree = None
+
+if Persistent is not None:
+    _IndexBase = Persistent
+else:
+    _IndexBase = object
+
+if OOBTree is not None:
+    _Mapping = OOBTree
+    _Set = OOTreeSet
+    _Length = Length
+else:
+    _Mapping = dict
+    _Set = set
+
+    class _Length(object):
+        """A counter, with the API of BTrees.Length.
+        """
+
+        def __init__(self, value=0):
+            self.value = value
+
+        def change(self, delta):
+            self.value += delta
+
+        def __call__(self):
+            return self.value
+
+# priorities of tree nodes, kept apart from the global random state
+_random = Random()
+
+class _Node(_IndexBase):
+    if Persistent is None:
+        __slots__ = ('start', 'end', 'key', 'priority', 'maxend', 'size',
+                     'left', 'right')
+
+        # nodes have no __dict__, pickle them as tuples for all protocols
+
+        def __getstate__(self):
+            return (self.start, self.end, self.key, self.priority,
+                    self.maxend, self.size, self.left, self.right)
+
+        def __setstate__(self, state):
+            (self.start, self.end, self.key, self.priority,
+             self.maxend, self.size, self.left, self.right) = state
+
+    def __init__(self, start, end, key):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.priority = _random.random()
+        self.maxend = end
+        self.size = 1
+        self.left = None
+        self.right = None
+
+def _size(node):
+    if node is None:
+        return 0
+    return node.size
+
+def _update(node):
+    maxend = node.end
+    size = 1
+    left = node.left
+    right = node.right
+    if left is not None:
+        size += left.size
+        if left.maxend > maxend:
+            maxend = left.maxend
+    if right is not None:
+        size += right.size
+        if right.maxend > maxend:
+            maxend = right.maxend
+    # persistent nodes are only written when they change
+    if node.maxend != maxend:
+        node.maxend = maxend
+    if node.size != size:
+        node.size = size
+
+def _setLeft(node, left):
+    if node.left is not left:
+        node.left = left
+
+def _setRight(node, right):
+    if node.right is not right:
+        node.right = right
+
+def _insert(node, new):
+    if node is None:
+        return new
+    if (new.start, new.key) < (node.start, node.key):
+        _setLeft(node, _insert(node.left, new))
+        if node.left.priority > node.priority:
+            # rotate right
+            top = node.left
+            node.left = top.right
+            _update(node)
+            top.right = node
+            node = top
+    else:
+        _setRight(node, _insert(node.right, new))
+        if node.right.priority > node.priority:
+            # rotate left
+            top = node.right
+            node.right = top.left
+            _update(node)
+            top.left = node
+            node = top
+    _update(node)
+    return node
+
+def _merge(left, right):
+    # all nodes in left sort before all nodes in right
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        _setRight(left, _merge(left.right, right))
+        _update(left)
+        return left
+    _setLeft(right, _merge(left, right.left))
+    _update(right)
+    return right
+
+def _remove(node, start, key):
+    if node is None:
+        raise KeyError(key)
+    if (start, key) < (node.start, node.key):
+        _setLeft(node, _remove(node.left, start, key))
+    elif (start, key) > (node.start, node.key):
+        _setRight(node, _remove(node.right, start, key))
+    else:
+        return _merge(node.left, node.right)
+    _update(node)
+    return node
+
+def _countLeft(node, start):
+    """Return the number of nodes starting before start.
+    """
+    result = 0
+    while node is not None:
+        if node.start < start:
+            result += _size(node.left) + 1
+            node = node.right
+        else:
+            node = node.left
+    return result
+
+def _countRight(node, start):
+    """Return the number of nodes starting at or before start.
+    """
+    result = 0
+    while node is not None:
+        if node.start <= start:
+            result += _size(node.left) + 1
+            node = node.right
+        else:
+            node = node.left
+    return result
+
+class PeriodIndex(_IndexBase):
+    """Index keys by half-open (start, end) periods.
+
+    This is an interval tree: a randomized balanced search tree (treap)
+    ordered on start, where each node also records the largest end found
+    in its subtree. Indexing and unindexing take O(log n); finding
+    all periods overlapping a query period skips every subtree that
+    ends before the query starts or starts after it ends.
+
+    Nodes also record the size of their subtree, and a second tree
+    orders the periods on their end, so the number of periods
+    overlapping a query period can be counted in O(log n).
+    """
+
+    def __init__(self):
+        self._root = None
+        self._end_root = None
+        self._periods = _Mapping()
+
+    # MANIPULATORS
+
+    def index(self, key, period):
+        """Index key for a (start, end) period, replacing any old period.
+        """
+        old = self._periods.get(key)
+        if old is not None:
+            if old == period:
+                return
+            self.unindex(key)
+        start, end = period
+        self._setRoots(_insert(self._root, _Node(start, end, key)),
+                       _insert(self._end_root, _Node(end, end, key)))
+        self._periods[key] = period
+
+    def unindex(self, key):
+        """Remove key from the index. Unknown keys are ignored.
+        """
+        old = self._periods.get(key)
+        if old is None:
+            return
+        del self._periods[key]
+        start, end = old
+        self._setRoots(_remove(self._root, start, key),
+                       _remove(self._end_root, end, key))
+
+    def clear(self):
+        self._root = None
+        self._end_root = None
+        self._periods = _Mapping()
+
+    # ACCESSORS
+
+    def __len__(self):
+        return _size(self._root)
+
+    def has_key(self, key):
+        return self._periods.has_key(key)
+
+    def getPeriod(self, key):
+        """Return the (start, end) period key is indexed with.
+        """
+        return self._periods[key]
+
+    def search(self, (begins, ends)):
+        """Return keys whose period overlaps the given period.
+
+        The period is half-open like the indexed periods; either side
+        may be None, meaning unbounded. Keys are returned in start order.
+        """
+        result = []
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            if node is not None:
+                if begins is not None and node.maxend <= begins:
+                    # nothing in this subtree ends after the period begins
+                    node = None
+                    continue
+                stack.append(node)
+                node = node.left
+                continue
+            node = stack.pop()
+            if ends is not None and node.start >= ends:
+                # nodes are visited in start order, we're done
+                break
+            if begins is None or node.end > begins:
+                result.append(node.key)
+            node = node.right
+        return result
+
+    def count(self, (begins, ends)):
+        """Return the number of keys whose period overlaps the given period.
+        """
+        # periods that do not overlap either start at or after the end of
+        # the period, or end at or before its beginning, never both
+        if ends is None:
+            result = _size(self._root)
+        else:
+            result = _countLeft(self._root, ends)
+        if begins is not None:
+            result -= _countRight(self._end_root, begins)
+        return result
+
+    def filter(self, keys, (begins, ends)):
+        """Return the keys among keys whose period overlaps the given period.
+        """
+        periods = self._periods
+        result = []
+        for key in keys:
+            start, end = periods[key]
+            if ends is not None and start >= ends:
+                continue
+            if begins is not None and end <= begins:
+                continue
+            result.append(key)
+        return result
+
+    # PRIVATE
+
+    def _setRoots(self, root, end_root):
+        # the index itself is only written when a root changes
+        if root is not self._root:
+            self._root = root
+        if end_root is not self._end_root:
+            self._end_root = end_root
+
+_empty = frozenset()
+
+class KeywordIndex(_IndexBase):
+    """Index keys by any number of hashable values.
+
+    This is an inverted index: for each value it keeps the set of keys
+    indexed with it, so finding all keys with a value is a lookup.
+    """
+
+    def __init__(self):
+        self._index = _Mapping()
+        self._counts = _Mapping()
+        self._unindex = _Mapping()
+        self._length = _Length()
+
+    # MANIPULATORS
+
+    def index(self, key, values):
+        """Index key with values, replacing any old values.
+        """
+        values = frozenset(values)
+        old = self._unindex.get(key, _empty)
+        if old == values:
+            return
+        for value in old - values:
+            count = self._counts[value]
+            if count() == 1:
+                del self._index[value]
+                del self._counts[value]
+            else:
+                self._index[value].remove(key)
+                count.change(-1)
+        for value in values - old:
+            keys = self._index.get(value)
+            if keys is None:
+                keys = self._index[value] = _Set()
+                self._counts[value] = _Length()
+            keys.add(key)
+            self._counts[value].change(1)
+        if values:
+            self._unindex[key] = values
+            if not old:
+                self._length.change(1)
+        else:
+            del self._unindex[key]
+            self._length.change(-1)
+
+    def unindex(self, key):
+        """Remove key from the index. Unknown keys are ignored.
+        """
+        self.index(key, ())
+
+    def clear(self):
+        self._index = _Mapping()
+        self._counts = _Mapping()
+        self._unindex = _Mapping()
+        self._length = _Length()
+
+    # ACCESSORS
+
+    def __len__(self):
+        return self._length()
+
+    def has_key(self, key):
+        return self._unindex.has_key(key)
+
+    def getValues(self, key):
+        """Return the values key is indexed with.
+        """
+        return self._unindex.get(key, _empty)
+
+    def search(self, value):
+        """Return the set of keys indexed with value.
+
+        The returned set must not be modified.
+        """
+        return self._index.get(value, _empty)
+
+    def count(self, value):
+        """Return the number of keys indexed with value.
+        """
+        count = self._counts.get(value)
+        if count is None:
+            return 0
+        return count()
+
+    def searchAny(self, values):
+        """Return the set of keys indexed with any of values.
+        """
+        result = set()
+        for value in values:
+            result.update(self._index.get(value, _empty))
+        return result
+
+    def countAny(self, values):
+        """Return an upper bound of the number of keys searchAny returns.
+        """
+        result = 0
+        for value in values:
+            result += self.count(value)
+        return result
+
+    def filterAny(self, keys, values):
+        """Return the keys among keys indexed with any of values.
+        """
+        values = frozenset(values)
+        unindex = self._unindex
+        return [key for key in keys
+                if not values.isdisjoint(unindex.get(key, _empty))]
+
+class KeywordPeriodIndex(_IndexBase):
+    """Index keys by a period, for each of any number of hashable values.
+
+    There is a PeriodIndex for each value, so finding the keys indexed
+    with a value whose period overlaps a query period takes O(log n),
+    n being the number of keys with that value, plus the keys found.
+    """
+
+    def __init__(self):
+        self._indexes = _Mapping()
+        self._unindex = _Mapping()
+        self._length = _Length()
+
+    # MANIPULATORS
+
+    def index(self, key, (period, values)):
+        """Index key for period with values, replacing any old ones.
+        """
+        values = frozenset(values)
+        old = self._unindex.get(key)
+        if old is None:
+            old_values = _empty
+        else:
+            if old == (period, values):
+                return
+            old_values = old[1]
+        for value in old_values - values:
+            idx = self._indexes[value]
+            idx.unindex(key)
+            if not len(idx):
+                del self._indexes[value]
+        for value in values:
+            idx = self._indexes.get(value)
+            if idx is None:
+                idx = self._indexes[value] = PeriodIndex()
+            # nothing to do if the period is the same
+            idx.index(key, period)
+        if values:
+            self._unindex[key] = (period, values)
+            if old is None:
+                self._length.change(1)
+        elif old is not None:
+            del self._unindex[key]
+            self._length.change(-1)
+
+    def unindex(self, key):
+        """Remove key from the index. Unknown keys are ignored.
+        """
+        self.index(key, (None, ()))
+
+    def clear(self):
+        self._indexes = _Mapping()
+        self._unindex = _Mapping()
+        self._length = _Length()
+
+    # ACCESSORS
+
+    def __len__(self):
+        return self._length()
+
+    def has_key(self, key):
+        return self._unindex.has_key(key)
+
+    def search(self, value, period):
+        """Return the keys indexed with value whose period overlaps period.
+        """
+        idx = self._indexes.get(value)
+        if idx is None:
+            return []
+        return idx.search(period)
+
+    def count(self, value, period):
+        """Return the number of keys search would return.
+        """
+        idx = self._indexes.get(value)
+        if idx is None:
+            return 0
+        return idx.count(period)
@@ -58,7 +58,109 @@ class IStorageManager(Interface):
         """Delete event from storage.
         """
 
+    def beginBatch():
+        """Start a batch of changes.
+
+        Until commitBatch is called, creations, deletions and changes
+        notified through notifyEvent are only recorded, and the storage
+        defers indexing. Participation changes of its events are
+        recorded too. Searches made meanwhile first index the events
+        changed so far, and do not use the query cache or the busy
+        index. Batches nest, and belong to the thread that began them.
+        """
+
+    def commitBatch():
+        """End a batch of changes.
+
+        Events changed in the batch are indexed, and a single
+        IEventBatchEvent lists the unique ids of the events created,
+        modified and deleted. Several changes of an event are reported
+        once.
+        """
+
+    def notifyEvent(eventevent):
+        """Notify eventevent, an IEventEvent, unless within a batch.
+        """
+
+    def enableQueryCache(max_results=10000):
+        """Cache the results of getEvents, getOccurrences and
+        getOccurrencesSegmented.
+
+        At most max_results events and occurrences are kept, the least
+        recently used results are dropped first. Results are dropped
+        when events are created, modified or deleted, so changes need
+        notifications: events changed directly are found as they were
+        until then. The cache is not persistent. With ZODB, results are
+        only kept within the transaction of the current thread, as
+        after an abort, or once changes committed by other clients are
+        seen, they may be stale.
+        """
+
+    def disableQueryCache():
+        """Stop caching query results.
+        """
+
+    def enableBusyIndex(horizon=None):
+        """Keep the busy periods of each attendee in a BusyIndex.
+
+        horizon is a (before, after) pair of timedeltas relative to
+        today, by default 30 days before until 365 days after. Periods
+        within the horizon are answered by getBlockedPeriods and
+        getFreePeriods from the index, which is updated when events are
+        created, modified or deleted and participation changes, so
+        changes need notifications. The index is not persistent: the
+        periods of each attendee are found when first asked for, again
+        each day and, with ZODB, in each transaction of the current
+        thread, as after an abort, or once changes committed by other
+        clients are seen, they may be stale.
+        """
+
+    def disableBusyIndex():
+        """Stop keeping a busy index.
+        """
+
+    def setConflictPolicy(policy):
+        """Set how double bookings of rooms are handled.
+
+        When an event is created or attendees are invited, rooms already
+        booked at the same time are looked for, and policy decides what
+        happens:
+
+        None - nothing, rooms are not checked (the default)
+        'reject' - DoubleBookingError is raised, the event is not
+          created and nobody is invited
+        'warn' - a warning is logged, the room is booked anyway
+        'decline' - the room declines the event
+
+        The policy is kept by the storage.
+        """
+
     # ACCESSORS
+    def getQueryCache():
+        """Return the query cache, or None if results are not cached.
+
+        The cache has a getStatistics() method returning its hits and
+        misses.
+        """
+
+    def getBusyIndex():
+        """Return the busy index, or None if there is none.
+        """
+
+    def getConflictPolicy():
+        """Return how double bookings of rooms are handled.
+
+        See setConflictPolicy.
+        """
+
+    def getConflicts(event, attendees=None):
+        """Get the events booking attendees at the same time as event.
+
+        By default the attendees whose time event blocks are checked.
+        Returns the events in lists by attendee id, for the attendees
+        with conflicts only.
+        """
+
     def getEvent(event_id):
         """Get an event.
 
@@ -104,6 +206,35 @@ class IStorageManager(Interface):
         This returns ICalendarOccurrences.
         """
 
+    def getUpcomingOccurrences(after, limit, search_criteria=None):
+        """Get the first limit occurrences going on at after or later.
+
+        The period has no end. See IStorage.iterUpcomingOccurrences for
+        the order; only the occurrences needed are computed.
+        """
+
+    def getUpcomingOccurrencesPage(after, limit, search_criteria=None,
+                                   cursor=None):
+        """Get the upcoming occurrences page by page.
+
+        Returns the next limit occurrences after cursor and a cursor for
+        the next page, or None if there are no more occurrences. Start
+        with no cursor. The cursor only depends on the last occurrence
+        returned, so it still works after events have changed.
+        """
+
+    def iterOccurrences(period, search_criteria=None):
+        """Iterate over the occurrences in period, in dtstart order.
+
+        See IStorage.iterOccurrences.
+        """
+
+    def getOccurrenceBatch(period, search_criteria=None):
+        """Get calendar occurrences in period, expanded all at once.
+
+        See IStorage.getOccurrenceBatch.
+        """
+
     def getOccurrencesSegmented(period, search_criteria=None):
         """Like getOccurrences, but segmented by day.
 
@@ -111,6 +242,12 @@ class IStorageManager(Interface):
         each day.
         """
 
+    def explain(period, search_criteria=None):
+        """Report how the storage finds the events in period.
+
+        See IStorage.explain.
+        """
+
     def getBlockedPeriods(attendees, period, time_period):
         """Get all periods blocked for people in a particular period.
 
@@ -121,8 +258,15 @@ class IStorageManager(Interface):
         time_period - a start time, end time tuple
         """
 
+    def getFreeBusyMap(attendees, period, granularity=None):
+        """Get the busy time of attendees in period, as a FreeBusyMap.
+
+        period is cut into slots of granularity, a timedelta (15
+        minutes by default). The map is keyed by attendee id.
+        """
+
     def getFreePeriods(attendees, period, time_period,
-                     minimum_duration=None):
+                     minimum_duration=None, granularity=None):
         """Get all the free periods available for people in period.
 
         period - a start datetime, end datetime tuple
@@ -130,10 +274,62 @@ class IStorageManager(Interface):
           slots between these times in a day.
         minimum_duration - optional mininum duration of free slot we're
           interested in.
+        granularity - optional timedelta; if given, free time is looked
+          for in slots of that duration using a FreeBusyMap, slots only
+          partly busy counting as busy.
+        """
+
+    def getFreePeriodsByAttendee(attendees, period, time_period,
+                                 minimal_duration=None):
+        """Get the free periods of each of attendees in period.
+
+        Returns a dictionary of lists of free periods, as returned by
+        getFreePeriods for that attendee alone, by attendee id. The
+        events of all attendees are looked at once.
+        """
+
+    def findAvailableSlots(attendees, duration, search_from, time_period,
+                           limit=1, max_days=366, rooms=None):
+        """Find the first slots of duration all attendees are free in.
+
+        The busy time of attendees is looked up for a week from
+        search_from, then for windows twice as long each time, until
+        limit slots are found or max_days days are searched. Only the
+        time between the start and end times of time_period is used each
+        day. Slots follow each other through each free period.
+
+        rooms, if given, is a list of attendees to meet in one of. Each
+        slot then goes to the first of them free during it.
+
+        Returns a list of (start, end) tuples, in order, or of (start,
+        end, room) tuples if rooms are given.
+        """
+
+    def findRecurringSlots(rule, duration, attendees, horizon, time_period,
+                           fraction=1.0, granularity=None):
+        """Find the times a recurrent meeting of attendees can be held at.
+
+        rule is an IRecurrenceRule giving the dates of the meeting from
+        the start of horizon, a (start, end) period. Each time of day
+        within time_period, by steps of granularity (30 minutes by
+        default), is checked against the busy time of attendees on all
+        the dates. Times are kept when attendees are free for at least
+        fraction of the meetings.
+
+        Returns a list of (start, conflicts) tuples, start being the
+        first meeting at that time, ordered by the number of meetings
+        with a conflict, then by start.
         """
 
 class IStorage(Interface):
     """A storage contains events.
+
+    Storages may index events to search them. Events changed other
+    than through an event specification or their participation
+    methods must be notified with an EventModifiedEvent (or notifyEvent
+    of the storage manager) for the indexes to follow. Until then,
+    searches still only return events matching the search, but may
+    miss the events changed.
     """
     # MANIPULATORS
     def createEvent(unique_id, spec):
@@ -148,11 +344,63 @@ class IStorage(Interface):
         """Delete event from storage.
         """
 
+    def reindexEvent(event, idxs=None):
+        """Update the storage indexes after event was modified.
+
+        If idxs is given, only the indexes with these names are updated.
+
+        Events call this themselves when modified through an event
+        specification or when participation changes, and on
+        EventModifiedEvent notifications.
+        """
+
+    def deferIndexing():
+        """Stop indexing events, only remember which ones to index.
+
+        Deleted events are still unindexed right away, and searches
+        index the events remembered first. This only applies to the
+        calling thread.
+        """
+
+    def commitIndexing():
+        """Index the events whose indexing was deferred, and index events
+        as they change again.
+        """
+
+    def setConflictPolicy(policy):
+        """Set how double bookings of rooms are handled.
+
+        See IStorageManager.setConflictPolicy.
+        """
+
+    def checkConflicts(event, attendees):
+        """Apply the conflict policy to the rooms among attendees.
+
+        This is called when event is created, before it is stored, and
+        before attendees are invited to it. Raises DoubleBookingError
+        if the policy rejects the event, and returns the rooms that
+        should decline it.
+        """
+
     # ACCESSORS
     def getStorageId():
         """Return storage id (should be unique per storage manager).
         """
 
+    def getConflictPolicy():
+        """Return how double bookings of rooms are handled.
+        """
+
+    def getConflicts(event, attendee_ids):
+        """Get the events booking attendees at the same time as event.
+
+        Returns the events in lists by attendee id, for the attendees
+        with conflicts only. Recurrences are compared, over the days
+        after which those of both events repeat for series both
+        recurring forever, or over a year of them for recurrence rules
+        not known to repeat.
+        """
+
     def getEvent(event_id):
         """Get an event given event_id.
 
@@ -171,6 +419,58 @@ class IStorage(Interface):
         Period must be bounded.
         """
 
+    def iterOccurrences(period, search_criteria):
+        """Iterate over all occurrences in period, in dtstart order.
+
+        Occurrences are computed as the iteration goes, merging those of
+        all events, so only the next occurrence of each event is kept in
+        memory. Stopping early saves computing the later ones.
+
+        Period must be bounded.
+        """
+
+    def iterUpcomingOccurrences(after, search_criteria):
+        """Iterate over all occurrences after a datetime, in order.
+
+        These are the occurrences still going on at after or starting
+        later, without end, ordered on dtstart and then on the unique id
+        of their event. Events are only expanded as far as the iteration
+        goes.
+        """
+
+    def getOccurrenceBatch(period, search_criteria):
+        """Get all occurrences in period as a calcore.batch.OccurrenceBatch.
+
+        The occurrences are the same as those of getOccurrences, sorted
+        on start, but kept in columns (starts, durations, and positions
+        of the events in the events list of the batch) and only turned
+        into ICalendarOccurrences when iterated over. Recurrent events
+        are expanded together by type of recurrence rule, which is much
+        faster for many recurrent events if NumPy is available.
+
+        Period must be bounded.
+        """
+
+    def explain(period, search_criteria=None):
+        """Report how events in period matching search_criteria are found.
+
+        This is meant for finding out why a query is slow. It runs the
+        query and returns a dictionary with:
+
+        events - the number of events in the storage
+        plan - the names of the stages run, in order
+        stages - for each stage a dictionary with 'index' (the name),
+          'estimate' (the number of events the index was estimated to
+          give, or None), 'candidates' (the number of events left after
+          the stage) and 'time' (the seconds spent in the stage)
+        time - the total number of seconds spent
+
+        Index stages are followed by a 'match' stage checking the
+        candidates against the search criteria, or a 'scan' stage
+        checking all events if no index could be used. If the period
+        is bounded, an 'expand' stage counts the occurrences.
+        """
+
 class ISearchCriteria(Interface):
     """Event search criteria.
     """
@@ -190,6 +490,13 @@ class ISearchCriteria(Interface):
         """Clone these search criteria, overriding any specified as arguments.
         """
 
+    def getKey():
+        """Return a hashable canonical form of these search criteria.
+
+        Criteria matching the same events have equal keys, whatever the
+        order of their attendees and categories.
+        """
+
 class IAttendee(Interface):
     # MANIPULATORS
     def createEvent(**kw):
@@ -309,13 +616,39 @@ class ICalendar(Interface):
         invited to the event
         """
 
-    def import_(self, text, period=(None, None), search_criteria=None):
+    def import_(self, text, period=(None, None), search_criteria=None,
+                synchronize=0, bulk=False, processes=None, pool=None):
         """Given iCalendar text, import events.
 
         This overwrites existing event data where necessary,
         and creates new events and removes existing events. What is
         an existing event depends on the period and search_criteria;
         by default this is all events in the calendar.
+
+        If bulk is set, the import is a batch of the storage manager
+        (see IStorageManager.beginBatch).
+
+        Events keep a fingerprint of the data they were last imported
+        from, so events imported again from the same data are skipped,
+        unless they were modified since.
+        Incomplete data raises ValueError, once the events before the
+        point where it ends have been imported.
+
+        If processes is given, that many processes of a multiprocessing
+        pool unfold, fingerprint and parse the events, only storing them
+        is done by this one. A pool can be given instead, to use it for
+        many imports; it is not terminated.
+        """
+
+    def importFrom(stream, period=(None, None), search_criteria=None,
+                   synchronize=0, progress=None, bulk=False,
+                   processes=None, pool=None):
+        """Import events from iCalendar data read from stream.
+
+        stream is a file-like object, read line by line; events are
+        imported one by one as they are read. Otherwise this works like
+        import_. If given, progress is called with the number of events
+        read so far after each event.
         """
 
     # ACCESSORS
@@ -338,10 +671,45 @@ class ICalendar(Interface):
         """Get all occurrences of event in period. Period must be bounded.
         """
 
+    def getUpcomingOccurrences(after, limit, search_criteria=None):
+        """Get the first limit occurrences going on at after or later.
+
+        The period has no end. See IStorage.iterUpcomingOccurrences for
+        the order; only the occurrences needed are computed.
+        """
+
+    def getUpcomingOccurrencesPage(after, limit, search_criteria=None,
+                                   cursor=None):
+        """Get the upcoming occurrences page by page.
+
+        Returns the next limit occurrences after cursor and a cursor for
+        the next page, or None if there are no more occurrences. Start
+        with no cursor. The cursor only depends on the last occurrence
+        returned, so it still works after events have changed.
+        """
+
+    def iterOccurrences(period, search_criteria=None):
+        """Iterate over the occurrences in period, in dtstart order.
+
+        See IStorage.iterOccurrences.
+        """
+
+    def getOccurrenceBatch(period, search_criteria=None):
+        """Get all occurrences in period, expanded all at once.
+
+        See IStorage.getOccurrenceBatch.
+        """
+
     def getEventsInDay(date):
         """Get all events on a day, indicated by date.
         """
 
+    def explain(period, search_criteria=None):
+        """Report how the events in period of this calendar are found.
+
+        See IStorage.explain.
+        """
+
     def getRecentYears():
         """Get relevant years (this year and a range around it), numerically.
         """
@@ -362,6 +730,21 @@ class ICalendar(Interface):
         by default all events in the calendar are exported.
         """
 
+    def exportTo(stream, period=(None, None), search_criteria=None):
+        """Export this calendar as iCalendar data written to stream.
+
+        stream is a file-like object. Each event is written as soon as
+        it is exported, so the data is never held in memory as a whole.
+        """
+
+    def iterExport(period=(None, None), search_criteria=None):
+        """Generate the iCalendar data exporting this calendar.
+
+        The header of the calendar comes first, then each event, then
+        the end of the calendar, as strings. Responses can be streamed
+        from it.
+        """
+
 Unchanged = object() # marker
 
 class IRecurrenceRule(Interface):
@@ -383,7 +766,7 @@ class IRecurrenceRule(Interface):
     def __ne__(other):
         """See if self != other."""
 
-    def apply(event, enddate=None):
+    def apply(event, enddate=None, period_start=None):
         """Apply this rule to an event.
 
         This is a generator that returns the dates on which the event should
@@ -392,6 +775,18 @@ class IRecurrenceRule(Interface):
 
         The optional enddate attribute can be used to set a range on the dates
         generated by this function (inclusive).
+
+        The optional period_start date leaves out the dates before it
+        (inclusive). Rules jump directly to the first recurrence on or
+        after it instead of stepping from the start of the event.
+        """
+
+    def getLastDate(start):
+        """Return the date after which there are no more recurrences.
+
+        start is the date the event starts on. This is the until date,
+        or the date of the last recurrence allowed by count, exceptions
+        left aside. Returns None if the recurrences go on forever.
         """
 
     def iCalRepresentation(dtstart):
@@ -586,6 +981,22 @@ class ICalendarEvent(ITimed):
 
         By setting private to True, only the time and date will be exported"""
 
+    def exportText(private=False):
+        """Return the event exported as iCalendar text, a VEVENT.
+
+        The texts with and without private information are cached, in
+        calcore.cal.export_cache, for the values they were exported
+        from, so changes need no notification. Texts of classes
+        overriding export() are only cached if they override
+        _getExportKey() too.
+        """
+
+    def getSeriesEnd():
+        """Return the datetime at which the last occurrence ends.
+
+        This is datetime.max for events recurring forever.
+        """
+
     # we're not supporting the schoolbell event comparison semantics yet.
 
 ##     def __eq__(other):
@@ -806,3 +1217,12 @@ class IEventParticipationChangeEvent(IEventModifiedEvent):
     attendee = Attribute("The attendee whose status changed.")
     old_status = Attribute("The previous status.")
     old_status = Attribute("The new status.")
+
+class IEventBatchEvent(Interface):
+    """Calendar events have been changed in a batch"""
+
+    created = Attribute("The unique ids of the created events.")
+    modified = Attribute("The unique ids of the modified events.")
+    deleted = Attribute("The unique ids of the deleted events.")
+    events = Attribute("The events changed, deleted ones included, "
+                       "by unique id.")
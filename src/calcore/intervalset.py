@@ -0,0 +1,170 @@
+# -*- coding: ISO-8859-15 -*-
+# (C) Copyright 2005 Nuxeo SARL <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+# $Id$
+
+"""Sets of time, kept as sorted lists of disjoint periods.
+
+Operations between sets go through the periods of both in order once,
+and take time linear in the number of periods.
+"""
+
+from heapq import merge as heapmerge
+from bisect import bisect_left, bisect_right
+
+class IntervalSet:
+    """A set of points in time, as sorted (start, end) periods.
+
+    Periods are half-open, like the occurrences of events. Overlapping
+    and adjacent periods are merged, empty ones are dropped. Anything
+    ordered can be used as time.
+
+    If periods are sorted already, presorted saves sorting them.
+    """
+
+    def __init__(self, periods=(), presorted=False):
+        if not presorted:
+            periods = sorted(periods)
+        self._periods = _coalesce(periods)
+
+    # ACCESSORS
+
+    def __iter__(self):
+        return iter(self._periods)
+
+    def __len__(self):
+        return len(self._periods)
+
+    def __getitem__(self, index):
+        return self._periods[index]
+
+    def __eq__(self, other):
+        return (isinstance(other, IntervalSet) and
+                self._periods == other._periods)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'IntervalSet(%r)' % self._periods
+
+    def getPeriods(self):
+        """Return the periods as a list.
+        """
+        return list(self._periods)
+
+    def union(self, other):
+        """Return the time in self or other.
+        """
+        return IntervalSet(heapmerge(self._periods, _sorted(other)), True)
+
+    def intersection(self, other):
+        """Return the time in both self and other.
+        """
+        first = self._periods
+        second = _sorted(other)
+        result = []
+        i = j = 0
+        while i < len(first) and j < len(second):
+            start = max(first[i][0], second[j][0])
+            end = min(first[i][1], second[j][1])
+            if start < end:
+                result.append((start, end))
+            # the period ending first overlaps nothing further
+            if first[i][1] < second[j][1]:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet(result, True)
+
+    def difference(self, other):
+        """Return the time in self but not in other.
+        """
+        second = _sorted(other)
+        result = []
+        j = 0
+        for start, end in self._periods:
+            # skip what ends before this period
+            while j < len(second) and second[j][1] <= start:
+                j += 1
+            k = j
+            while k < len(second) and second[k][0] < end:
+                if second[k][0] > start:
+                    result.append((start, second[k][0]))
+                start = max(start, second[k][1])
+                k += 1
+            if start < end:
+                result.append((start, end))
+        return IntervalSet(result, True)
+
+    def complement(self, window):
+        """Return the time within window, a period, not in self.
+        """
+        return IntervalSet([window]).difference(self)
+
+    def window(self, (begins, ends)):
+        """Return the time in self within the period from begins to ends.
+
+        Periods are found by bisection, so this takes O(log n) plus the
+        number of periods within the window.
+        """
+        periods = self._periods
+        i = bisect_right(periods, (begins,))
+        if i and periods[i - 1][1] > begins:
+            i -= 1
+        result = []
+        while i < len(periods) and periods[i][0] < ends:
+            start, end = periods[i]
+            result.append((max(start, begins), min(end, ends)))
+            i += 1
+        return IntervalSet(result, True)
+
+    def overlaps(self, (begins, ends)):
+        """Tell whether any time from begins to ends is in self.
+
+        This takes O(log n).
+        """
+        periods = self._periods
+        # the periods starting before ends, the last one ends last
+        i = bisect_left(periods, (ends,))
+        return i > 0 and periods[i - 1][1] > begins
+
+def merge(streams):
+    """Return the union of streams of periods, each sorted already.
+
+    Streams can be IntervalSets, lists or iterators. This takes
+    O(n log k) for n periods in k streams.
+    """
+    return IntervalSet(heapmerge(*streams), True)
+
+def _sorted(periods):
+    if isinstance(periods, IntervalSet):
+        return periods._periods
+    return IntervalSet(periods)._periods
+
+def _coalesce(periods):
+    """Merge overlapping and adjacent periods among sorted periods."""
+    result = []
+    for start, end in periods:
+        if start >= end:
+            continue
+        if result and start <= result[-1][1]:
+            if end > result[-1][1]:
+                result[-1] = (result[-1][0], end)
+        else:
+            result.append((start, end))
+    return result
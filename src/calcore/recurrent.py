@@ -111,28 +111,86 @@ class BasicRecurrenceRule:
         """
         return hash(self._tupleForComparison())
 
-    def apply(self, event, enddate=None):
+    def apply(self, event, enddate=None, period_start=None):
         """Generator that generates dates of recurrences"""
-        if enddate:
-            assert isinstance(enddate, datetime.date), "enddate must be a date"
-            assert not isinstance(enddate, datetime.datetime), \
-                    "enddate must be a date, not a datetime"
-        cur = event.dtstart.date()
-        count = 0
-        while True:
-            if ((enddate and cur > enddate) or
-                (self.count is not None and count >= self.count) or
-                (self.until and cur > self.until)):
+        _checkDates(enddate, period_start)
+        # all the work is done on proleptic ordinals (date.toordinal())
+        last = None
+        for limit in (enddate, self.until):
+            if limit and (last is None or limit.toordinal() < last):
+                last = limit.toordinal()
+        count = self.count
+        # dates never compare equal to datetimes, so these never matched
+        exceptions = frozenset([d.toordinal() for d in self.exceptions
+                                if not isinstance(d, datetime.datetime)])
+        first = None
+        if period_start is not None:
+            first = period_start.toordinal()
+        fromordinal = datetime.date.fromordinal
+        for index, ordinal in self._recurrences(event.dtstart.date(),
+                                                period_start):
+            if ((last is not None and ordinal > last) or
+                (count is not None and index >= count)):
                 break
-            if cur not in self.exceptions:
-                yield cur
-            count += 1
+            if ordinal not in exceptions and (first is None or
+                                              ordinal >= first):
+                yield fromordinal(ordinal)
+
+    def getLastDate(self, start):
+        """See IRecurrenceRule"""
+        if self.until:
+            if isinstance(self.until, datetime.datetime):
+                return self.until.date()
+            return self.until
+        if self.count is None:
+            return None
+        if self.count <= 0:
+            return start
+        try:
+            return datetime.date.fromordinal(self._lastOrdinal(start))
+        except (ValueError, OverflowError):
+            # beyond the dates we can compute recurrences for
+            return None
+
+    def _lastOrdinal(self, start):
+        """Return the ordinal of the recurrence with index count - 1."""
+        for index, ordinal in self._recurrences(start, None):
+            if index == self.count - 1:
+                return ordinal
+
+    def _recurrences(self, start, period_start):
+        """Generate (index, ordinal) tuples for all recurrences.
+
+        index counts the recurrences from start on, ordinal is the
+        proleptic ordinal of the date of the recurrence. Recurrences
+        before period_start may be left out.
+
+        This implementation steps from date to date with _nextRecurrence,
+        after jumping close to period_start with _seek.
+        """
+        cur = start
+        index = 0
+        if period_start is not None and period_start > cur:
+            cur, index = self._seek(cur, period_start)
+        while True:
+            yield index, cur.toordinal()
+            index += 1
             cur = self._nextRecurrence(cur)
 
     def _nextRecurrence(self, date):
         """Add the basic step of recurrence to the date."""
         return date + self.interval * date.resolution
 
+    def _seek(self, start, period_start):
+        """Skip recurrences that happen before period_start.
+
+        Returns the first recurrence that may happen on or after
+        period_start, and the number of recurrences before it, counting
+        from start. This implementation does not skip anything; rules
+        that can compute where to continue override it.
+        """
+        return start, 0
+
     def iCalRepresentation(self, dtstart):
         """See IRecurrenceRule"""
         assert self.ical_freq, 'RecurrenceRule.ical_freq must be overridden'
@@ -171,10 +229,16 @@ class NoRecurrenceRule(BasicRecurrenceRule):
     """This only happens once"""
     implements(INoRecurrenceRule)
 
-    def apply(self, event, enddate=None):
+    def apply(self, event, enddate=None, period_start=None):
         """Generator that generates dates of recurrences"""
-        yield event.dtstart.date()
-        
+        cur = event.dtstart.date()
+        if period_start is None or cur >= period_start:
+            yield cur
+
+    def getLastDate(self, start):
+        """See IRecurrenceRule"""
+        return start
+
     # XXX implement all the ical stuff
 
 
@@ -184,6 +248,24 @@ class DailyRecurrenceRule(BasicRecurrenceRule):
 
     ical_freq = 'DAILY'
 
+    def _recurrences(self, start, period_start):
+        """Generate (index, ordinal) tuples for all recurrences."""
+        interval = self.interval
+        ordinal = start.toordinal()
+        index = 0
+        if period_start is not None and period_start > start:
+            # jump to the first day in the interval on or after period_start
+            index = ceildiv(period_start.toordinal() - ordinal, interval)
+            ordinal += index * interval
+        while True:
+            yield index, ordinal
+            index += 1
+            ordinal += interval
+
+    def _lastOrdinal(self, start):
+        """Return the ordinal of the recurrence with index count - 1."""
+        return start.toordinal() + (self.count - 1) * self.interval
+
 
 class YearlyRecurrenceRule(BasicRecurrenceRule):
     """Yearly recurrence rule."""
@@ -196,6 +278,11 @@ class YearlyRecurrenceRule(BasicRecurrenceRule):
         nextyear = date.year + self.interval
         return date.replace(year=nextyear)
 
+    def _seek(self, start, period_start):
+        """Jump to the first year in the interval not before period_start."""
+        count = ceildiv(period_start.year - start.year, self.interval)
+        return start.replace(year=start.year + count * self.interval), count
+
     def _iCalArgs(self, dtstart):
         """Return iCalendar parameters specific to monthly recurrence."""
         # KOrganizer wants explicit BYMONTH and BYMONTHDAY arguments.
@@ -250,33 +337,38 @@ class WeeklyRecurrenceRule(BasicRecurrenceRule):
         return (self.__class__.__name__, self.interval, self.count,
                 self.until, self.exceptions, self.weekdays)
 
-    def apply(self, event, enddate=None):
-        """Generate dates of recurrences."""
-        if enddate:
-            assert isinstance(enddate, datetime.date), "enddate must be a date"
-            assert not isinstance(enddate, datetime.datetime), \
-                    "enddate must be a date, not a datetime"
-        cur = start = event.dtstart.date()
-        count = 0
+    def _recurrences(self, start, period_start):
+        """Generate (index, ordinal) tuples for all recurrences.
+
+        This goes through the weeks in the interval, and directly to the
+        weekdays in each week.
+        """
         weekdays = Set(self.weekdays)
-        weekdays.add(event.dtstart.weekday())
+        weekdays.add(start.weekday())
+        weekdays = list(weekdays)
+        weekdays.sort()
+        first = start.toordinal()
+        monday = first - start.weekday()
+        index = 0
+        if period_start is not None and period_start > start:
+            # jump to the first week in the interval that does not end
+            # before period_start
+            weeks = ceildiv(weekspan(start, period_start), self.interval)
+            if weeks > 0:
+                # all of the first week from start on, and full weeks after
+                index = len([day for day in weekdays
+                             if day >= start.weekday()])
+                index += (weeks - 1) * len(weekdays)
+                monday += weeks * self.interval * 7
+        step = self.interval * 7
         while True:
-            if ((enddate and cur > enddate) or
-                (self.count is not None and count >= self.count) or
-                (self.until and cur > self.until)):
-                return
-            # Check that this is the correct week and
-            # the desired weekday
-            if (weekspan(start, cur) % self.interval == 0 and
-                cur.weekday() in weekdays):
-                if cur not in self.exceptions:
-                    yield cur
-                count += 1
-            cur = self._nextRecurrence(cur)
-
-    def _nextRecurrence(self, date):
-        """Add the basic step of recurrence to the date."""
-        return date + date.resolution
+            for day in weekdays:
+                ordinal = monday + day
+                if ordinal < first:
+                    continue
+                yield index, ordinal
+                index += 1
+            monday += step
 
     def _iCalArgs(self, dtstart):
         """Return iCalendar parameters specific to monthly recurrence."""
@@ -346,65 +438,50 @@ class MonthlyRecurrenceRule(BasicRecurrenceRule):
             except ValueError:
                 continue
 
-    def apply(self, event, enddate=None):
-        if enddate:
-            assert isinstance(enddate, datetime.date), "enddate must be a date"
-            assert not isinstance(enddate, datetime.datetime), \
-                    "enddate must be a date, not a datetime"
-        if self.monthly == 'monthday':
-            for date in BasicRecurrenceRule.apply(self, event, enddate):
-                yield date
-        elif self.monthly == 'weekday':
-            for date in self._applyWeekday(event, enddate):
-                yield date
-        elif self.monthly == 'lastweekday':
-            for date in self._applyLastWeekday(event, enddate):
-                yield date
-
-    def _applyWeekday(self, event, enddate=None):
-        """Generator that generates dates of recurrences."""
-        cur = start = event.dtstart.date()
-        count = 0
-        year = start.year
-        month = start.month
-        weekday = start.weekday()
-        index = (start.day - 1) / 7 + 1
+    def _seek(self, start, period_start):
+        """Jump to the first month in the interval not before period_start.
 
+        Months that do not have the day of the month of start are
+        skipped, and not counted as recurrences.
+        """
+        steps = ceildiv(monthspan(start, period_start), self.interval)
+        count = steps - missingmonthdays(start, self.interval, steps)
         while True:
-            cur = monthindex(year, month, index, weekday)
-            if ((enddate and cur > enddate) or
-                (self.count is not None and count >= self.count) or
-                (self.until and cur > self.until)):
-                break
-            if cur not in self.exceptions:
-                yield cur
-            count += 1
-            # Next month, please.
-            year, month = divmod(year * 12 + month + self.interval - 1, 12)
-            month += 1
+            year, month = divmod(
+                start.year * 12 + start.month - 1 + steps * self.interval, 12)
+            try:
+                return start.replace(year=year, month=month + 1), count
+            except ValueError:
+                # not in this month, and not counted
+                steps += 1
 
-    def _applyLastWeekday(self, event, enddate=None):
-        """Generator that generates dates of recurrences."""
-        cur = start = event.dtstart.date()
-        count = 0
-        year = start.year
-        month = start.month
+    def _recurrences(self, start, period_start):
+        """Generate (index, ordinal) tuples for all recurrences."""
+        if self.monthly == 'monthday':
+            return BasicRecurrenceRule._recurrences(self, start, period_start)
         weekday = start.weekday()
-        daysinmonth = calendar.monthrange(year, month)[1]
-        index = (start.day - daysinmonth - 1) / 7
+        if self.monthly == 'weekday':
+            index = (start.day - 1) / 7 + 1
+        else:
+            daysinmonth = calendar.monthrange(start.year, start.month)[1]
+            index = (start.day - daysinmonth - 1) / 7
+        return self._recurrencesByWeekday(start, period_start, index, weekday)
 
+    def _recurrencesByWeekday(self, start, period_start, index, weekday):
+        """Generate recurrences on the index-th weekday of the months."""
+        count = 0
+        if period_start is not None and period_start > start:
+            # recurrences found by weekday may fall just outside their
+            # month, so only skip months at least two months before the
+            # month of period_start
+            count = ceildiv(monthspan(start, period_start) - 1, self.interval)
+        months = start.year * 12 + start.month - 1 + count * self.interval
         while True:
-            cur = monthindex(year, month, index, weekday)
-            if ((enddate and cur > enddate) or
-                (self.count is not None and count >= self.count) or
-                (self.until and cur > self.until)):
-                break
-            if cur not in self.exceptions:
-                yield cur
+            year, month = divmod(months, 12)
+            yield count, monthindexordinal(year, month + 1, index, weekday)
             count += 1
             # Next month, please.
-            year, month = divmod(year * 12 + month + self.interval - 1, 12)
-            month += 1
+            months += self.interval
 
     def _iCalArgs(self, dtstart):
         """Return iCalendar parameters specific to monthly recurrence."""
@@ -435,11 +512,97 @@ def weekspan(first, second):
     return (secondmonday - firstmonday).days / 7
 
 
+def monthspan(first, second):
+    """Return the distance in months between dates.
+
+    For days in the same month, the result is 0.
+    """
+    return (second.year - first.year) * 12 + second.month - first.month
+
+
+def ceildiv(a, b):
+    """Divide a by b, rounding up. Never returns less than 0."""
+    if a <= 0:
+        return 0
+    return (a + b - 1) // b
+
+
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def missingmonthdays(start, interval, steps):
+    """Count the months without the day of month of start.
+
+    The months looked at are those of start plus 0, interval, 2 * interval,
+    ..., up to (but not including) steps * interval months.
+    """
+    day = start.day
+    if day <= 28 or steps <= 0:
+        return 0
+    first = start.year * 12 + start.month - 1
+    # in the sequence of months, a given month of the year comes back
+    # every period steps
+    period = 12 // gcd(interval, 12)
+    missing = 0
+    for step in range(min(period, steps)):
+        month = (first + step * interval) % 12 + 1
+        if calendar.mdays[month] >= day:
+            continue
+        # this month of the year comes back at step, step + period, ...
+        times = (steps - step + period - 1) // period
+        if month == 2 and day == 29:
+            # only missing in years that are not leap years
+            year = (first + step * interval) // 12
+            years = period * interval // 12
+            times -= countleapyears(year, years, times)
+        missing += times
+    return missing
+
+
+def countleapyears(first, step, n):
+    """Count the leap years in first, first + step, ... (n years)."""
+    # leap years repeat every 400 years
+    cycle = 400 // gcd(step, 400)
+    full, rest = divmod(n, cycle)
+    result = 0
+    if full:
+        leaps = 0
+        for i in range(cycle):
+            if calendar.isleap(first + i * step):
+                leaps += 1
+        result = full * leaps
+    for i in range(rest):
+        if calendar.isleap(first + i * step):
+            result += 1
+    return result
+
+
+def _checkDates(enddate, period_start):
+    for value in (enddate, period_start):
+        if value:
+            assert isinstance(value, datetime.date), \
+                   "enddate and period_start must be dates"
+            assert not isinstance(value, datetime.datetime), \
+                   "enddate and period_start must be dates, not datetimes"
+
+
 def monthindex(year, month, index, weekday):
     """Return the (index)th weekday of the month in a year.
 
     May return a date beyond month if index is too big.
     """
+    return datetime.date.fromordinal(
+        monthindexordinal(year, month, index, weekday))
+
+
+def monthindexordinal(year, month, index, weekday):
+    """Return the proleptic ordinal of the (index)th weekday of the month.
+
+    May return a day beyond month if index is too big.
+    """
     # make corrections for the negative index
     # if index is negative, we're really interested in the next month's
     # first weekday, minus n weeks
@@ -449,16 +612,23 @@ def monthindex(year, month, index, weekday):
         month += 1
         index += 1
 
-    # find first weekday
-    for day in range(1, 8):
-        if datetime.date(year, month, day).weekday() == weekday:
-            break
+    first = firstordinal(year, month)
+    # day 1 is a monday
+    first += (weekday - (first - 1)) % 7
+    return first + (index - 1) * 7
+
 
-    # calculate the timedelta to the index-th
-    shift = (index - 1) * datetime.timedelta(7)
+_days_before_month = [None, 0, 31, 59, 90, 120, 151, 181, 212, 243, 273,
+                      304, 334]
 
-    # return the result
-    return datetime.date(year, month, day) + shift
+def firstordinal(year, month):
+    """Return the proleptic ordinal of the first day of the month."""
+    y = year - 1
+    result = y * 365 + y // 4 - y // 100 + y // 400
+    result += _days_before_month[month] + 1
+    if month > 2 and calendar.isleap(year):
+        result += 1
+    return result
 
 # from schoolbell.calendar.icalendar
 
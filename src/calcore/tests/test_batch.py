@@ -0,0 +1,121 @@
+import unittest
+from random import Random
+from datetime import datetime, timedelta, date
+
+from calcore import cal, recurrent, batch
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._m = cal.StorageManager()
+        self._m.setStorage(cal.MemoryStorage('storage'))
+        self._s = cal.SimpleAttendeeSource(self._m)
+
+    def _expanded(self, events, period):
+        result = []
+        for position, event in enumerate(events):
+            for occurrence in event.expand(period):
+                result.append((occurrence.dtstart, position,
+                               occurrence.duration))
+        result.sort()
+        return result
+
+    def _batched(self, events, period):
+        occurrences = batch.expandEvents(events, period)
+        result = []
+        for i, occurrence in enumerate(occurrences):
+            position = int(occurrences.positions[i])
+            self.assert_(occurrence.original is events[position])
+            result.append((occurrence.dtstart, position, occurrence.duration))
+        return result
+
+    def test_expandEvents(self):
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        rules = [None,
+                 recurrent.DailyRecurrenceRule(interval=3, count=20),
+                 recurrent.WeeklyRecurrenceRule(weekdays=(0, 3), count=7),
+                 recurrent.DailyRecurrenceRule(count=0),
+                 recurrent.MonthlyRecurrenceRule(
+                     monthly='lastweekday', until=date(2006, 1, 1)),
+                 recurrent.MonthlyRecurrenceRule(monthly='weekday'),
+                 recurrent.MonthlyRecurrenceRule(
+                     exceptions=[date(2005, 5, 31)]),
+                 recurrent.YearlyRecurrenceRule(interval=2)]
+        events = []
+        for rule in rules:
+            events.append(martijn.createEvent(
+                dtstart=datetime(2005, 3, 31, 23, 00),
+                duration=timedelta(hours=2),
+                title="Meeting",
+                recurrence=rule))
+        for period in [(datetime(2005, 4, 1), datetime(2005, 4, 2)),
+                       (datetime(2005, 3, 1), datetime(2006, 3, 1)),
+                       (datetime(2007, 3, 31), datetime(2007, 4, 1))]:
+            self.assertEquals(self._expanded(events, period),
+                              self._batched(events, period))
+
+    def test_compareWithExpand(self):
+        rand = Random(42)
+        events = []
+        for n in range(200):
+            kw = {'interval': rand.choice([1, 2, 3])}
+            limit = rand.random()
+            if limit < 0.3:
+                kw['count'] = rand.randint(1, 30)
+            elif limit < 0.6:
+                kw['until'] = date(2005, 1, 1) + timedelta(
+                    rand.randint(0, 700))
+            kw['exceptions'] = [date(2005, 1, 1) + timedelta(
+                rand.randint(0, 700)) for i in range(rand.randint(0, 3))]
+            rule = rand.choice([
+                None,
+                recurrent.DailyRecurrenceRule(**kw),
+                recurrent.WeeklyRecurrenceRule(
+                    weekdays=rand.sample(range(7), rand.randint(0, 3)), **kw),
+                recurrent.MonthlyRecurrenceRule(
+                    monthly=rand.choice(['monthday', 'weekday',
+                                         'lastweekday']), **kw)])
+            dtstart = datetime(2005, 1, 1) + timedelta(
+                days=rand.randint(0, 365), minutes=rand.randint(0, 1439))
+            events.append(cal.Event(str(n), cal.EventSpecification(
+                dtstart=dtstart,
+                duration=timedelta(minutes=rand.randint(1, 2000)),
+                recurrence=rule)))
+        for n in range(20):
+            begin = datetime(2005, 1, 1) + timedelta(
+                hours=rand.randint(0, 20000))
+            period = (begin, begin + timedelta(days=rand.choice([1, 7, 31])))
+            self.assertEquals(self._expanded(events, period),
+                              self._batched(events, period))
+
+    def test_getOccurrenceBatch(self):
+        calendar = cal.Calendar(self._m, self._s)
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        calendar.addAttendee(martijn)
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting",
+            recurrence=recurrent.DailyRecurrenceRule())
+        guido.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Guido's Meeting")
+        week = (datetime(2005, 4, 11), datetime(2005, 4, 18))
+        occurrences = calendar.getOccurrenceBatch(week)
+        self.assertEquals(7, len(occurrences))
+        self.assertEquals(datetime(2005, 4, 11, 16, 00),
+                          occurrences[0].dtstart)
+        self.assertEquals("Martijn's Meeting",
+                          occurrences[6].original.title)
+        occurrences = self._m.getOccurrenceBatch(week)
+        self.assertEquals(7, len(list(occurrences)))
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests([unittest.makeSuite(BatchTestCase)])
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
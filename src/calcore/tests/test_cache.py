@@ -0,0 +1,57 @@
+import unittest
+
+from calcore import cache
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_getAndSet(self):
+        c = cache.LRUCache()
+        self.assertEquals(None, c.get('a'))
+        c.set('a', 1)
+        c.set('b', [])
+        self.assertEquals(1, c.get('a'))
+        self.assertEquals([], c.get('b', 'default'))
+        self.assertEquals('default', c.get('c', 'default'))
+        stats = c.getStatistics()
+        self.assertEquals(2, stats['hits'])
+        self.assertEquals(2, stats['misses'])
+        self.assertEquals(2, stats['entries'])
+
+    def test_leastRecentlyUsedDropped(self):
+        dropped = []
+        c = cache.LRUCache(maxcost=5, ondrop=dropped.append)
+        c.set('a', 1, cost=2)
+        c.set('b', 2, cost=2)
+        c.get('a')
+        c.set('c', 3, cost=2)
+        self.assertEquals(['b'], dropped)
+        self.assert_(c.has_key('a'))
+        self.assert_(c.has_key('c'))
+        self.assertEquals(4, c.getStatistics()['cost'])
+        # too costly values are not kept at all
+        self.assert_(not c.set('d', 4, cost=6))
+        self.assert_(not c.has_key('d'))
+        c.setMaxCost(2)
+        self.assertEquals(['b', 'a'], dropped)
+        self.assertEquals(1, len(c))
+
+    def test_invalidate(self):
+        c = cache.LRUCache()
+        c.set('a', 1)
+        c.set('a', 2, cost=3)
+        self.assertEquals(3, c.getStatistics()['cost'])
+        c.invalidate('a')
+        c.invalidate('unknown')
+        self.assertEquals(None, c.get('a'))
+        self.assertEquals(0, c.getStatistics()['cost'])
+        c.set('b', 1)
+        c.clear()
+        self.assertEquals(0, len(c))
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests([unittest.makeSuite(LRUCacheTestCase)])
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -1,7 +1,7 @@
 import unittest
 import doctest
 from calcore import cal
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from calcore.interfaces import IEventParticipationChangeEvent
 
 def _invite_subscriber(eventevent):
@@ -100,6 +100,942 @@ class CalTestCase(unittest.TestCase):
         events = self._m.getEvents((None, None), sc)
         self.failUnlessEqual(len(events), 2)
 
+    def test_periodIndexFollowsModification(self):
+        from calcore.events import EventModifiedEvent
+        from zope.event import notify
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting")
+        april = (datetime(2005, 4, 1), datetime(2005, 5, 1))
+        may = (datetime(2005, 5, 1), datetime(2005, 6, 1))
+        spec = cal.EventSpecification(
+            dtstart=datetime(2005, 5, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            organizer=martijn)
+        spec.setOnObject(meeting)
+        self.assertEquals([], martijn.getEvents(april))
+        self.assertEquals([meeting], martijn.getEvents(may))
+        # direct modification followed by a notification
+        meeting.dtstart = datetime(2005, 4, 10, 16, 00)
+        notify(EventModifiedEvent(meeting))
+        self.assertEquals([meeting], martijn.getEvents(april))
+        self.assertEquals(1, len(martijn.getOccurrences(april)))
+        self.assertEquals([], martijn.getOccurrences(may))
+        self._m.deleteEvent(meeting)
+        self.assertEquals([], martijn.getEvents(april))
+
+    def test_periodIndexRecurrence(self):
+        from calcore import recurrent
+        from datetime import date
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        rule = recurrent.DailyRecurrenceRule(until=date(2005, 4, 20))
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Daily Meeting",
+            recurrence=rule)
+        self.assertEquals(1, len(martijn.getOccurrences(
+            (datetime(2005, 4, 20), datetime(2005, 4, 21)))))
+        self.assertEquals(0, len(martijn.getOccurrences(
+            (datetime(2005, 4, 21), datetime(2005, 4, 22)))))
+        rule = recurrent.DailyRecurrenceRule()
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Endless Meeting",
+            recurrence=rule)
+        self.assertEquals(1, len(martijn.getOccurrences(
+            (datetime(2015, 4, 21), datetime(2015, 4, 22)))))
+
+    def test_expandOpenStart(self):
+        from calcore import recurrent
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Daily Meeting",
+            recurrence=recurrent.DailyRecurrenceRule())
+        period = (None, datetime(2005, 4, 13))
+        occurrences = meeting.expand(period)
+        self.assertEquals(3, len(occurrences))
+        self.assertEquals(datetime(2005, 4, 10, 16, 00),
+                          occurrences[0].dtstart)
+        self.assertEquals(3, len(list(meeting.iterExpand(period))))
+
+    def test_seriesEnd(self):
+        from calcore import recurrent
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Weekly Meeting",
+            recurrence=recurrent.WeeklyRecurrenceRule(count=3))
+        self.assertEquals(datetime(2005, 4, 24, 17, 00),
+                          meeting.getSeriesEnd())
+        # finished series are left out by the period index
+        storage = self._m._storage
+        period = (datetime(2005, 5, 1), datetime(2005, 5, 8))
+        self.assertEquals([], storage._getCandidateIds(
+            cal.NullSearchCriteria(), period))
+        self.assertEquals([], meeting.expand(period))
+        # the end follows changes of the rule
+        spec = cal.EventSpecification(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            organizer=martijn,
+            recurrence=recurrent.WeeklyRecurrenceRule(count=5))
+        spec.setOnObject(meeting)
+        self.assertEquals(datetime(2005, 5, 8, 17, 00),
+                          meeting.getSeriesEnd())
+        self.assertEquals(1, len(martijn.getOccurrences(period)))
+
+    def test_expansionCache(self):
+        from calcore import recurrent
+        from calcore.events import EventModifiedEvent
+        from zope.event import notify
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Daily Meeting",
+            recurrence=recurrent.DailyRecurrenceRule())
+        week = (datetime(2005, 4, 11), datetime(2005, 4, 18))
+        expansion_cache = cal.expansion_cache
+        expansion_cache.resetStatistics()
+        self.assertEquals(7, len(martijn.getOccurrences(week)))
+        self.assertEquals(7, len(martijn.getOccurrences(week)))
+        stats = expansion_cache.getStatistics()
+        self.assertEquals(1, stats['hits'])
+        self.assertEquals(1, stats['misses'])
+        # modifications invalidate
+        meeting.recurrence = recurrent.DailyRecurrenceRule(interval=7)
+        notify(EventModifiedEvent(meeting))
+        self.assertEquals(1, len(martijn.getOccurrences(week)))
+        self.assertEquals(2, expansion_cache.getStatistics()['misses'])
+        # expansions too large for the cache are not recorded
+        cache = cal.ExpansionCache(max_occurrences=3)
+        day = (datetime(2005, 4, 11), datetime(2005, 4, 12))
+        cache.set(meeting, day, [None] * 7)
+        self.assertEquals(None, cache.get(meeting, day))
+        self.assert_(day not in meeting._v_expansions.periods)
+        self._m.deleteEvent(meeting)
+        self.assertEquals(None, expansion_cache.get(meeting, week))
+
+    def test_registerSubscribers(self):
+        from zope.event import subscribers
+        registered = len(subscribers)
+        cal.registerSubscribers()
+        self.assertEquals(registered, len(subscribers))
+
+    def test_exportCache(self):
+        from calcore.events import EventModifiedEvent
+        from zope.event import notify
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting")
+        export_cache = cal.export_cache
+        export_cache.resetStatistics()
+        text = meeting.exportText()
+        self.assertEquals(meeting.export().as_string(), text)
+        self.assertEquals(text, meeting.exportText())
+        private = meeting.exportText(private=True)
+        self.assert_("Martijn's Meeting" not in private)
+        self.assertEquals(private, meeting.exportText(private=True))
+        stats = export_cache.getStatistics()
+        self.assertEquals(2, stats['hits'])
+        self.assertEquals(2, stats['misses'])
+        # modifications invalidate, notified or not
+        meeting.title = 'Moved Meeting'
+        self.assert_('Moved Meeting' in meeting.exportText())
+        self.assertEquals(None, export_cache.get(meeting, True))
+        meeting.title = "Martijn's Meeting"
+        notify(EventModifiedEvent(meeting))
+        self.assertEquals(text, export_cache.get(meeting, False))
+        meeting.duration = timedelta(minutes=30)
+        self.assertEquals(None, export_cache.get(meeting, True))
+        # attendees are not exported
+        text = meeting.exportText()
+        meeting.invite([guido])
+        self.assertEquals(text, export_cache.get(meeting, False))
+        self._m.deleteEvent(meeting)
+        self.assertEquals(None, export_cache.get(meeting, False))
+
+    def test_exportCacheOverriddenExport(self):
+        class CommentedEvent(cal.Event):
+            comment = 'First'
+            def export(self, private=False):
+                e = cal.Event.export(self, private)
+                e.add('comment', self.comment)
+                return e
+        event = CommentedEvent('commented', cal.EventSpecification(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Meeting"))
+        self.assert_('First' in event.exportText())
+        event.comment = 'Second'
+        self.assert_('Second' in event.exportText())
+        self.assertEquals(None, cal.export_cache.get(event, False))
+
+    def test_queryCache(self):
+        from calcore.events import EventModifiedEvent
+        from zope.event import notify
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        self._m.enableQueryCache()
+        query_cache = self._m.getQueryCache()
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting")
+        april = (datetime(2005, 4, 1), datetime(2005, 5, 1))
+        self.assertEquals([meeting], martijn.getEvents(april))
+        self.assertEquals([meeting], martijn.getEvents(april))
+        self.assertEquals(1, query_cache.getStatistics()['hits'])
+        # events of other attendees leave the result alone
+        guido.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Guido's Meeting")
+        self.assertEquals(1, len(martijn.getEvents(april)))
+        self.assertEquals(2, query_cache.getStatistics()['hits'])
+        # as do events in other periods
+        martijn.createEvent(
+            dtstart=datetime(2005, 6, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Other Meeting")
+        self.assertEquals(1, len(martijn.getEvents(april)))
+        self.assertEquals(3, query_cache.getStatistics()['hits'])
+        # moving the event out of the period drops the result
+        meeting.dtstart = datetime(2005, 5, 10, 16, 00)
+        notify(EventModifiedEvent(meeting))
+        self.assertEquals([], martijn.getEvents(april))
+        # so does a new participant
+        meeting.dtstart = datetime(2005, 4, 10, 16, 00)
+        notify(EventModifiedEvent(meeting))
+        self.assertEquals(1, len(guido.getOccurrences(april)))
+        meeting.invite([guido])
+        self.assertEquals(2, len(guido.getOccurrences(april)))
+        self._m.deleteEvent(meeting)
+        self.assertEquals(1, len(guido.getOccurrences(april)))
+        self._m.disableQueryCache()
+        self.assertEquals(None, self._m.getQueryCache())
+
+    def test_searchCriteriaKey(self):
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        sc1 = cal.SearchCriteria(attendees=[martijn, guido],
+                                 categories=['a', 'b'])
+        sc2 = cal.SearchCriteria(attendees=[guido, martijn],
+                                 categories=('b', 'a'))
+        self.assertEquals(sc1.getKey(), sc2.getKey())
+        self.assertEquals(hash(sc1.getKey()), hash(sc2.getKey()))
+        self.assertNotEquals(sc1.getKey(),
+                             cal.SearchCriteria(attendees=[guido]).getKey())
+
+    def test_iterOccurrences(self):
+        from calcore import recurrent
+        from itertools import islice
+        calendar = cal.Calendar(self._m, self._s)
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        calendar.addAttendee(martijn)
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Daily Meeting",
+            recurrence=recurrent.DailyRecurrenceRule())
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 9, 00),
+            duration=timedelta(minutes=60),
+            title="Weekly Meeting",
+            recurrence=recurrent.WeeklyRecurrenceRule(weekdays=[2]))
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 12, 15, 00),
+            duration=timedelta(minutes=60),
+            title="Single Meeting")
+        week = (datetime(2005, 4, 11), datetime(2005, 4, 18))
+        occurrences = list(calendar.iterOccurrences(week))
+        starts = [occurrence.dtstart for occurrence in occurrences]
+        expected = [occurrence.dtstart for occurrence
+                    in self._m.getOccurrences(week)]
+        expected.sort()
+        self.assertEquals(expected, starts)
+        self.assertEquals(["Weekly Meeting", "Daily Meeting",
+                           "Single Meeting", "Daily Meeting",
+                           "Weekly Meeting"],
+                          [occurrence.original.title
+                           for occurrence in occurrences[:5]])
+        # occurrences are only computed when needed
+        century = (datetime(2005, 4, 11), datetime(2105, 4, 11))
+        first = list(islice(self._m.iterOccurrences(century), 3))
+        self.assertEquals([datetime(2005, 4, 11, 9, 00),
+                           datetime(2005, 4, 11, 16, 00),
+                           datetime(2005, 4, 12, 15, 00)],
+                          [occurrence.dtstart for occurrence in first])
+
+    def test_upcomingOccurrences(self):
+        from calcore import recurrent
+        calendar = cal.Calendar(self._m, self._s)
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        calendar.addAttendee(martijn)
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Endless Meeting",
+            recurrence=recurrent.WeeklyRecurrenceRule(weekdays=[0, 2]))
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Same Time Meeting",
+            recurrence=recurrent.DailyRecurrenceRule(count=3))
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 12, 10, 00),
+            duration=timedelta(minutes=60),
+            title="Single Meeting")
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 1, 10, 00),
+            duration=timedelta(minutes=60),
+            title="Past Meeting")
+        after = datetime(2005, 4, 11, 16, 30)
+        occurrences = calendar.getUpcomingOccurrences(after, 5)
+        self.assertEquals([datetime(2005, 4, 11, 16, 00),
+                           datetime(2005, 4, 11, 16, 00),
+                           datetime(2005, 4, 12, 10, 00),
+                           datetime(2005, 4, 12, 16, 00),
+                           datetime(2005, 4, 13, 16, 00)],
+                          [occurrence.dtstart for occurrence in occurrences])
+        # the same as all occurrences in a bounded period, in order
+        period = (after, datetime(2005, 6, 1))
+        expected = [(occurrence.dtstart, occurrence.original.unique_id)
+                    for occurrence in self._m.getOccurrences(period)]
+        expected.sort()
+        occurrences = self._m.getUpcomingOccurrences(after, len(expected))
+        self.assertEquals(expected,
+                          [(occurrence.dtstart, occurrence.original.unique_id)
+                           for occurrence in occurrences])
+        # page by page
+        found = []
+        cursor = None
+        while len(found) < len(expected):
+            page, cursor = calendar.getUpcomingOccurrencesPage(
+                after, 3, cursor=cursor)
+            self.assertEquals(3, len(page))
+            found.extend([(occurrence.dtstart, occurrence.original.unique_id)
+                          for occurrence in page])
+        self.assertEquals(expected, found[:len(expected)])
+        # occurrences at the time of the cursor may follow it
+        page, cursor = self._m.getUpcomingOccurrencesPage(
+            after, 2, cursor=(datetime(2005, 4, 13, 16, 00), ''))
+        self.assertEquals([datetime(2005, 4, 13, 16, 00)] * 2,
+                          [occurrence.dtstart for occurrence in page])
+        sc = cal.SearchCriteria(categories=['unknown'])
+        self.assertEquals(([], None),
+                          self._m.getUpcomingOccurrencesPage(after, 3, sc))
+
+    def test_blockedPeriodsOfGroup(self):
+        from datetime import time
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        room = self._s.createRoom('room', 'Room')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 10, 00),
+            duration=timedelta(minutes=60),
+            title="Shared Meeting")
+        meeting.invite([guido, room])
+        meeting.setParticipationStatus(guido, 'DECLINED')
+        guido.createEvent(
+            dtstart=datetime(2005, 4, 11, 14, 00),
+            duration=timedelta(minutes=60),
+            title="Guido's Meeting")
+        declined = martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Declined Meeting")
+        declined.invite([guido])
+        declined.setParticipationStatus(martijn, 'DECLINED')
+        declined.setParticipationStatus(guido, 'DELEGATED')
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 17, 00),
+            duration=timedelta(minutes=60),
+            title="Transparent Meeting",
+            transparent=True)
+        period = (datetime(2005, 4, 11), datetime(2005, 4, 12))
+        time_period = (time(9, 0), time(18, 0))
+        self.assertEquals(
+            [(datetime(2005, 4, 11, 0, 0), datetime(2005, 4, 11, 9, 0)),
+             (datetime(2005, 4, 11, 10, 0), datetime(2005, 4, 11, 11, 0)),
+             (datetime(2005, 4, 11, 14, 0), datetime(2005, 4, 11, 15, 0)),
+             (datetime(2005, 4, 11, 18, 0), datetime(2005, 4, 12, 0, 0))],
+            self._m.getBlockedPeriods([martijn, guido], period,
+                                      time_period))
+        # guido declined the shared meeting
+        self.assertEquals(
+            [(datetime(2005, 4, 11, 0, 0), datetime(2005, 4, 11, 9, 0)),
+             (datetime(2005, 4, 11, 14, 0), datetime(2005, 4, 11, 15, 0)),
+             (datetime(2005, 4, 11, 18, 0), datetime(2005, 4, 12, 0, 0))],
+            self._m.getBlockedPeriods([guido], period, time_period))
+
+    def test_getFreePeriodsWithinDays(self):
+        from datetime import time
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 11, 0),
+            duration=timedelta(minutes=60),
+            title="Meeting")
+        time_period = (time(9, 0), time(18, 0))
+        # the period starts and ends within working hours
+        period = (datetime(2005, 4, 11, 10, 30), datetime(2005, 4, 12, 10))
+        self.assertEquals(
+            [(datetime(2005, 4, 11, 10, 30), datetime(2005, 4, 11, 11, 0)),
+             (datetime(2005, 4, 11, 12, 0), datetime(2005, 4, 11, 18, 0)),
+             (datetime(2005, 4, 12, 9, 0), datetime(2005, 4, 12, 10, 0))],
+            self._m.getFreePeriods([martijn], period, time_period))
+        # the period ends before working hours
+        period = (datetime(2005, 4, 11, 12, 0), datetime(2005, 4, 12, 8))
+        self.assertEquals(
+            [(datetime(2005, 4, 11, 12, 0), datetime(2005, 4, 11, 18, 0))],
+            self._m.getFreePeriods([martijn], period, time_period))
+
+    def test_busyIndex(self):
+        from datetime import time, date
+        from calcore import recurrent
+        from calcore.events import EventModifiedEvent
+        from zope.event import notify
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        tomorrow = datetime.combine(date.today() + timedelta(days=1),
+                                    time(0, 0))
+        hour = timedelta(hours=1)
+        meeting = martijn.createEvent(
+            dtstart=tomorrow + 10 * hour,
+            duration=hour,
+            title="Shared Meeting")
+        self._m.enableBusyIndex((timedelta(days=-1), timedelta(days=7)))
+        busy_index = self._m.getBusyIndex()
+        day = (tomorrow, tomorrow + 24 * hour)
+        time_period = (time(9, 0), time(18, 0))
+        def blocked(attendees):
+            return self._m.getBlockedPeriods(attendees, day, time_period)
+        self.assert_(busy_index.covers(day))
+        self.assertEquals([(tomorrow + 10 * hour, tomorrow + 11 * hour)],
+                          busy_index.getBusyPeriods(['martijn'], day))
+        self.assertEquals([], busy_index.getBusyPeriods(['guido'], day))
+        # only the attendees asked about are loaded
+        self.assertEquals(['guido', 'martijn'], sorted(busy_index._busy))
+        # created events and participation changes are taken in
+        meeting.invite([guido])
+        daily = guido.createEvent(
+            dtstart=tomorrow - 14 * hour,
+            duration=3 * hour,
+            title="Daily Meeting",
+            recurrence=recurrent.DailyRecurrenceRule())
+        self.assertEquals(
+            [(tomorrow, tomorrow + 9 * hour),
+             (tomorrow + 10 * hour, tomorrow + 13 * hour),
+             (tomorrow + 18 * hour, tomorrow + 24 * hour)],
+            blocked([guido]))
+        meeting.setParticipationStatus(guido, 'DECLINED')
+        self.assertEquals(
+            [(tomorrow + 10 * hour, tomorrow + 13 * hour)],
+            busy_index.getBusyPeriods(['guido'], (tomorrow + hour,
+                                                  tomorrow + 20 * hour)))
+        # modifications, given notification
+        meeting.dtstart = tomorrow + 13 * hour
+        notify(EventModifiedEvent(meeting))
+        self.assertEquals(
+            [(tomorrow + 10 * hour, tomorrow + 14 * hour)],
+            busy_index.getBusyPeriods(['martijn', 'guido'],
+                                      (tomorrow + hour,
+                                       tomorrow + 20 * hour)))
+        self._m.deleteEvent(daily)
+        self.assertEquals(
+            [(tomorrow + 13 * hour, tomorrow + 14 * hour)],
+            busy_index.getBusyPeriods(['martijn', 'guido'], day))
+        # the same answers as without the index
+        self._m.disableBusyIndex()
+        expected = blocked([martijn, guido])
+        self._m.enableBusyIndex()
+        self.assertEquals(expected, blocked([martijn, guido]))
+        # beyond the horizon
+        self.failIf(self._m.getBusyIndex().covers(
+            (tomorrow, tomorrow + timedelta(days=400))))
+
+    def test_findAvailableSlots(self):
+        from datetime import time
+        from calcore import recurrent
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        room = self._s.createRoom('room', 'Room')
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 9, 00),
+            duration=timedelta(hours=3),
+            title="Morning Meeting",
+            recurrence=recurrent.DailyRecurrenceRule())
+        booking = guido.createEvent(
+            dtstart=datetime(2005, 4, 11, 13, 00),
+            duration=timedelta(hours=4),
+            title="Guido's Meeting")
+        booking.invite([room])
+        guido.createEvent(
+            dtstart=datetime(2005, 4, 1, 9, 00),
+            duration=timedelta(hours=8),
+            title="Guido's Day",
+            recurrence=recurrent.DailyRecurrenceRule())
+        time_period = (time(9, 0), time(17, 0))
+        search_from = datetime(2005, 4, 11, 10, 00)
+        self.assertEquals(
+            [(datetime(2005, 4, 12, 12, 00), datetime(2005, 4, 12, 14, 00))],
+            self._m.findAvailableSlots([martijn, room], timedelta(hours=2),
+                                       search_from, time_period))
+        # slots follow each other through free periods
+        self.assertEquals(
+            [(datetime(2005, 4, 11, 12, 00), datetime(2005, 4, 11, 13, 00)),
+             (datetime(2005, 4, 11, 13, 00), datetime(2005, 4, 11, 14, 00)),
+             (datetime(2005, 4, 11, 14, 00), datetime(2005, 4, 11, 15, 00))],
+            self._m.findAvailableSlots([martijn], timedelta(hours=1),
+                                       search_from, time_period, limit=3))
+        self.assertEquals(
+            [(datetime(2005, 4, 12, 12, 00), datetime(2005, 4, 12, 14, 00)),
+             (datetime(2005, 4, 12, 14, 00), datetime(2005, 4, 12, 16, 00)),
+             (datetime(2005, 4, 13, 12, 00), datetime(2005, 4, 13, 14, 00))],
+            self._m.findAvailableSlots([martijn, room], timedelta(hours=2),
+                                       search_from, time_period, limit=3))
+        # beyond the first window searched
+        slots = self._m.findAvailableSlots(
+            [martijn], timedelta(hours=1), search_from, time_period,
+            limit=40)
+        self.assertEquals(40, len(slots))
+        self.assertEquals(
+            (datetime(2005, 4, 18, 16, 00), datetime(2005, 4, 18, 17, 00)),
+            slots[-1])
+        # the first free room of a list
+        other_room = self._s.createRoom('other_room', 'Other Room')
+        booking = guido.createEvent(
+            dtstart=datetime(2005, 4, 11, 13, 00),
+            duration=timedelta(hours=2),
+            title="Guido's Other Meeting")
+        booking.invite([other_room])
+        self.assertEquals(
+            [(datetime(2005, 4, 11, 12, 00), datetime(2005, 4, 11, 13, 00),
+              room),
+             (datetime(2005, 4, 11, 15, 00), datetime(2005, 4, 11, 16, 00),
+              other_room),
+             (datetime(2005, 4, 11, 16, 00), datetime(2005, 4, 11, 17, 00),
+              other_room)],
+            self._m.findAvailableSlots([martijn], timedelta(hours=1),
+                                       search_from, time_period, limit=3,
+                                       rooms=[room, other_room]))
+        # too long for a day, or never free
+        self.assertEquals([], self._m.findAvailableSlots(
+            [room], timedelta(hours=9), search_from, time_period))
+        self.assertEquals([], self._m.findAvailableSlots(
+            [guido], timedelta(hours=1), search_from, time_period,
+            max_days=10))
+
+    def test_findRecurringSlots(self):
+        from datetime import time
+        from calcore import recurrent
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 4, 9, 00),
+            duration=timedelta(hours=1),
+            title="Weekly Meeting",
+            recurrence=recurrent.WeeklyRecurrenceRule())
+        guido.createEvent(
+            dtstart=datetime(2005, 4, 18, 10, 00),
+            duration=timedelta(hours=1),
+            title="Guido's Meeting")
+        # four mondays
+        horizon = (datetime(2005, 4, 11), datetime(2005, 5, 9))
+        time_period = (time(9, 0), time(12, 0))
+        def find(fraction):
+            return self._m.findRecurringSlots(
+                recurrent.WeeklyRecurrenceRule(), timedelta(hours=1),
+                [martijn, guido], horizon, time_period, fraction,
+                timedelta(hours=1))
+        self.assertEquals([(datetime(2005, 4, 11, 11, 00), 0)], find(1.0))
+        self.assertEquals([(datetime(2005, 4, 11, 11, 00), 0),
+                           (datetime(2005, 4, 11, 10, 00), 1)], find(0.75))
+        self.assertEquals([(datetime(2005, 4, 11, 11, 00), 0),
+                           (datetime(2005, 4, 11, 10, 00), 1),
+                           (datetime(2005, 4, 11, 9, 00), 4)], find(0))
+        # on wednesdays, starting with the first one in the horizon
+        self.assertEquals(
+            [(datetime(2005, 4, 13, 9, 00), 0),
+             (datetime(2005, 4, 13, 9, 30), 0),
+             (datetime(2005, 4, 13, 10, 00), 0)],
+            self._m.findRecurringSlots(
+                recurrent.WeeklyRecurrenceRule(weekdays=(2,)),
+                timedelta(hours=2), [martijn, guido], horizon,
+                time_period))
+
+    def test_findFreeRooms(self):
+        from datetime import time
+        from calcore import recurrent
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        small = self._s.createRoom('small', 'Small Room')
+        large = self._s.createRoom('large', 'Large Room')
+        closed = self._s.createRoom('closed', 'Closed Room')
+        self.assertEquals(['closed', 'large', 'small'], sorted(
+            [room.getAttendeeId()
+             for room in self._s.getAttendeesOfType('ROOM')]))
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 10, 00),
+            duration=timedelta(hours=4),
+            title="Long Meeting")
+        meeting.invite([small])
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 15, 00),
+            duration=timedelta(hours=1),
+            title="Short Meeting").invite([large])
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 1, 9, 00),
+            duration=timedelta(hours=8),
+            title="Closed",
+            recurrence=recurrent.DailyRecurrenceRule()).invite([closed])
+        period = (datetime(2005, 4, 11), datetime(2005, 4, 12))
+        time_period = (time(9, 0), time(17, 0))
+        self.assertEquals(
+            [(large, [(datetime(2005, 4, 11, 9, 00),
+                       datetime(2005, 4, 11, 15, 00))]),
+             (small, [(datetime(2005, 4, 11, 14, 00),
+                       datetime(2005, 4, 11, 17, 00))])],
+            self._s.findFreeRooms(period, timedelta(hours=3), time_period))
+        self.assertEquals(
+            [(large, [(datetime(2005, 4, 11, 9, 00),
+                       datetime(2005, 4, 11, 15, 00))])],
+            self._s.findFreeRooms(period, timedelta(hours=4), time_period))
+        # the same free periods as for each attendee alone
+        meeting.setParticipationStatus(small, 'DECLINED')
+        attendees = [martijn, small, large, closed]
+        free = self._m.getFreePeriodsByAttendee(attendees, period,
+                                                time_period)
+        for attendee in attendees:
+            self.assertEquals(
+                self._m.getFreePeriods([attendee], period, time_period),
+                free[attendee.getAttendeeId()])
+
+    def test_conflictPolicy(self):
+        from calcore import recurrent
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        room = self._s.createRoom('room', 'Room')
+        weekly = martijn.createEvent(
+            dtstart=datetime(2005, 4, 4, 10, 00),
+            duration=timedelta(hours=1),
+            title="Weekly Meeting",
+            recurrence=recurrent.WeeklyRecurrenceRule())
+        weekly.invite([room])
+        self.assertEquals(None, self._m.getConflictPolicy())
+        self.assertRaises(ValueError, self._m.setConflictPolicy, 'ignore')
+        def book(dtstart, title, rule=None):
+            return guido.createEvent(
+                dtstart=dtstart,
+                duration=timedelta(hours=1),
+                title=title,
+                recurrence=rule,
+                attendees=[(room, 'REQ-PARTICIPANT', 'NEEDS-ACTION')])
+        # without a policy, double bookings are allowed
+        allowed = book(datetime(2005, 4, 11, 10, 30), "Allowed")
+        self.assertEquals(
+            {'room': [weekly]},
+            self._m.getConflicts(allowed))
+        self.assertEquals({}, self._m.getConflicts(allowed, [guido]))
+        self._m.deleteEvent(allowed)
+        self._m.setConflictPolicy('reject')
+        # against a later occurrence of the series
+        self.assertRaises(cal.DoubleBookingError, book,
+                          datetime(2005, 5, 2, 10, 30), "Rejected")
+        self.assertEquals(
+            [weekly], self._m.getEvents((datetime(2005, 4, 1),
+                                         datetime(2005, 6, 1))))
+        # right after an occurrence, and a series on other days
+        after = book(datetime(2005, 4, 11, 11, 00), "After")
+        daily = book(datetime(2005, 4, 5, 10, 00), "Daily",
+                     recurrent.DailyRecurrenceRule(interval=7))
+        self.assertEquals('NEEDS-ACTION', daily.getParticipationStatus(room))
+        # inviting the room
+        meeting = guido.createEvent(
+            dtstart=datetime(2005, 4, 19, 9, 30),
+            duration=timedelta(hours=1),
+            title="Meeting")
+        try:
+            meeting.invite([martijn, room])
+        except cal.DoubleBookingError, e:
+            self.assertEquals({'room': [daily]}, e.conflicts)
+        else:
+            self.fail("DoubleBookingError not raised")
+        self.assertEquals(None, meeting.getParticipationStatus(martijn))
+        self._m.setConflictPolicy('decline')
+        meeting.invite([martijn, room])
+        self.assertEquals('NEEDS-ACTION',
+                          meeting.getParticipationStatus(martijn))
+        self.assertEquals('DECLINED', meeting.getParticipationStatus(room))
+        declined = book(datetime(2005, 4, 11, 11, 30), "Declined")
+        self.assertEquals('DECLINED', declined.getParticipationStatus(room))
+        # the room is free again once it declined
+        weekly.setParticipationStatus(room, 'DECLINED')
+        free = book(datetime(2005, 4, 25, 10, 00), "Free")
+        self.assertEquals('NEEDS-ACTION', free.getParticipationStatus(room))
+        self._m.setConflictPolicy('warn')
+        warned = book(datetime(2005, 4, 25, 10, 30), "Warned")
+        self.assertEquals('NEEDS-ACTION', warned.getParticipationStatus(room))
+        self.assertEquals({'room': [free], 'guido': [free]},
+                          self._m.getConflicts(warned))
+
+    def test_conflictsOfSeries(self):
+        from calcore import recurrent
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        room = self._s.createRoom('room', 'Room')
+        def book(dtstart, rule):
+            return martijn.createEvent(
+                dtstart=dtstart,
+                duration=timedelta(hours=1),
+                title="Meeting",
+                recurrence=rule,
+                attendees=[(room, 'REQ-PARTICIPANT', 'NEEDS-ACTION')])
+        weekly = book(datetime(2005, 4, 4, 10, 00),
+                      recurrent.WeeklyRecurrenceRule())
+        # first on a monday more than six years later
+        rare = book(datetime(2005, 4, 5, 10, 30),
+                    recurrent.DailyRecurrenceRule(interval=400))
+        self.assertEquals({'room': [weekly]},
+                          self._m.getConflicts(rare, [room]))
+        self._m.deleteEvent(rare)
+        # never on a monday
+        monthly = book(datetime(2005, 4, 12, 10, 00),
+                       recurrent.MonthlyRecurrenceRule(monthly='weekday'))
+        self.assertEquals({}, self._m.getConflicts(monthly, [room]))
+        self._m.deleteEvent(monthly)
+        # but on the 11th of some months
+        monthly = book(datetime(2005, 4, 11, 10, 00),
+                       recurrent.MonthlyRecurrenceRule(
+                           exceptions=[date(2005, 4, 11)]))
+        self.assertEquals({'room': [weekly]},
+                          self._m.getConflicts(monthly, [room]))
+
+    def test_mergeOccurrences(self):
+        first = [cal.Timed(datetime(2005, 4, day), None) for day in (1, 3)]
+        second = [cal.Timed(datetime(2005, 4, day), None)
+                  for day in (1, 2, 4)]
+        merged = list(cal.mergeOccurrences([first, [], second]))
+        self.assertEquals([1, 1, 2, 3, 4],
+                          [timed.dtstart.day for timed in merged])
+        self.assert_(merged[0] is first[0])
+        self.assert_(merged[1] is second[0])
+
+    def test_attendeeIndexes(self):
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting")
+        meeting.invite([guido])
+        storage = self._m._storage
+        sc = cal.SearchCriteria(attendees=[guido],
+                                participation_status='NEEDS-ACTION')
+        self.assertEquals(set([meeting.unique_id]),
+                          storage._getCandidateIds(sc, (None, None)))
+        meeting.setParticipationStatus(guido, 'ACCEPTED')
+        self.assertEquals(set(), storage._getCandidateIds(sc, (None, None)))
+        sc = cal.SearchCriteria(attendees=[guido],
+                                participation_status='ACCEPTED')
+        self.assertEquals([meeting], self._m.getEvents((None, None), sc))
+        meeting.setParticipationRole(guido, 'CHAIR')
+        sc = cal.SearchCriteria(attendees=[guido],
+                                participation_role='CHAIR')
+        self.assertEquals([meeting], self._m.getEvents((None, None), sc))
+        meeting.setParticipationStatus(guido, None)
+        self.assertEquals([], self._m.getEvents((None, None), sc))
+        self.assertEquals([], guido.getEvents((None, None)))
+
+    def test_participationIndexesOverridden(self):
+        # the hooks of implementations need not reindex
+        class StatusEvent(cal.Event):
+            def _setParticipationStatus(self, attendee, status):
+                self._participation_state[attendee.getAttendeeId()] = status
+        class StatusStorage(cal.MemoryStorage):
+            def _eventFactory(self, event_id, spec):
+                return StatusEvent(event_id, spec)
+        self._m.setStorage(StatusStorage('status'))
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting")
+        meeting.invite([guido])
+        self.assertEquals([meeting], guido.getEvents((None, None)))
+        meeting.setParticipationStatus(guido, 'ACCEPTED')
+        sc = cal.SearchCriteria(attendees=[guido],
+                                participation_status='ACCEPTED')
+        self.assertEquals([meeting], self._m.getEvents((None, None), sc))
+
+    def test_organizerIndex(self):
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting")
+        self.assertEquals([meeting], martijn.getOrganizedEvents())
+        self.assertEquals([], guido.getOrganizedEvents())
+        spec = cal.EventSpecification(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            organizer=guido)
+        spec.setOnObject(meeting)
+        self.assertEquals([], martijn.getOrganizedEvents())
+        self.assertEquals([meeting], guido.getOrganizedEvents())
+
+    def test_indexesWithoutNotification(self):
+        from calcore.events import EventModifiedEvent
+        from zope.event import notify
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting",
+            categories=['a'])
+        a = cal.SearchCriteria(categories=['a'])
+        b = cal.SearchCriteria(categories=['b'])
+        meeting.categories = set(['b'])
+        # events that do not match anymore are never returned, those
+        # that match now are only found once notified
+        self.assertEquals([], self._m.getEvents((None, None), a))
+        self.assertEquals([], self._m.getEvents((None, None), b))
+        notify(EventModifiedEvent(meeting))
+        self.assertEquals([meeting], self._m.getEvents((None, None), b))
+
+    def test_storageOfEvents(self):
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        storage = self._m._storage
+        meeting = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Martijn's Meeting")
+        self.assert_(meeting._getStorage() is storage)
+        # events kept elsewhere than their storage fail to reindex
+        del storage._events[meeting.unique_id]
+        self.assertRaises(ValueError, meeting.invite, [guido])
+        storage._events[meeting.unique_id] = meeting
+        self._m.deleteEvent(meeting)
+        self.assertEquals(None, meeting._getStorage())
+        meeting.invite([guido])
+        self.assertEquals([], guido.getEvents((None, None)))
+
+    def test_explain(self):
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        room = self._s.createRoom('room', 'Room')
+        for day in range(1, 29):
+            martijn.createEvent(
+                dtstart=datetime(2005, 2, day, 10, 00),
+                duration=timedelta(minutes=60),
+                title="Martijn's Meeting")
+        meeting = room.createEvent(
+            dtstart=datetime(2005, 2, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Room booking")
+        week = (datetime(2005, 2, 7), datetime(2005, 2, 14))
+        # the room has a single event, so its index is used first
+        sc = cal.SearchCriteria(attendees=[room])
+        report = self._m.explain(week, sc)
+        self.assertEquals(29, report['events'])
+        self.assertEquals(['attendee', 'period', 'match', 'expand'],
+                          report['plan'])
+        stages = report['stages']
+        self.assertEquals(1, stages[0]['estimate'])
+        self.assertEquals(1, stages[1]['candidates'])
+        self.assertEquals(8, stages[1]['estimate'])
+        self.assertEquals(1, stages[-1]['candidates'])
+        # martijn has many events, so the period comes first
+        sc = cal.SearchCriteria(attendees=[martijn])
+        report = self._m.explain(week, sc)
+        self.assertEquals(['period', 'attendee', 'match', 'expand'],
+                          report['plan'])
+        self.assertEquals(7, report['stages'][-1]['candidates'])
+        # without usable criteria nor period, everything is scanned
+        report = self._m.explain((None, None))
+        self.assertEquals(['scan'], report['plan'])
+        self.assertEquals(29, report['stages'][0]['candidates'])
+
+    def test_batch(self):
+        from zope.event import subscribers
+        from calcore.events import EventModifiedEvent
+        from calcore.interfaces import IEventEvent, IEventBatchEvent
+        notified = []
+        def subscriber(eventevent):
+            if (IEventEvent.providedBy(eventevent) or
+                IEventBatchEvent.providedBy(eventevent)):
+                notified.append(eventevent)
+        martijn = self._s.createIndividual('martijn', 'Martijn')
+        guido = self._s.createIndividual('guido', 'Guido')
+        old = martijn.createEvent(
+            dtstart=datetime(2005, 4, 10, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Old Meeting")
+        gone = martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 16, 00),
+            duration=timedelta(minutes=60),
+            title="Gone Meeting")
+        day = (datetime(2005, 4, 12), datetime(2005, 4, 13))
+        guidos = cal.SearchCriteria(attendees=[guido])
+        self._m.enableQueryCache()
+        self.assertEquals([], self._m.getEvents(day, guidos))
+        subscribers.append(subscriber)
+        try:
+            self._m.beginBatch()
+            new = martijn.createEvent(
+                dtstart=datetime(2005, 4, 12, 16, 00),
+                duration=timedelta(minutes=60),
+                title="New Meeting")
+            new.invite([guido])
+            self._m.notifyEvent(EventModifiedEvent(new))
+            old.dtstart = datetime(2005, 4, 12, 10, 00)
+            self._m.notifyEvent(EventModifiedEvent(old))
+            temporary = martijn.createEvent(
+                dtstart=datetime(2005, 4, 12, 16, 00),
+                duration=timedelta(minutes=60),
+                title="Temporary Meeting")
+            self._m.deleteEvent(temporary)
+            self._m.deleteEvent(gone)
+            # searches index the events changed so far, and are not
+            # cached, as notifications wait for the end of the batch
+            self.assertEquals([new], self._m.getEvents(day, guidos))
+            events = self._m.getEvents(
+                day, cal.SearchCriteria(attendees=[martijn]))
+            self.assertEquals(['New Meeting', 'Old Meeting'],
+                              sorted([event.title for event in events]))
+            # participation changes are kept for the batch too
+            self.assertEquals([], notified)
+            # batches nest
+            self._m.beginBatch()
+            self._m.commitBatch()
+            self.assertEquals([], notified)
+            self._m.commitBatch()
+        finally:
+            subscribers.remove(subscriber)
+        self.assertEquals(1, len(notified))
+        batchevent = notified[-1]
+        self.assert_(IEventBatchEvent.providedBy(batchevent))
+        self.assertEquals([new.unique_id], batchevent.created)
+        self.assertEquals([old.unique_id], batchevent.modified)
+        self.assertEquals([gone.unique_id], batchevent.deleted)
+        self.assert_(batchevent.events[temporary.unique_id] is temporary)
+        # events are indexed and the cached result dropped
+        self.assertEquals([new], self._m.getEvents(day, guidos))
+        events = self._m.getEvents(
+            day, cal.SearchCriteria(attendees=[martijn]))
+        self.assertEquals(['New Meeting', 'Old Meeting'],
+                          sorted([event.title for event in events]))
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTests([unittest.makeSuite(CalTestCase)])
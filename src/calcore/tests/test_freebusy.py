@@ -0,0 +1,92 @@
+import unittest
+from datetime import datetime, timedelta, time
+
+from calcore import cal, recurrent
+from calcore.freebusy import FreeBusyMap
+
+class FreeBusyMapTestCase(unittest.TestCase):
+
+    def test_addBusy(self):
+        freebusy = FreeBusyMap((datetime(2005, 4, 11), datetime(2005, 4, 12)),
+                               timedelta(hours=1))
+        freebusy.addBusy('martijn', (datetime(2005, 4, 11, 9, 30),
+                                     datetime(2005, 4, 11, 11, 0)))
+        freebusy.addBusy('guido', (datetime(2005, 4, 11, 23, 0),
+                                   datetime(2005, 4, 12, 2, 0)))
+        freebusy.addBusy('guido', (datetime(2005, 4, 10, 23, 0),
+                                   datetime(2005, 4, 11, 1, 0)))
+        # empty and outside the period
+        freebusy.addBusy('guido', (datetime(2005, 4, 11, 12, 0),
+                                   datetime(2005, 4, 11, 12, 0)))
+        freebusy.addBusy('guido', (datetime(2005, 4, 12, 3, 0),
+                                   datetime(2005, 4, 12, 4, 0)))
+        self.assertEquals(0x600, freebusy.getBusy(['martijn']))
+        self.assertEquals(0x800001, freebusy.getBusy(['guido']))
+        self.assertEquals(0x800601, freebusy.getBusy(['martijn', 'guido']))
+        self.assertEquals(0, freebusy.getBusy(['tim']))
+
+    def test_getWorkingHours(self):
+        freebusy = FreeBusyMap((datetime(2005, 4, 11, 12, 0),
+                                datetime(2005, 4, 12, 12, 0)),
+                               timedelta(hours=1))
+        # 12:00-17:00 on the first day, 9:00-12:00 on the second
+        self.assertEquals(0xe0001f,
+                          freebusy.getWorkingHours((time(9, 0),
+                                                    time(17, 0))))
+
+    def test_getFreePeriods(self):
+        freebusy = FreeBusyMap((datetime(2005, 4, 11), datetime(2005, 4, 13)),
+                               timedelta(minutes=15))
+        freebusy.addBusy('martijn', (datetime(2005, 4, 11, 10, 0),
+                                     datetime(2005, 4, 11, 10, 50)))
+        freebusy.addBusy('guido', (datetime(2005, 4, 11, 16, 0),
+                                   datetime(2005, 4, 12, 10, 0)))
+        time_period = (time(9, 0), time(17, 0))
+        self.assertEquals(
+            [(datetime(2005, 4, 11, 9, 0), datetime(2005, 4, 11, 10, 0)),
+             (datetime(2005, 4, 11, 11, 0), datetime(2005, 4, 11, 16, 0)),
+             (datetime(2005, 4, 12, 10, 0), datetime(2005, 4, 12, 17, 0))],
+            freebusy.getFreePeriods(['martijn', 'guido'], time_period))
+        self.assertEquals(
+            [(datetime(2005, 4, 11, 11, 0), datetime(2005, 4, 11, 16, 0)),
+             (datetime(2005, 4, 12, 10, 0), datetime(2005, 4, 12, 17, 0))],
+            freebusy.getFreePeriods(['martijn', 'guido'], time_period,
+                                    timedelta(hours=2)))
+        self.assertEquals([], freebusy.getFreePeriods(
+            ['martijn'], time_period, timedelta(hours=9)))
+
+    def test_compareWithBlockedPeriods(self):
+        m = cal.StorageManager()
+        m.setStorage(cal.MemoryStorage('storage'))
+        s = cal.SimpleAttendeeSource(m)
+        martijn = s.createIndividual('martijn', 'Martijn')
+        guido = s.createIndividual('guido', 'Guido')
+        martijn.createEvent(
+            dtstart=datetime(2005, 4, 11, 10, 30),
+            duration=timedelta(hours=26),
+            title="Long Meeting")
+        meeting = guido.createEvent(
+            dtstart=datetime(2005, 4, 10, 8, 0),
+            duration=timedelta(hours=2),
+            title="Standup",
+            recurrence=recurrent.DailyRecurrenceRule(interval=2))
+        meeting.invite([martijn])
+        meeting.setParticipationStatus(martijn, 'DECLINED')
+        period = (datetime(2005, 4, 10), datetime(2005, 4, 17))
+        time_period = (time(9, 0), time(18, 0))
+        for attendees in [martijn], [guido], [martijn, guido]:
+            for minimal_duration in None, timedelta(hours=3):
+                self.assertEquals(
+                    m.getFreePeriods(attendees, period, time_period,
+                                     minimal_duration),
+                    m.getFreePeriods(attendees, period, time_period,
+                                     minimal_duration,
+                                     granularity=timedelta(minutes=30)))
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests([unittest.makeSuite(FreeBusyMapTestCase)])
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
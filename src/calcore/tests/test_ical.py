@@ -400,6 +400,174 @@ END:VEVENT"""
             'CONFIDENTIAL',
             self._calendar.getEvent(self._meeting_uid).access)
 
+    def test_importFrom(self):
+        from StringIO import StringIO
+        text = self._calendar.export()
+        text = text.replace("SUMMARY:Martijn's Meeting",
+                            "SUMMARY:Martijn's\r\n  Long \r\n\tMeeting")
+        # line endings are repaired as well
+        text = text.replace('\r\n', '\n')
+        read = []
+        self._calendar.importFrom(StringIO(text), progress=read.append)
+        self.assertEquals([1, 2], read)
+        self.assertEquals(
+            "Martijn's Long Meeting",
+            self._calendar.getEvent(self._meeting_uid).title)
+        self.assertEquals(
+            'Another meeting',
+            self._calendar.getEvent(self._meeting2_uid).title)
+
+    def test_importFromNested(self):
+        from StringIO import StringIO
+        text = self._calendar.export()
+        text = insert_lines_textually(text, 'BEGIN:VEVENT\r\n', [
+            'BEGIN:VALARM',
+            'ACTION:DISPLAY',
+            'DESCRIPTION:Reminder',
+            'TRIGGER:-PT15M',
+            'END:VALARM'])
+        text = text.replace('Room 1', 'Room 3').replace('Room 2', 'Room 3')
+        self._calendar.importFrom(StringIO(text))
+        self.assertEquals(
+            'Room 3', self._calendar.getEvent(self._meeting_uid).location)
+        self.assertEquals(
+            'Room 3', self._calendar.getEvent(self._meeting2_uid).location)
+
+    def test_import_bulk(self):
+        from zope.event import subscribers
+        from calcore.interfaces import IEventEvent, IEventBatchEvent
+        notified = []
+        def subscriber(eventevent):
+            if (IEventEvent.providedBy(eventevent) or
+                IEventBatchEvent.providedBy(eventevent)):
+                notified.append(eventevent)
+        text = self._calendar.export()
+        text = text.replace('Room 1', 'Room 3')
+        i = text.find('UID:' + self._meeting2_uid)
+        text = text[:i] + 'UID:dag' + text[text.find('\r\n', i):]
+        subscribers.append(subscriber)
+        try:
+            self._calendar.import_(text, synchronize=1, bulk=True)
+        finally:
+            subscribers.remove(subscriber)
+        self.assertEquals(1, len(notified))
+        batchevent = notified[0]
+        self.assert_(IEventBatchEvent.providedBy(batchevent))
+        self.assertEquals(['dag'], batchevent.created)
+        self.assertEquals([self._meeting_uid], batchevent.modified)
+        self.assertEquals([self._meeting2_uid], batchevent.deleted)
+        self.assertEquals(
+            'Room 3', self._calendar.getEvent(self._meeting_uid).location)
+        self.assertEquals(
+            ['dag'],
+            [event.unique_id for event in self._m.getEvents(
+            (datetime(2005, 4, 11), datetime(2005, 4, 12)))])
+
+    def test_exportTo(self):
+        from StringIO import StringIO
+        text = self._calendar.export()
+        stream = StringIO()
+        self._calendar.exportTo(stream)
+        self.assertEquals(text, stream.getvalue())
+        chunks = list(self._calendar.iterExport())
+        self.assertEquals(4, len(chunks))
+        self.assert_(chunks[0].startswith('BEGIN:VCALENDAR\r\n'))
+        self.assert_(chunks[1].startswith('BEGIN:VEVENT\r\n'))
+        self.assertEquals('END:VCALENDAR\r\n', chunks[-1])
+        # only the events asked for are exported
+        stream = StringIO()
+        self._calendar.exportTo(
+            stream, (datetime(2005, 4, 11), datetime(2005, 4, 12)))
+        self.assertEquals(1, stream.getvalue().count('BEGIN:VEVENT'))
+        self.assert_('Another meeting' in stream.getvalue())
+
+    def test_import_unchanged(self):
+        from calcore.events import EventModifiedEvent
+        from zope.event import notify
+        imported = []
+        def importExistingEvent(uid, fields):
+            imported.append(uid)
+            cal.Calendar._importExistingEvent(self._calendar, uid, fields)
+        self._calendar._importExistingEvent = importExistingEvent
+        self._calendar.import_(self._calendar.export())
+        self.assertEquals(2, len(imported))
+        text = self._calendar.export()
+        # events imported from the same data are skipped
+        del imported[:]
+        self._calendar.import_(text)
+        self.assertEquals([], imported)
+        text = text.replace('Room 1', 'Room 3')
+        self._calendar.import_(text)
+        self.assertEquals([self._meeting_uid], imported)
+        # events changed since are imported again
+        del imported[:]
+        meeting2 = self._calendar.getEvent(self._meeting2_uid)
+        meeting2.title = 'Changed'
+        notify(EventModifiedEvent(meeting2))
+        self._calendar.import_(text)
+        self.assertEquals([self._meeting2_uid], imported)
+        self.assertEquals('Another meeting', meeting2.title)
+        # also without notification
+        del imported[:]
+        meeting2.title = 'Changed'
+        self._calendar.import_(text)
+        self.assertEquals([self._meeting2_uid], imported)
+        self.assertEquals('Another meeting', meeting2.title)
+
+    def test_import_processes(self):
+        text = self._calendar.export()
+        text = text.replace('Room 1', 'Room 3')
+        i = text.find('UID:' + self._meeting2_uid)
+        text = text[:i] + 'UID:dag' + text[text.find('\r\n', i):]
+        self._calendar.import_(text, synchronize=1, processes=2)
+        self.assertEquals(
+            'Room 3', self._calendar.getEvent(self._meeting_uid).location)
+        self.assert_(not self._calendar.hasEvent(self._meeting2_uid))
+        dag = self._calendar.getEvent('dag')
+        self.assertEquals('Another meeting', dag.title)
+        self.assertEquals(Set(['Public Holiday', 'Wonderful Event']),
+                          dag.categories)
+
+    def test_import_pool(self):
+        from multiprocessing import Pool
+        text = self._calendar.export()
+        pool = Pool(2)
+        try:
+            self._calendar.import_(text.replace('Room 1', 'Room 3'),
+                                   pool=pool)
+            meeting = self._calendar.getEvent(self._meeting_uid)
+            self.assertEquals('Room 3', meeting.location)
+            # the pool is still there for the next import
+            self._calendar.import_(text, pool=pool)
+            self.assertEquals('Room 1', meeting.location)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def test_import_hooks(self):
+        class LocatedCalendar(cal.Calendar):
+            def _importEventSpecification(self, e):
+                spec = cal.Calendar._importEventSpecification(self, e)
+                spec.location = e.decoded('LOCATION', '').upper()
+                return spec
+        calendar = LocatedCalendar(self._m, self._s)
+        calendar.addAttendee(self._s.getAttendee('martijn'))
+        text = self._calendar.export()
+        calendar.import_(text.replace('Room 1', 'Room 3'))
+        meeting = calendar.getEvent(self._meeting_uid)
+        self.assertEquals('ROOM 3', meeting.location)
+
+    def test_import_incomplete(self):
+        text = self._calendar.export()
+        text = text[:text.rfind('END:VEVENT')]
+        self.assertRaises(ValueError, self._calendar.import_, text,
+                          synchronize=1)
+        self.assert_(self._calendar.hasEvent(self._meeting_uid))
+        self.assert_(self._calendar.hasEvent(self._meeting2_uid))
+        self.assertRaises(ValueError, self._calendar.import_, '',
+                          synchronize=1)
+        self.assert_(self._calendar.hasEvent(self._meeting_uid))
+
 class RecurrentImportExportTestCase(unittest.TestCase):
     def setUp(self):
         self._m = cal.StorageManager()
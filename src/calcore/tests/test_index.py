@@ -0,0 +1,180 @@
+import unittest
+import pickle
+from random import Random
+
+from calcore import index
+
+class PeriodIndexTestCase(unittest.TestCase):
+
+    def test_search(self):
+        i = index.PeriodIndex()
+        i.index('a', (1, 5))
+        i.index('b', (3, 4))
+        i.index('c', (6, 8))
+        self.assertEquals(['a', 'b'], i.search((2, 6)))
+        self.assertEquals(['a', 'b', 'c'], i.search((None, None)))
+        self.assertEquals(['c'], i.search((5, None)))
+        self.assertEquals(['a'], i.search((None, 3)))
+
+    def test_searchHalfOpen(self):
+        i = index.PeriodIndex()
+        i.index('a', (1, 5))
+        self.assertEquals([], i.search((5, 10)))
+        self.assertEquals([], i.search((0, 1)))
+        self.assertEquals(['a'], i.search((4, 10)))
+
+    def test_reindex(self):
+        i = index.PeriodIndex()
+        i.index('a', (1, 5))
+        i.index('a', (10, 12))
+        self.assertEquals(1, len(i))
+        self.assertEquals([], i.search((2, 6)))
+        self.assertEquals(['a'], i.search((11, 20)))
+        self.assertEquals((10, 12), i.getPeriod('a'))
+
+    def test_unindex(self):
+        i = index.PeriodIndex()
+        i.index('a', (1, 5))
+        i.index('b', (1, 5))
+        i.unindex('a')
+        i.unindex('unknown')
+        self.assertEquals(['b'], i.search((None, None)))
+        self.assert_(not i.has_key('a'))
+
+    def test_countAndFilter(self):
+        i = index.PeriodIndex()
+        i.index('a', (1, 5))
+        i.index('b', (3, 4))
+        i.index('c', (6, 8))
+        self.assertEquals(2, i.count((2, 6)))
+        self.assertEquals(3, i.count((None, None)))
+        self.assertEquals(1, i.count((5, None)))
+        self.assertEquals(0, i.count((8, 10)))
+        self.assertEquals(['a', 'c'], i.filter(['a', 'c'], (4, 7)))
+        self.assertEquals(['c'], i.filter(['a', 'b', 'c'], (5, 7)))
+
+    def test_compareWithScan(self):
+        rand = Random(42)
+        i = index.PeriodIndex()
+        periods = {}
+        for n in range(500):
+            start = rand.randint(0, 1000)
+            end = start + rand.randint(0, 100)
+            periods[n] = (start, end)
+            i.index(n, (start, end))
+        for n in range(0, 500, 3):
+            del periods[n]
+            i.unindex(n)
+        for begins in range(0, 1100, 37):
+            ends = begins + 20
+            expected = [key for key, (start, end) in periods.items()
+                        if start < ends and end > begins]
+            result = i.search((begins, ends))
+            expected.sort()
+            result.sort()
+            self.assertEquals(expected, result)
+            self.assertEquals(len(expected), i.count((begins, ends)))
+        self.assertEquals(len(periods), len(i))
+        i.clear()
+        self.assertEquals(0, len(i))
+        self.assertEquals([], i.search((None, None)))
+
+    def test_pickle(self):
+        i = index.PeriodIndex()
+        i.index('a', (1, 5))
+        i.index('b', (3, 4))
+        i.index('c', (6, 8))
+        for protocol in (0, 1, 2):
+            copy = pickle.loads(pickle.dumps(i, protocol))
+            self.assertEquals(['a', 'b'], copy.search((2, 6)))
+            copy.unindex('a')
+            self.assertEquals(['b'], copy.search((2, 6)))
+
+class KeywordIndexTestCase(unittest.TestCase):
+
+    def test_search(self):
+        i = index.KeywordIndex()
+        i.index('a', ['x', 'y'])
+        i.index('b', ['y'])
+        self.assertEquals(set(['a']), set(i.search('x')))
+        self.assertEquals(set(['a', 'b']), set(i.search('y')))
+        self.assertEquals(set(), set(i.search('z')))
+        self.assertEquals(2, i.count('y'))
+
+    def test_reindex(self):
+        i = index.KeywordIndex()
+        i.index('a', ['x', 'y'])
+        i.index('a', ['y', 'z'])
+        self.assertEquals(set(), set(i.search('x')))
+        self.assertEquals(set(['a']), set(i.search('z')))
+        self.assertEquals(frozenset(['y', 'z']), i.getValues('a'))
+
+    def test_searchAny(self):
+        i = index.KeywordIndex()
+        i.index('a', ['x', 'y'])
+        i.index('b', ['y'])
+        i.index('c', ['z'])
+        self.assertEquals(set(['a', 'c']), i.searchAny(['x', 'z']))
+        self.assertEquals(3, i.countAny(['x', 'y']))
+        self.assertEquals(['b', 'c'], i.filterAny(['b', 'c'], ['y', 'z']))
+
+    def test_unindex(self):
+        i = index.KeywordIndex()
+        i.index('a', ['x'])
+        i.unindex('a')
+        i.unindex('unknown')
+        self.assertEquals(0, len(i))
+        self.assertEquals(0, i.count('x'))
+        i.index('b', ['x'])
+        i.clear()
+        self.assertEquals(0, len(i))
+        self.assertEquals(0, i.count('x'))
+
+class KeywordPeriodIndexTestCase(unittest.TestCase):
+
+    def test_search(self):
+        i = index.KeywordPeriodIndex()
+        i.index('a', ((1, 5), ['x', 'y']))
+        i.index('b', ((4, 8), ['x']))
+        i.index('c', ((6, 9), []))
+        self.assertEquals(2, len(i))
+        self.assertEquals(['a', 'b'], i.search('x', (3, 6)))
+        self.assertEquals(['b'], i.search('x', (5, 6)))
+        self.assertEquals(['a'], i.search('y', (0, 2)))
+        self.assertEquals([], i.search('y', (5, 6)))
+        self.assertEquals([], i.search('z', (0, 10)))
+        self.assertEquals(2, i.count('x', (3, 6)))
+        self.assertEquals(0, i.count('z', (3, 6)))
+
+    def test_reindex(self):
+        i = index.KeywordPeriodIndex()
+        i.index('a', ((1, 5), ['x', 'y']))
+        i.index('a', ((6, 7), ['y', 'z']))
+        self.assertEquals([], i.search('x', (0, 10)))
+        self.assertEquals([], i.search('y', (1, 5)))
+        self.assertEquals(['a'], i.search('y', (6, 7)))
+        self.assertEquals(['a'], i.search('z', (6, 7)))
+        i.unindex('a')
+        i.unindex('unknown')
+        self.assertEquals(0, len(i))
+        self.assertEquals([], i.search('y', (0, 10)))
+
+    def test_pickle(self):
+        i = index.KeywordPeriodIndex()
+        i.index('a', ((1, 5), ['x', 'y']))
+        i.index('b', ((4, 8), ['x']))
+        for protocol in (0, 1, 2):
+            copy = pickle.loads(pickle.dumps(i, protocol))
+            self.assertEquals(['a', 'b'], copy.search('x', (3, 6)))
+            copy.unindex('a')
+            self.assertEquals(['b'], copy.search('x', (3, 6)))
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests([unittest.makeSuite(PeriodIndexTestCase)])
+    suite.addTests([unittest.makeSuite(KeywordIndexTestCase)])
+    suite.addTests([unittest.makeSuite(KeywordPeriodIndexTestCase)])
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,70 @@
+import unittest
+
+from calcore.intervalset import IntervalSet, merge
+
+class IntervalSetTestCase(unittest.TestCase):
+
+    def test_coalesce(self):
+        self.assertEquals(
+            [(1, 4), (5, 8)],
+            IntervalSet([(5, 6), (1, 3), (2, 4), (6, 8), (7, 7)]).getPeriods())
+        self.assertEquals([], IntervalSet().getPeriods())
+        self.assertEquals([(1, 3)], list(IntervalSet([(1, 3), (3, 3)])))
+
+    def test_union(self):
+        a = IntervalSet([(1, 3), (6, 8)])
+        self.assertEquals(
+            IntervalSet([(1, 4), (5, 9)]),
+            a.union([(2, 4), (5, 7), (7, 9)]))
+        self.assertEquals(a, a.union(IntervalSet()))
+
+    def test_intersection(self):
+        a = IntervalSet([(1, 5), (7, 10)])
+        self.assertEquals(
+            [(2, 3), (4, 5), (7, 8), (9, 10)],
+            a.intersection([(2, 3), (4, 8), (9, 12)]).getPeriods())
+        self.assertEquals([], a.intersection([(5, 7)]).getPeriods())
+
+    def test_difference(self):
+        a = IntervalSet([(1, 5), (7, 10)])
+        self.assertEquals(
+            [(1, 2), (3, 4), (8, 9)],
+            a.difference([(2, 3), (4, 8), (9, 12)]).getPeriods())
+        self.assertEquals(a, a.difference([(5, 7), (10, 11)]))
+        self.assertEquals([], a.difference([(0, 11)]).getPeriods())
+
+    def test_complement(self):
+        a = IntervalSet([(1, 3), (5, 6)])
+        self.assertEquals([(0, 1), (3, 5), (6, 10)],
+                          a.complement((0, 10)).getPeriods())
+        self.assertEquals([(3, 4)], a.complement((2, 4)).getPeriods())
+        self.assertEquals([], a.complement((1, 3)).getPeriods())
+
+    def test_window(self):
+        a = IntervalSet([(1, 3), (5, 6), (8, 12)])
+        self.assertEquals([(2, 3), (5, 6), (8, 9)],
+                          a.window((2, 9)).getPeriods())
+        self.assertEquals([], a.window((3, 5)).getPeriods())
+
+    def test_overlaps(self):
+        a = IntervalSet([(1, 3), (5, 6)])
+        self.assert_(a.overlaps((2, 4)))
+        self.assert_(a.overlaps((0, 10)))
+        self.assert_(a.overlaps((5, 6)))
+        self.failIf(a.overlaps((3, 5)))
+        self.failIf(a.overlaps((6, 9)))
+        self.failIf(IntervalSet().overlaps((0, 1)))
+
+    def test_merge(self):
+        self.assertEquals(
+            [(1, 4), (5, 9)],
+            merge([IntervalSet([(1, 2), (6, 7)]), [(2, 4), (8, 9)],
+                   iter([(5, 6), (7, 8)])]).getPeriods())
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests([unittest.makeSuite(IntervalSetTestCase)])
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -1,6 +1,8 @@
 import unittest
 import doctest
 
+from datetime import date, datetime, timedelta
+
 from zope.interface import verify
 
 from calcore import recurrent
@@ -40,7 +42,130 @@ def doctest_interfaces():
         True
     """
 
+class FakeEvent:
+    def __init__(self, dtstart):
+        self.dtstart = dtstart
+
+class SeekTestCase(unittest.TestCase):
+
+    def assertSeeks(self, rule, dtstart, enddate, period_starts):
+        event = FakeEvent(dtstart)
+        dates = list(rule.apply(event, enddate))
+        for period_start in period_starts:
+            self.assertEquals(
+                [d for d in dates if d >= period_start],
+                list(rule.apply(event, enddate, period_start)))
+
+    def period_starts(self, start, days=800, step=11):
+        return [start + timedelta(i) for i in range(-3, days, step)]
+
+    def test_daily(self):
+        start = datetime(2005, 3, 1, 10, 0)
+        for rule in [recurrent.DailyRecurrenceRule(),
+                     recurrent.DailyRecurrenceRule(interval=3, count=50),
+                     recurrent.DailyRecurrenceRule(
+                         interval=2, until=date(2006, 1, 1),
+                         exceptions=[date(2005, 3, 5)])]:
+            self.assertSeeks(rule, start, date(2007, 1, 1),
+                             self.period_starts(start.date()))
+
+    def test_weekly(self):
+        start = datetime(2005, 3, 2, 10, 0)
+        for rule in [recurrent.WeeklyRecurrenceRule(),
+                     recurrent.WeeklyRecurrenceRule(
+                         interval=3, count=40, weekdays=[0, 4, 6]),
+                     recurrent.WeeklyRecurrenceRule(
+                         interval=2, weekdays=[1],
+                         exceptions=[date(2005, 3, 16)])]:
+            self.assertSeeks(rule, start, date(2007, 1, 1),
+                             self.period_starts(start.date(), step=5))
+
+    def test_monthly(self):
+        for start in [datetime(2005, 3, 2, 10, 0),
+                      datetime(2004, 1, 29, 10, 0),
+                      datetime(2005, 1, 31, 10, 0),
+                      datetime(2005, 3, 30, 10, 0)]:
+            for monthly in ['monthday', 'weekday', 'lastweekday']:
+                for rule in [
+                    recurrent.MonthlyRecurrenceRule(monthly=monthly),
+                    recurrent.MonthlyRecurrenceRule(
+                        interval=5, count=20, monthly=monthly),
+                    recurrent.MonthlyRecurrenceRule(
+                        interval=7, count=30, monthly=monthly)]:
+                    self.assertSeeks(rule, start, date(2012, 1, 1),
+                                     self.period_starts(start.date(), 2500, 31))
+
+    def test_yearly(self):
+        start = datetime(2005, 3, 2, 10, 0)
+        for rule in [recurrent.YearlyRecurrenceRule(),
+                     recurrent.YearlyRecurrenceRule(interval=2, count=5)]:
+            self.assertSeeks(rule, start, date(2020, 1, 1),
+                             self.period_starts(start.date(), 5000, 97))
+
+class OrdinalTestCase(unittest.TestCase):
+
+    def test_firstordinal(self):
+        for year in range(1899, 2102):
+            for month in range(1, 13):
+                self.assertEquals(date(year, month, 1).toordinal(),
+                                  recurrent.firstordinal(year, month))
+
+    def test_monthindex(self):
+        for year, month in [(2004, 2), (2005, 2), (2005, 12), (2006, 1)]:
+            days = [date(year, month, day) for day in range(1, 29)]
+            for weekday in range(7):
+                matching = [d for d in days if d.weekday() == weekday]
+                self.assertEquals(
+                    matching[0],
+                    recurrent.monthindex(year, month, 1, weekday))
+                self.assertEquals(
+                    matching[2],
+                    recurrent.monthindex(year, month, 3, weekday))
+
+    def test_weekly(self):
+        # every other week on monday and wednesday, starting on a thursday
+        rule = recurrent.WeeklyRecurrenceRule(
+            interval=2, count=5, weekdays=[0, 2],
+            exceptions=[date(2005, 3, 14)])
+        event = FakeEvent(datetime(2005, 3, 3, 10, 0))
+        self.assertEquals(
+            [date(2005, 3, 3), date(2005, 3, 16),
+             date(2005, 3, 17), date(2005, 3, 28)],
+            list(rule.apply(event)))
+
+class LastDateTestCase(unittest.TestCase):
+
+    def test_lastDate(self):
+        start = date(2005, 1, 31)
+        event = FakeEvent(datetime(2005, 1, 31, 10, 0))
+        rules = [recurrent.DailyRecurrenceRule(interval=3, count=10),
+                 recurrent.WeeklyRecurrenceRule(count=10, weekdays=[1, 4]),
+                 recurrent.MonthlyRecurrenceRule(count=10),
+                 recurrent.MonthlyRecurrenceRule(count=10,
+                                                 monthly='lastweekday'),
+                 recurrent.YearlyRecurrenceRule(interval=2, count=3),
+                 recurrent.NoRecurrenceRule()]
+        for rule in rules:
+            self.assertEquals(list(rule.apply(event))[-1],
+                              rule.getLastDate(start))
+
+    def test_untilAndForever(self):
+        start = date(2005, 1, 31)
+        rule = recurrent.DailyRecurrenceRule(until=date(2005, 3, 1))
+        self.assertEquals(date(2005, 3, 1), rule.getLastDate(start))
+        rule = recurrent.DailyRecurrenceRule(
+            until=datetime(2005, 3, 1, 12, 0))
+        self.assertEquals(date(2005, 3, 1), rule.getLastDate(start))
+        rule = recurrent.WeeklyRecurrenceRule()
+        self.assertEquals(None, rule.getLastDate(start))
+        # too far away to compute
+        rule = recurrent.DailyRecurrenceRule(count=10000000)
+        self.assertEquals(None, rule.getLastDate(start))
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTests([doctest.DocTestSuite()])
+    suite.addTests([unittest.makeSuite(SeekTestCase)])
+    suite.addTests([unittest.makeSuite(OrdinalTestCase)])
+    suite.addTests([unittest.makeSuite(LastDateTestCase)])
     return suite